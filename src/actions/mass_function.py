@@ -7,6 +7,7 @@ from src.actions.base import BaseAction
 from src.calc import mass_function
 from src.fitting import fits
 from src.plotting import Plotter
+from src.util import parallel
 
 
 class MassFunctionActions(BaseAction):
@@ -22,8 +23,14 @@ class MassFunctionActions(BaseAction):
         ds = self.dataset_cache.load(hf)
         z = ds.current_redshift
 
+        # Fill the sphere samples for all the radii in one sampling pass
+        if self.config.tasks.mass_function and self.config.sampling.multi_radius:
+            logger.info("Sampling spheres for all radii...")
+            mf.sample_radii(hf, self.config.radii, z)
+
         # Iterate over the radii to sample for
-        for radius in yt.parallel_objects(self.config.radii):
+        for radius in yt.parallel_objects(
+                self.config.radii, njobs=parallel.njobs(self.config)):
 
             # =================================================================
             # MASS FUNCTION:
@@ -31,10 +38,9 @@ class MassFunctionActions(BaseAction):
             if self.config.tasks.mass_function:
                 logger.info("Working on mass function:")
 
-                mass_hist, bin_edges = mf.mass_function(hf, radius)
+                hist = mf.mass_function(hf, radius)
 
-                plotter.mass_function(
-                    z, radius, mass_hist, bin_edges, self.sim_name)
+                plotter.mass_function(z, radius, hist, self.sim_name)
 
             else:
                 logger.info("Skipping calculating mass function...")
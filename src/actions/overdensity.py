@@ -7,6 +7,7 @@ from src.actions.base import BaseAction
 from src.calc import overdensity, std_dev
 from src.fitting import fits
 from src.plotting import Plotter
+from src.util import parallel
 
 
 class OverdensityActions(BaseAction):
@@ -27,8 +28,17 @@ class OverdensityActions(BaseAction):
         # Get the number of samples needed
         num_sphere_samples = self.config.sampling.num_sp_samples
 
+        # Fill the sphere samples for all the radii in one sampling pass,
+        # unless each radius only samples until its std dev converges
+        if self.config.tasks.overdensity and self.config.sampling.multi_radius \
+                and not od.uses_density_field() \
+                and not self.config.sampling.converge_std_dev:
+            logger.info("Sampling spheres for all radii...")
+            od.sample_radii(hf, self.config.radii, z)
+
         # Iterate over the radii to sample for
-        for radius in yt.parallel_objects(self.config.radii):
+        for radius in yt.parallel_objects(
+                self.config.radii, njobs=parallel.njobs(self.config)):
 
             # Use the number of samples required to converge in new calculation
             # if we don't want to override the old values
@@ -55,12 +65,24 @@ class OverdensityActions(BaseAction):
                 deltas = od.calc_overdensities(hf, radius)
 
                 # Truncate the lists to the desired number of values
-                # if there are too many
-                deltas = deltas[:num_sphere_samples]
+                # if there are too many, the density field gives a value
+                # per mesh cell which are all kept
+                if not od.uses_density_field():
+                    deltas = deltas[:num_sphere_samples]
+
+                # Extrapolating can sample the data sets, which needs every
+                # rank sharing the work, so only the plotting is left to
+                # the root
+                extrapolated_sigma = sd.extrapolate(
+                    self.config.from_z, z, radius)
 
             else:
                 logger.info("Skipping calculating overdensities...")
 
+            # Only the root rank plots
+            if not parallel.is_root():
+                continue
+
             # =========================================================
             # STANDALONE OVERDENSITY PLOT:
             # =========================================================
@@ -129,7 +151,6 @@ class OverdensityActions(BaseAction):
 
                 # Extrapolated
                 A, mu, sigma = gauss_popt
-                extrapolated_sigma = sd.extrapolate(self.config.from_z, z, radius)
 
                 fig = plotter.gaussian(
                     A, mu, extrapolated_sigma, self.config.sampling.num_hist_bins, fig=fig)
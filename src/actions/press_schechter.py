@@ -7,6 +7,7 @@ from src.actions.base import BaseAction
 from src.calc import mass_function, overdensity, press_schechter, rho_bar
 from src.fitting import fits
 from src.plotting import Plotter
+from src.util import parallel
 
 
 class PressSchechterActions(BaseAction):
@@ -29,10 +30,9 @@ class PressSchechterActions(BaseAction):
         if self.config.tasks.total_mass_function:
             logger.info("Calculating total mass function...")
 
-            total_hist, total_bins = mf.total_mass_function(hf)
-            if total_hist is not None and total_bins is not None:
-                plotter.total_mass_function(
-                    z, total_hist, total_bins, self.sim_name)
+            total = mf.total_mass_function(hf)
+            if total is not None:
+                plotter.total_mass_function(z, total, self.sim_name)
 
         else:
             logger.info("Skipping calculating total mass function...")
@@ -57,13 +57,17 @@ class PressSchechterActions(BaseAction):
         # =============================================================
         # PRESS SCHECHTER - TOTAL COMPARISON
         # =============================================================
+        # Only the root rank plots
+        if not parallel.is_root():
+            return
+
         if self.config.tasks.total_mass_function and self.config.tasks.press_schechter_mass_function:
             logger.info("Plotting PS - total mass function comparison...")
 
-            all_mass = mf.cache_total_mass_function(hf)
-
-            plotter.press_schechter_total_comparison(
-                z, masses, all_mass, ps_fit, self.sim_name)
+            total = mf.total_mass_function(hf)
+            if total is not None:
+                plotter.press_schechter_total_comparison(
+                    z, total, masses, ps_fit, self.sim_name)
 
         else:
             logger.info("Skipping comparing mass function plots...")
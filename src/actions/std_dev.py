@@ -5,6 +5,7 @@ import logging.config
 import yt
 from src.actions.base import BaseAction
 from src.calc import std_dev
+from src.util import parallel
 
 
 class StdDevActions(BaseAction):
@@ -18,7 +19,8 @@ class StdDevActions(BaseAction):
             self, self.type, self.sim_name)
 
         # Iterate over the radii to sample for
-        for radius in yt.parallel_objects(self.config.radii):
+        for radius in yt.parallel_objects(
+                self.config.radii, njobs=parallel.njobs(self.config)):
 
             # =================================================================
             # STANDARD DEVIATION
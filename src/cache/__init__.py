@@ -1 +1,2 @@
-from src.cache import caching, dataset  # noqa: F401
+from src.cache import (backends, caching, columns, dataset, halo_index,  # noqa: F401
+                       projection, ragged)
@@ -0,0 +1,427 @@
+import hashlib
+import logging
+import os
+import pickle
+import time
+from typing import Dict, Set, Tuple
+
+import h5py
+import numpy as np
+import unyt
+from unyt.unit_registry import UnitRegistry
+
+# Name of the dataset each value is stored as within the group of its key,
+# so that keys can be nested within other keys
+VALUE_NAME = "__val__"
+# Group the unit registries of the stored unyt arrays are shared in
+REGISTRIES_GROUP = "__registries__"
+
+KIND_ATTR = "kind"
+UNITS_ATTR = "units"
+REGISTRY_ATTR = "unit_registry"
+
+ARRAY_KIND = "array"
+PICKLE_KIND = "pickle"
+
+
+class PickleBackend:
+    """
+    Stores each cache entry as its own pickle file, in a directory tree
+    mirroring the entry's keys
+    """
+
+    def __init__(self, caches_dir: str):
+        self._dir = caches_dir
+
+    def _compile_path(self, keys: tuple) -> str:
+        fname = "/".join(str(k) for k in keys) + ".pickle"
+
+        return os.path.join(self._dir, fname)
+
+    def load(self, keys: tuple):
+        logger = logging.getLogger(
+            __name__ + "." + PickleBackend.__name__ + "." + self.load.__name__)
+
+        pth = self._compile_path(keys)
+        if not os.path.exists(pth):
+            logger.debug(f"Cache doesn't exist for '{pth}'!")
+            return None
+
+        logger.debug(f"Opening existing cache at '{pth}'")
+        with open(pth, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, keys: tuple, val):
+        logger = logging.getLogger(
+            __name__ + "." + PickleBackend.__name__ + "." + self.save.__name__)
+
+        pth = self._compile_path(keys)
+        logger.debug(f"Saving cache to '{pth}'")
+
+        dirname = os.path.dirname(pth)
+        try:
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+        except FileExistsError as fee:
+            logger.error(fee)
+
+        with open(pth, "wb") as f:
+            pickle.dump(val, f)
+
+    def read(self, keys: tuple, start: int = None, stop: int = None):
+        val = self.load(keys)
+        if val is None:
+            return None
+
+        return val[start:stop]
+
+    def append(self, keys: tuple, val):
+        existing = self.load(keys)
+        if existing is not None:
+            val = _concatenate(existing, val)
+
+        self.save(keys, val)
+
+    def delete(self, keys: tuple):
+        pth = self._compile_path(keys)
+        if os.path.exists(pth):
+            os.remove(pth)
+
+
+class HDF5Backend:
+    """
+    Stores all the cache entries sharing their first key (i.e. the
+    simulation) in a single HDF5 file, with each entry in the group named
+    by the rest of its keys. Numeric arrays are stored as chunked, resizable
+    datasets so they can be partially read and appended to, anything else is
+    pickled into a resizable byte dataset. Entries are overwritten in place
+    where possible, and the files track their free space across sessions,
+    so that rewriting entries doesn't grow the files.
+    """
+
+    def __init__(self, caches_dir: str, lock_timeout: float = 600):
+        self._dir = caches_dir
+        self._lock_timeout = lock_timeout
+        # Entries cached before the store existed are migrated on access
+        self._legacy = PickleBackend(caches_dir)
+        # The entries in each file, with the file mtime they were read at
+        self._indices: Dict[str, Tuple[float, Set[str]]] = {}
+        self._registries: Dict[str, UnitRegistry] = {}
+        # Whether each simulation has a legacy pickle cache to migrate
+        self._has_legacy: Dict[str, bool] = {}
+
+    def _split_keys(self, keys: tuple) -> Tuple[str, str]:
+        keys = [str(k) for k in keys]
+
+        fname = os.path.join(self._dir, keys[0] + ".h5")
+        name = "/".join(keys[1:] + [VALUE_NAME])
+
+        return fname, name
+
+    def _open(self, fname: str, mode: str) -> h5py.File:
+        logger = logging.getLogger(
+            __name__ + "." + HDF5Backend.__name__ + "." + self._open.__name__)
+
+        if mode != "r" and not os.path.exists(fname):
+            self._create(fname)
+
+        start = time.time()
+        wait = 0.1
+
+        # Other processes can be holding the file lock, so retry until
+        # they are done with it
+        while True:
+            try:
+                return h5py.File(fname, mode)
+            except OSError as oe:
+                if "lock" not in str(oe) or \
+                        time.time() - start > self._lock_timeout:
+                    raise
+
+                logger.debug(f"'{fname}' is locked, retrying in {wait}s")
+                time.sleep(wait)
+                wait = min(2 * wait, 5)
+
+    def _create(self, fname: str):
+        # HDF5 only reuses the space freed by deleted entries across
+        # sessions if the file is created persisting its free space
+        try:
+            h5py.File(fname, "x", fs_strategy="fsm", fs_persist=True).close()
+        except (FileExistsError, OSError):
+            # Created by another process in the meantime
+            if not os.path.exists(fname):
+                raise
+
+    def _legacy_exists(self, keys: tuple) -> bool:
+        """
+        Whether there is a pickle cache of the simulation to migrate, only
+        checked once per simulation rather than once per missing entry
+        """
+        sim = str(keys[0])
+        if sim not in self._has_legacy:
+            self._has_legacy[sim] = os.path.isdir(
+                os.path.join(self._dir, sim))
+
+        return self._has_legacy[sim]
+
+    def _index(self, fname: str) -> Set[str]:
+        mtime = os.path.getmtime(fname) if os.path.exists(fname) else None
+
+        cached = self._indices.get(fname)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        names = set()
+        if mtime is not None:
+            def visitor(name):
+                if name.endswith(VALUE_NAME):
+                    names.add(name)
+
+            with self._open(fname, "r") as f:
+                f.visit(visitor)
+
+        self._indices[fname] = (mtime, names)
+
+        return names
+
+    def _update_index(self, fname: str, name: str):
+        names = self._index(fname)
+        names.add(name)
+
+        self._indices[fname] = (os.path.getmtime(fname), names)
+
+    def exists(self, keys: tuple) -> bool:
+        fname, name = self._split_keys(keys)
+
+        return name in self._index(fname)
+
+    def load(self, keys: tuple):
+        logger = logging.getLogger(
+            __name__ + "." + HDF5Backend.__name__ + "." + self.load.__name__)
+
+        fname, name = self._split_keys(keys)
+
+        if name not in self._index(fname):
+            if not self._legacy_exists(keys):
+                return None
+
+            val = self._legacy.load(keys)
+            if val is not None:
+                logger.debug(f"Migrating pickled cache for '{keys}' to '{fname}'")  # noqa: E501
+                self.save(keys, val)
+
+            return val
+
+        logger.debug(f"Reading '{name}' from '{fname}'")
+        with self._open(fname, "r") as f:
+            return self._decode(f, f[name])
+
+    def save(self, keys: tuple, val):
+        logger = logging.getLogger(
+            __name__ + "." + HDF5Backend.__name__ + "." + self.save.__name__)
+
+        fname, name = self._split_keys(keys)
+        logger.debug(f"Saving '{name}' to '{fname}'")
+
+        try:
+            if not os.path.exists(self._dir):
+                os.makedirs(self._dir)
+        except FileExistsError as fee:
+            logger.error(fee)
+
+        with self._open(fname, "a") as f:
+            if name in f and not self._overwrite(f, f[name], val):
+                del f[name]
+            if name not in f:
+                self._encode(f, name, val)
+
+        self._update_index(fname, name)
+
+    def read(self, keys: tuple, start: int = None, stop: int = None):
+        """
+        Reads only the given range of the entry from disk
+        """
+        fname, name = self._split_keys(keys)
+
+        if name not in self._index(fname):
+            if not self._legacy_exists(keys):
+                return None
+
+            return self._legacy.read(keys, start, stop)
+
+        with self._open(fname, "r") as f:
+            dset = f[name]
+
+            if dset.attrs[KIND_ATTR] == PICKLE_KIND:
+                return self._decode(f, dset)[start:stop]
+
+            return self._decode(f, dset, np.s_[start:stop])
+
+    def append(self, keys: tuple, val):
+        """
+        Appends the values to the end of the entry, without rewriting the
+        existing values
+        """
+        fname, name = self._split_keys(keys)
+
+        if name not in self._index(fname):
+            existing = None
+            if self._legacy_exists(keys):
+                existing = self._legacy.load(keys)
+            if existing is not None:
+                val = _concatenate(existing, val)
+
+            self.save(keys, val)
+            return
+
+        with self._open(fname, "a") as f:
+            dset = f[name]
+
+            if dset.attrs[KIND_ATTR] == PICKLE_KIND or dset.ndim == 0:
+                existing = self._decode(f, dset)
+                val = _concatenate(existing, val)
+                if not self._overwrite(f, dset, val):
+                    del f[name]
+                    self._encode(f, name, val)
+
+            else:
+                if UNITS_ATTR in dset.attrs:
+                    val = val.to(dset.attrs[UNITS_ATTR])
+                data = np.asarray(val)
+
+                num = dset.shape[0]
+                dset.resize(num + len(data), axis=0)
+                dset[num:] = data
+
+        self._update_index(fname, name)
+
+    def delete(self, keys: tuple):
+        fname, name = self._split_keys(keys)
+
+        if name in self._index(fname):
+            with self._open(fname, "a") as f:
+                del f[name]
+
+            names = self._index(fname)
+            names.discard(name)
+            self._indices[fname] = (os.path.getmtime(fname), names)
+
+        if self._legacy_exists(keys):
+            self._legacy.delete(keys)
+
+    def _overwrite(self, f: h5py.File, dset: h5py.Dataset, val) -> bool:
+        """
+        Writes the value over the existing dataset of the entry, resizing
+        it if needed, returning False if the dataset can't hold the value
+        (i.e. a different type or shape) and has to be recreated
+        """
+        if dset.attrs[KIND_ATTR] == PICKLE_KIND:
+            if _is_numeric(val) or dset.ndim != 1:
+                return False
+
+            data = np.frombuffer(pickle.dumps(val), dtype=np.uint8)
+        else:
+            if not _is_numeric(val):
+                return False
+
+            data = np.asarray(val)
+            if data.dtype != dset.dtype or data.ndim != dset.ndim or \
+                    data.shape[1:] != dset.shape[1:]:
+                return False
+            if data.ndim > 0 and data.shape[0] != dset.shape[0] and \
+                    dset.chunks is None:
+                return False
+
+        if data.ndim > 0:
+            dset.resize(data.shape[0], axis=0)
+        dset[()] = data
+
+        if dset.attrs[KIND_ATTR] == ARRAY_KIND:
+            if isinstance(val, unyt.unyt_array):
+                dset.attrs[UNITS_ATTR] = str(val.units)
+                dset.attrs[REGISTRY_ATTR] = self._save_registry(
+                    f, val.units.registry)
+            else:
+                for attr in (UNITS_ATTR, REGISTRY_ATTR):
+                    if attr in dset.attrs:
+                        del dset.attrs[attr]
+
+        return True
+
+    def _encode(self, f: h5py.File, name: str, val):
+        if _is_numeric(val):
+            data = np.asarray(val)
+
+            if data.ndim > 0:
+                dset = f.create_dataset(
+                    name, data=data, chunks=True,
+                    maxshape=(None,) + data.shape[1:])
+            else:
+                dset = f.create_dataset(name, data=data)
+
+            dset.attrs[KIND_ATTR] = ARRAY_KIND
+
+            if isinstance(val, unyt.unyt_array):
+                dset.attrs[UNITS_ATTR] = str(val.units)
+                dset.attrs[REGISTRY_ATTR] = self._save_registry(
+                    f, val.units.registry)
+
+        else:
+            # Stored as bytes in a resizable dataset, so can be overwritten
+            # in place
+            data = np.frombuffer(pickle.dumps(val), dtype=np.uint8)
+            dset = f.create_dataset(
+                name, data=data, chunks=True, maxshape=(None,))
+            dset.attrs[KIND_ATTR] = PICKLE_KIND
+
+    def _decode(self, f: h5py.File, dset: h5py.Dataset, sl=()):
+        if dset.attrs[KIND_ATTR] == PICKLE_KIND:
+            return pickle.loads(dset[()].tobytes())
+
+        data = dset[sl]
+
+        if UNITS_ATTR not in dset.attrs:
+            return data
+
+        registry = self._load_registry(f, dset.attrs[REGISTRY_ATTR])
+        if np.ndim(data) == 0:
+            return unyt.unyt_quantity(
+                data, dset.attrs[UNITS_ATTR], registry=registry)
+
+        return unyt.unyt_array(data, dset.attrs[UNITS_ATTR], registry=registry)
+
+    def _save_registry(self, f: h5py.File, registry: UnitRegistry) -> str:
+        # Registries are large and shared by most entries, so are stored
+        # once per file keyed by their hash
+        json = registry.to_json()
+        digest = hashlib.md5(json.encode()).hexdigest()
+
+        name = REGISTRIES_GROUP + "/" + digest
+        if name not in f:
+            f.create_dataset(name, data=np.void(json.encode()))
+
+        return digest
+
+    def _load_registry(self, f: h5py.File, digest: str) -> UnitRegistry:
+        if digest not in self._registries:
+            json = f[REGISTRIES_GROUP + "/" + digest][()].tobytes().decode()
+            self._registries[digest] = UnitRegistry.from_json(json)
+
+        return self._registries[digest]
+
+
+def _is_numeric(val) -> bool:
+    if isinstance(val, np.ndarray):
+        return val.dtype.kind in "biuf"
+
+    return isinstance(val, (int, float, np.number)) and \
+        not isinstance(val, bool)
+
+
+def _concatenate(existing, val):
+    if isinstance(existing, unyt.unyt_array):
+        return unyt.uconcatenate((existing, val.to(existing.units)))
+    elif isinstance(existing, np.ndarray):
+        return np.concatenate((existing, val))
+
+    return list(existing) + list(val)
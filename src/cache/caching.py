@@ -1,17 +1,59 @@
 import logging
-import os
-import pickle
 from typing import Dict, Sequence
 
+from src.cache import backends
+from src.cache.ragged import RaggedArray
+from src.util import parallel
 from src.util.constants import sim_regex
 
+HDF5_BACKEND = "hdf5"
+PICKLE_BACKEND = "pickle"
+
+BACKENDS = {
+    HDF5_BACKEND: backends.HDF5Backend,
+    PICKLE_BACKEND: backends.PickleBackend,
+}
+
+# Sub keys that ragged entries store their flattened values and the end
+# offsets of each row under
+RAGGED_VALUES_KEY = "ragged_values"
+RAGGED_ENDS_KEY = "ragged_ends"
+
+_default_backend = PICKLE_BACKEND
+
+
+def set_default_backend(name: str):
+    """
+    Sets the storage backend used by the caches that aren't given one
+    explicitly
+    """
+    global _default_backend
+
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown cache backend '{name}', expected one of {list(BACKENDS.keys())}")  # noqa: E501
+
+    _default_backend = name
+
 
 class Cache:
 
-    def __init__(self, caches_dir: str = "./data/"):
+    def __init__(self, caches_dir: str = "./data/", backend: str = None):
         self._dir = caches_dir
+        self._backend_name = backend
+        self._backend = None
         self._cache: Dict[tuple, CacheEntry] = {}
 
+    @property
+    def backend(self):
+        # Resolved lazily, as module level caches are created before the
+        # configuration is read
+        if self._backend is None:
+            name = self._backend_name or _default_backend
+            self._backend = BACKENDS[name](self._dir)
+
+        return self._backend
+
     def reset(self):
         logger = logging.getLogger(__name__ + "." + self.reset.__name__)
         logger.debug("Resetting cache...")
@@ -39,7 +81,7 @@ class Cache:
         keys = self._parse_keys(keys)
 
         if keys not in self._cache:
-            self._cache[keys] = CacheEntry(self._dir, keys)
+            self._cache[keys] = CacheEntry(self.backend, keys)
 
         return self._cache[keys]
 
@@ -57,66 +99,119 @@ class Cache:
 
 class CacheEntry:
 
-    def __init__(self, dir: str, keys: tuple):
-        self._dir = dir
+    def __init__(self, backend, keys: tuple):
+        self._backend = backend
         self._keys = keys
-        self._path, self._fname = self._compile_path()
         self._cached_val = None
 
-    def _compile_path(self):
-        nkeys = len(self._keys)
+    def _load(self):
+        if self._cached_val is not None:
+            return self._cached_val
+
+        self._cached_val = self._backend.load(self._keys)
 
-        fname = ""
-        for i in range(nkeys):
-            fname += str(self._keys[i])
-            if i < nkeys - 1:
-                fname += "/"
+        return self._cached_val
 
-        fname += ".pickle"
+    def _save(self, val):
+        self._cached_val = val
 
-        full_path = os.path.join(self._dir, fname)
+        if not _writes():
+            return
 
-        return os.path.split(full_path)
+        self._backend.save(self._keys, val)
 
-    def _load(self):
+    def read(self, start: int = None, stop: int = None):
+        """
+        Reads the given range of the cached values, only reading that part
+        from disk if the whole value isn't already loaded
+        """
         if self._cached_val is not None:
-            return self._cached_val
+            return self._cached_val[start:stop]
 
-        logger = logging.getLogger(
-            __name__ + "." +
-            self.__class__.__name__ + "." +
-            self._load.__name__)
+        return self._backend.read(self._keys, start, stop)
 
-        pth = os.path.join(self._path, self._fname)
-        if os.path.exists(pth):
-            logger.debug(f"Opening existing cache at '{pth}'")
+    def append(self, val):
+        """
+        Appends the values to the end of the cached values, only writing the
+        new values where the backend supports it
+        """
+        if _writes():
+            self._backend.append(self._keys, val)
 
-            with open(pth, "rb") as f:
-                self._cached_val = pickle.load(f)
-        else:
-            logger.debug(
-                f"Cache doesn't exist for '{pth}'!")
+        # Reload the full value lazily on next access, which the other ranks
+        # can only do once the root has written it
+        self._cached_val = None
+        parallel.barrier()
 
-        return self._cached_val
+    def _ragged_keys(self):
+        return self._keys + (RAGGED_VALUES_KEY,), \
+            self._keys + (RAGGED_ENDS_KEY,)
 
-    def _save(self, val):
-        self._cached_val = val
+    def read_ragged(self, num: int = None) -> RaggedArray:
+        """
+        Reads the first num rows of a ragged cache entry, only reading those
+        rows from disk
+        """
         logger = logging.getLogger(
             __name__ + "." +
             self.__class__.__name__ + "." +
-            self._save.__name__)
+            self.read_ragged.__name__)
+
+        values_keys, ends_keys = self._ragged_keys()
+
+        ends = self._backend.read(ends_keys, 0, num)
+        if ends is None:
+            # Entries cached before the ragged layout store a list of rows
+            rows = self._backend.load(self._keys)
+            if rows is None:
+                return None
+
+            logger.debug(f"Converting cache for '{self._keys}' to ragged")
+            ragged = RaggedArray.from_rows(rows)
+            self.save_ragged(ragged)
+            if _writes():
+                self._backend.delete(self._keys)
 
-        pth = os.path.join(self._path, self._fname)
-        logger.debug(f"Saving cache to '{pth}'")
+            return ragged[:num]
 
-        try:
-            if not os.path.exists(self._path):
-                os.makedirs(self._path)
-        except FileExistsError as fee:
-            logger.error(fee)
+        num_values = int(ends[-1]) if len(ends) > 0 else 0
+        values = self._backend.read(values_keys, 0, num_values)
 
-        with open(pth, "wb") as f:
-            pickle.dump(val, f)
+        return RaggedArray(values, ends)
+
+    def save_ragged(self, ragged: RaggedArray):
+        """
+        Overwrites the ragged cache entry with the given rows
+        """
+        if not _writes():
+            return
+
+        values_keys, ends_keys = self._ragged_keys()
+
+        self._backend.save(values_keys, ragged.values)
+        self._backend.save(ends_keys, ragged.ends)
+
+    def append_ragged(self, ragged: RaggedArray):
+        """
+        Appends the rows to the end of the ragged cache entry, only writing
+        the new rows where the backend supports it
+        """
+        if len(ragged) == 0 or not _writes():
+            return
+
+        values_keys, ends_keys = self._ragged_keys()
+
+        last_end = self._backend.read(ends_keys, -1, None)
+        if last_end is None:
+            self.save_ragged(ragged)
+            return
+
+        offset = int(last_end[0]) if len(last_end) > 0 else 0
+
+        # The values are written first, so that an interrupted append can't
+        # leave ends pointing past the stored values
+        self._backend.append(values_keys, ragged.values)
+        self._backend.append(ends_keys, ragged.ends + offset)
 
     @property
     def val(self):
@@ -125,3 +220,9 @@ class CacheEntry:
     @val.setter
     def val(self, v):
         self._save(v)
+
+
+def _writes() -> bool:
+    # The ranks sharing a unit of work hold the same values, so only their
+    # root writes them to disk
+    return parallel.is_root()
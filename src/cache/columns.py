@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Tuple
+
+import numpy as np
+import unyt
+
+# Subdirectory of the caches the columns are exported to
+COLUMNS_DIR = "columns"
+
+UNITS_KEY = "units"
+SOURCE_MTIME_KEY = "source_mtime"
+DEPENDENCY_MTIMES_KEY = "dependency_mtimes"
+
+
+class ColumnStore:
+    """
+    Columns of the halo catalogues (masses, positions, radii...) exported
+    once to their own .npy files, which later runs memory map rather than
+    parsing the catalogue again
+    """
+
+    def __init__(self, caches_dir: str = "./data/"):
+        self._dir = os.path.join(caches_dir, COLUMNS_DIR)
+
+    def _compile_paths(self, fname: str, field: tuple) -> Tuple[str, str]:
+        # Catalogues of different simulations share their file names
+        digest = hashlib.md5(os.path.abspath(fname).encode()).hexdigest()[:8]
+        dirname = os.path.join(
+            self._dir, f"{os.path.basename(fname)}.{digest}")
+
+        name = ".".join(str(f) for f in field)
+        pth = os.path.join(dirname, name)
+
+        return pth + ".npy", pth + ".json"
+
+    def read(self, fname: str, field: tuple, dependencies: Tuple[str, ...] = ()) -> Tuple[np.ndarray, str]:  # noqa: E501
+        """
+        Memory maps the exported column of the catalogue, returning it with
+        its units, or None if it hasn't been exported since the catalogue
+        (or any other file the column's values depend on) last changed
+        """
+        logger = logging.getLogger(
+            __name__ + "." + ColumnStore.__name__ + "." + self.read.__name__)
+
+        data_pth, meta_pth = self._compile_paths(fname, field)
+        if not os.path.exists(meta_pth):
+            return None
+
+        with open(meta_pth) as f:
+            meta = json.load(f)
+
+        if meta[SOURCE_MTIME_KEY] != os.path.getmtime(fname) or \
+                meta.get(DEPENDENCY_MTIMES_KEY, {}) != _mtimes(dependencies):
+            logger.debug(f"Exported column {field} of '{fname}' is stale")
+            return None
+
+        return np.load(data_pth, mmap_mode="r"), meta[UNITS_KEY]
+
+    def write(self, fname: str, field: tuple, val: np.ndarray, dependencies: Tuple[str, ...] = ()):  # noqa: E501
+        logger = logging.getLogger(
+            __name__ + "." + ColumnStore.__name__ + "." + self.write.__name__)
+
+        data_pth, meta_pth = self._compile_paths(fname, field)
+        logger.debug(f"Exporting column {field} of '{fname}' to '{data_pth}'")
+
+        os.makedirs(os.path.dirname(data_pth), exist_ok=True)
+
+        units = str(val.units) if isinstance(val, unyt.unyt_array) else ""
+        meta = {
+            UNITS_KEY: units,
+            SOURCE_MTIME_KEY: os.path.getmtime(fname),
+            DEPENDENCY_MTIMES_KEY: _mtimes(dependencies),
+        }
+
+        # Write to temporary files and rename them over the columns, so other
+        # processes never map a partially written column. The metadata goes
+        # last as it marks the column as exported.
+        tmp = f".{os.getpid()}.tmp"
+        with open(data_pth + tmp, "wb") as f:
+            np.save(f, np.ascontiguousarray(np.asarray(val)))
+        os.replace(data_pth + tmp, data_pth)
+
+        with open(meta_pth + tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_pth + tmp, meta_pth)
+
+
+def _mtimes(fnames: Tuple[str, ...]) -> dict:
+    return {os.path.abspath(f): os.path.getmtime(f) for f in fnames}
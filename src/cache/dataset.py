@@ -1,88 +1,378 @@
+import collections
 import logging
 import os
 import threading
+from concurrent.futures import Future
 
+import numpy as np
 import yt
 import yt.extensions.legacy
+from src.cache import projection
+from src.cache.columns import ColumnStore
 from src.cache.faux_rockstar import FauxRockstar
+from src.cache.halo_index import HaloIndex
+from src.util import parallel
 from src.util import units as u
 
 _existing_instance = None
 
 
-def new():
+def new(max_bytes: int = None, columns: ColumnStore = None, max_entries: int = None, base_bytes: int = None):  # noqa: E501
     global _existing_instance
     if _existing_instance is None:
         _existing_instance = CachedDataSet()
 
+    if max_bytes is not None:
+        _existing_instance.max_bytes = max_bytes
+    if columns is not None:
+        _existing_instance.columns = columns
+    if max_entries is not None:
+        _existing_instance.max_entries = max_entries
+    if base_bytes is not None:
+        _existing_instance.base_bytes = base_bytes
+
     return _existing_instance
 
 
 class CachedDataSet:
+    """
+    Least recently used cache of the loaded data sets, evicting data sets
+    (and the field data read from them) once the estimated size of the
+    data sets and their field data exceeds the byte budget, or there are
+    more data sets than the maximum number of entries
+    """
 
     _load_key = "dataset"
     _all_data_key = "all_data"
+    _halo_index_key = "halo_index"
+    _fields_key = "fields"
+
+    def __init__(self, max_bytes: int = 0, columns: ColumnStore = None, max_entries: int = 0, base_bytes: int = 0):  # noqa: E501
+        # No limit if the budget (or maximum number of entries) isn't
+        # positive
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        # Memory charged for each loaded data set on top of its field data,
+        # as the index and particle data yt holds can't be measured
+        self.base_bytes = base_bytes
+        # Fields are exported to (and read back from) the column store if set
+        self.columns = columns
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-    def __init__(self):
         self._mutex = threading.Lock()
         with self._mutex:
-            self._cache = {}
+            self._cache = collections.OrderedDict()
 
     def clear(self):
+        logger = logging.getLogger(__name__ + "." + self.clear.__name__)
+        logger.info(f"Data set cache stats: {self.stats()}")
+
         with self._mutex:
-            self._cache = {}
+            self._cache = collections.OrderedDict()
 
-    def load(self, fname):
-        logger = logging.getLogger(__name__ + "." + self.load.__name__)
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._cache),
+            "bytes": self.nbytes(),
+        }
 
-        dirname = os.path.dirname(fname)
-        basename = os.path.basename(fname)
-        _, ext = os.path.splitext(basename)
+    def nbytes(self) -> int:
+        """
+        The estimated size of the field data held by all the data sets
+        """
+        return sum(_estimate_bytes(entry, self.base_bytes)
+                   for entry in list(self._cache.values()))
 
-        if fname not in self._cache:
-            with self._mutex:
+    def _get(self, fname, key, compute):
+        """
+        Gets the value of the key for the data set, computing it if it isn't
+        cached. Concurrent calls for the same key wait on the first call's
+        future rather than computing it again, while different keys (and
+        data sets) are computed in parallel.
+        """
+        with self._mutex:
+            if fname not in self._cache:
                 self._cache[fname] = {}
+            self._cache.move_to_end(fname)
+
+            entry = self._cache[fname]
+            future = entry.get(key)
+            owner = future is None
+
+            if owner:
+                self.misses += 1
+                future = entry[key] = Future()
+            else:
+                self.hits += 1
 
-        if self._load_key not in self._cache[fname]:
-            logger.debug(
-                f"No dataset found for file '{fname}' with key '{self._load_key}', reading into cache...")  # noqa: E501
+        if owner:
+            try:
+                future.set_result(compute())
+            except BaseException as e:
+                # Let the next call retry rather than caching the failure
+                with self._mutex:
+                    if entry.get(key) is future:
+                        del entry[key]
+                future.set_exception(e)
+                raise
 
-            with self._mutex:
-                args = []
-                kwargs = {}
+        return future.result()
 
-                if "snapdir" in dirname:
-                    kwargs = {
-                        "unit_base": u.unit_base()
-                    }
+    def _evict(self):
+        """
+        Evicts the least recently used data sets until the estimated size of
+        the cache is within the budget and the number of data sets within
+        the maximum, always keeping the most recent
+        """
+        logger = logging.getLogger(__name__ + "." + self._evict.__name__)
 
-                ds = yt.load(fname, *args, **kwargs)
+        max_bytes = self.max_bytes if self.max_bytes and self.max_bytes > 0 \
+            else np.inf
+        max_entries = self.max_entries \
+            if self.max_entries and self.max_entries > 0 else np.inf
 
-                if "rockstar" in dirname:
-                    ds.parameters["format_revision"] = 2
-                    ds = FauxRockstar(ds, fname)
+        if max_bytes == np.inf and max_entries == np.inf:
+            return
 
-                self._cache[fname][self._load_key] = ds
+        with self._mutex:
+            sizes = {fname: _estimate_bytes(entry, self.base_bytes)
+                     for fname, entry in self._cache.items()}
+            total = sum(sizes.values())
+
+            while (total > max_bytes or len(self._cache) > max_entries) \
+                    and len(self._cache) > 1:
+                fname, _ = self._cache.popitem(last=False)
+                total -= sizes[fname]
+                self.evictions += 1
+
+                logger.debug(
+                    f"Evicted data set '{fname}' ({sizes[fname]} bytes) from the cache")  # noqa: E501
+
+    def load(self, fname):
+        ds = self._get(fname, self._load_key, lambda: self._load(fname))
 
-        return self._cache[fname][self._load_key]
+        # Data sets only opened for sphere selections (i.e. snapshots) hold
+        # memory too
+        self._evict()
+
+        return ds
+
+    def _load(self, fname):
+        logger = logging.getLogger(__name__ + "." + self._load.__name__)
+
+        dirname = os.path.dirname(fname)
+
+        logger.debug(
+            f"No dataset found for file '{fname}' with key '{self._load_key}', reading into cache...")  # noqa: E501
+
+        args = []
+        kwargs = {}
+
+        if "snapdir" in dirname:
+            kwargs = {
+                "unit_base": u.unit_base()
+            }
+
+        ds = yt.load(fname, *args, **kwargs)
+
+        if "rockstar" in dirname:
+            ds.parameters["format_revision"] = 2
+            ds = FauxRockstar(ds, fname, self.columns)
+
+        return ds
 
     def all_data(self, fname):
-        logger = logging.getLogger(__name__ + "." + self.all_data.__name__)
+        ad = self._get(fname, self._all_data_key,
+                       lambda: self._all_data(fname))
 
-        if fname not in self._cache:
-            with self._mutex:
-                self._cache[fname] = {}
+        # The fields read from the region are only known once used, so the
+        # size of the cache is checked on every access
+        self._evict()
+
+        return ad
+
+    def _all_data(self, fname):
+        logger = logging.getLogger(__name__ + "." + self._all_data.__name__)
 
-        if self._all_data_key not in self._cache[fname]:
-            logger.debug(
-                f"All data missing in cache for data set '{fname}', reading...")  # noqa: E501
+        logger.debug(
+            f"All data missing in cache for data set '{fname}', reading...")
+
+        return self.load(fname).all_data()
+
+    def halo_index(self, fname, halo_type) -> HaloIndex:
+        index = self._get(fname, self._halo_index_key,
+                          lambda: self._halo_index(fname, halo_type))
+
+        self._evict()
+
+        return index
+
+    def _halo_index(self, fname, halo_type) -> HaloIndex:
+        logger = logging.getLogger(__name__ + "." + self._halo_index.__name__)
+
+        logger.debug(f"No halo index found for data set '{fname}', building...")  # noqa: E501
+
+        ds = self.load(fname)
 
-            data_set = self.load(fname)
-            with self._mutex:
-                self._cache[fname][self._all_data_key] = data_set.all_data()
+        # Read the halo positions in a consistent unit system
+        xs = self.field(fname, halo_type.coord_index_x()).to("code_length")
+        ys = self.field(fname, halo_type.coord_index_y()).to("code_length")
+        zs = self.field(fname, halo_type.coord_index_z()).to("code_length")
+        positions = ds.arr(
+            np.stack([xs.value, ys.value, zs.value], axis=1), "code_length")
 
-        return self._cache[fname][self._all_data_key]
+        masses = self.field(fname, halo_type.index)
+        box_size = ds.domain_width[0].to("code_length")
+
+        return HaloIndex(positions, masses, box_size)
+
+    def prefetch(self, fname, halo_type, fields):
+        """
+        Reads the declared fields of the halo catalogue in one pass over its
+        files, for the catalogues that can be read without yt
+        """
+        logger = logging.getLogger(__name__ + "." + self.prefetch.__name__)
+
+        # Exported fields are memory mapped instead
+        fields = [f for f in fields if self._exported(fname, f) is None]
+
+        if halo_type not in projection.PROJECTED_TYPES or len(fields) == 0:
+            return
+
+        # Fields are declared as the yt field tuples, in any order
+        fields = tuple(sorted(set(fields)))
+        key = (self._fields_key, fields)
+
+        try:
+            self._get(fname, key, lambda: projection.read_fields(
+                self.load(fname), fname, halo_type, list(fields)))
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(
+                f"Couldn't prefetch fields {fields} from '{fname}', reading them through yt instead")  # noqa: E501
+            logger.warning(e)
+            return
+
+        self._evict()
+
+    def field(self, fname, field):
+        """
+        Gets the field of the data set, memory mapping it if it has been
+        exported, otherwise from the prefetched fields if it was declared or
+        else reading it through yt (exporting it for the following runs)
+        """
+        exported = self._exported(fname, field)
+        if exported is not None:
+            data, units = exported
+            return self.load(fname).arr(data, units)
+
+        val = self._projected(fname, field)
+        if val is None:
+            val = self.all_data(fname)[field]
+
+        if self.columns is not None and parallel.is_root():
+            self.columns.write(
+                fname, field, val, self._dependencies(fname, field))
+
+        return val
+
+    def field_chunks(self, fname, field, chunk_size: int = None):
+        """
+        Iterates over the field of the data set chunk by chunk, without
+        reading all of it into memory: as slices of the exported (memory
+        mapped) or prefetched field, otherwise through yt's IO chunks of a
+        region that isn't kept in the cache
+        """
+        exported = self._exported(fname, field)
+        projected = None
+        if exported is None:
+            projected = self._projected(fname, field)
+
+        if exported is not None or projected is not None:
+            if exported is not None:
+                data, units = exported
+                ds = self.load(fname)
+            else:
+                data = projected
+
+            chunk_size = chunk_size or max(len(data), 1)
+            for start in range(0, len(data), chunk_size):
+                chunk = data[start:start + chunk_size]
+                yield chunk if exported is None else ds.arr(chunk, units)
+
+            return
+
+        ad = self.load(fname).all_data()
+        for chunk in ad.chunks([], "io"):
+            yield chunk[field]
+
+    def _projected(self, fname, field):
+        with self._mutex:
+            entry = self._cache.get(fname, {})
+            projected = [_result(entry, k) for k in list(entry)
+                         if isinstance(k, tuple) and k[0] == self._fields_key]
+
+        return next((fields[field] for fields in projected
+                     if fields is not None and field in fields), None)
+
+    def _exported(self, fname, field):
+        if self.columns is None:
+            return None
+
+        return self.columns.read(
+            fname, field, self._dependencies(fname, field))
+
+    def _dependencies(self, fname, field) -> tuple:
+        # Fields overridden from other files go stale with those files too
+        ds = self.load(fname)
+        if isinstance(ds, FauxRockstar):
+            return ds.dependencies(field)
+
+        return ()
 
     def sphere(self, fname, centre, radius):
         ds = self.load(fname)
         return ds.sphere(centre, radius)
+
+
+def _estimate_bytes(entry: dict, base_bytes: int = 0) -> int:
+    """
+    Estimates the memory held by the cached data of one data set, from the
+    base cost of the loaded data set, the field data read into its region
+    and the arrays of its halo index
+    """
+    num_bytes = 0
+
+    if _result(entry, CachedDataSet._load_key) is not None:
+        num_bytes += base_bytes or 0
+
+    ad = _result(entry, CachedDataSet._all_data_key)
+    if ad is not None:
+        for v in list(ad.field_data.values()):
+            num_bytes += getattr(v, "nbytes", 0)
+
+    index = _result(entry, CachedDataSet._halo_index_key)
+    if index is not None:
+        num_bytes += index.nbytes
+
+    for key in list(entry):
+        if isinstance(key, tuple) and key[0] == CachedDataSet._fields_key:
+            fields = _result(entry, key)
+            if fields is not None:
+                num_bytes += sum(v.nbytes for v in fields.values())
+
+    return num_bytes
+
+
+def _result(entry: dict, key: str):
+    # Values still being computed don't hold any memory in the cache yet
+    future = entry.get(key)
+    if future is None or not future.done() or future.exception() is not None:
+        return None
+
+    return future.result()
@@ -2,24 +2,32 @@ from __future__ import annotations
 
 import logging
 import os
-from typing import Any
+from typing import Any, Dict, Tuple
 
-import astropy.table.table
+import numpy as np
 import unyt
 import yt
 import yt.data_objects.selection_objects.data_selection_objects
-import yt.data_objects.selection_objects.region
 import yt.frontends.rockstar.data_structures
 from astropy.io import ascii
+from src.cache.columns import ColumnStore
+from src.util import parallel
 
 ATTRIBUTES_MAP = {
     ("halos", "particle_mass"): "mvir"
 }
 
+# The halo IDs in the binary catalogue and the ascii halo list
+ID_FIELD = ("halos", "particle_identifier")
+ID_COLUMN = "id"
+
+# Field type the ascii columns are exported to the column store under
+ASCII_FIELD_TYPE = "ascii"
+
 
 class FauxRockstar:
 
-    def __init__(self, ds: yt.frontends.rockstar.data_structures.RockstarDataset, filename: str):
+    def __init__(self, ds: yt.frontends.rockstar.data_structures.RockstarDataset, filename: str, columns: ColumnStore = None):
         self._fname = filename
         self._ds = ds
 
@@ -38,20 +46,30 @@ class FauxRockstar:
 
         logger.debug(f"Associated ascii file is at: {ascii_dirpath}")
 
-        self._ascii_data = ascii.read(
-            ascii_dirpath, format="fast_commented_header")
+        self._ascii_fname = ascii_dirpath
+        self._overrides = AsciiOverrides.load(ascii_dirpath, columns)
 
         logger.debug("Read in ascii data...")
 
+    def dependencies(self, field: tuple) -> Tuple[str, ...]:
+        """
+        The files the values of the field are read from besides the binary
+        catalogue, i.e. the ascii file for the overridden fields
+        """
+        if field in ATTRIBUTES_MAP:
+            return (self._ascii_fname,)
+
+        return ()
+
     def all_data(self, find_max=False, **kwargs):
         ad = self._ds.all_data(find_max, **kwargs)
 
-        return FauxSelection(ad, self._ascii_data)
+        return FauxSelection(ad, self._overrides)
 
     def sphere(self, centre, radius: float):
         sp = self._ds.sphere(centre, radius)
 
-        return FauxSelection(sp, self._ascii_data)
+        return FauxSelection(sp, self._overrides)
 
     @property
     def current_redshift(self):
@@ -75,20 +93,120 @@ class FauxRockstar:
     def quan(self, *args, **kwargs):
         return self._ds.quan(*args, **kwargs)
 
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes the wrapper doesn't have itself
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        return getattr(self._ds, name)
+
+
+class AsciiOverrides:
+    """
+    Columns of the rockstar ascii halo list, looked up by halo ID so that
+    they can be matched to the halos of any selection of the binary catalogue
+    """
+
+    def __init__(self, ids: np.ndarray, columns: Dict[str, np.ndarray]):
+        ids = np.asarray(ids, dtype=np.int64)
+
+        self._order = np.argsort(ids, kind="stable")
+        self._sorted_ids = ids[self._order]
+        self._columns = columns
+
+    @classmethod
+    def load(cls, ascii_fname: str, columns: ColumnStore = None) -> "AsciiOverrides":  # noqa: E501
+        """
+        Reads the overriding columns of the ascii file, from the binary copies
+        in the column store if they have already been converted
+        """
+        logger = logging.getLogger(
+            __name__ + "." + AsciiOverrides.__name__ + "." + cls.load.__name__)
+
+        names = [ID_COLUMN] + sorted(set(ATTRIBUTES_MAP.values()))
+
+        if columns is not None:
+            cached = [columns.read(ascii_fname, (ASCII_FIELD_TYPE, n))
+                      for n in names]
+            if all(c is not None for c in cached):
+                logger.debug(f"Using converted columns of '{ascii_fname}'")
+                data = {n: c[0] for n, c in zip(names, cached)}
+
+                return cls(data.pop(ID_COLUMN), data)
 
-class FauxSelection(yt.data_objects.selection_objects.data_selection_objects.YTSelectionContainer3D):
+        logger.debug(f"Parsing columns {names} of '{ascii_fname}'")
+        table = ascii.read(ascii_fname, format="fast_commented_header",
+                           include_names=names)
+        data = {n: np.asarray(table[n]) for n in names}
 
-    def __init__(self, data: yt.data_objects.selection_objects.data_selection_objects.YTSelectionContainer3D, overrides: astropy.table.table.Table = None):
+        # The ranks sharing the work parse the same file, so only their root
+        # exports it
+        if columns is not None and parallel.is_root():
+            for n, col in data.items():
+                columns.write(ascii_fname, (ASCII_FIELD_TYPE, n), col)
+
+        return cls(data.pop(ID_COLUMN), data)
+
+    def rows(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The rows of the halos with the given IDs, alongside whether each of
+        the halos was found in the ascii file
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            return np.zeros(len(ids), dtype=np.intp), np.zeros(len(ids), dtype=bool)  # noqa: E501
+
+        pos = np.searchsorted(self._sorted_ids, ids)
+        pos = np.minimum(pos, len(self._sorted_ids) - 1)
+        found = self._sorted_ids[pos] == ids
+
+        return self._order[pos], found
+
+    def lookup(self, data, field: tuple) -> unyt.unyt_array:
+        """
+        Replaces the values of the field for the halos of the selection with
+        the mapped ascii column, keeping the catalogue values of any halos
+        missing from the ascii file
+        """
+        attr = data[field]
+        col = self._columns[ATTRIBUTES_MAP[field]]
+
+        rows, found = self.rows(data[ID_FIELD])
+
+        val = np.array(attr.value, dtype=np.float64)
+        val[found] = col[rows[found]]
+
+        return unyt.unyt_array(val, attr.units)
+
+
+class FauxSelection:
+    """
+    Wraps a selection of the rockstar data set, replacing the fields mapped
+    to the ascii columns with the values of the same (selected) halos in the
+    ascii file
+    """
+
+    def __init__(self, data: yt.data_objects.selection_objects.data_selection_objects.YTSelectionContainer3D, overrides: AsciiOverrides = None):  # noqa: E501
         self._data = data
         self._overrides = overrides
+        self._mapped = {}
+
+    def __getitem__(self, field: tuple) -> unyt.unyt_array:
+        if field not in ATTRIBUTES_MAP or self._overrides is None:
+            return self._data[field]
+
+        if field not in self._mapped:
+            self._mapped[field] = self._overrides.lookup(self._data, field)
 
-    def __getattribute__(self, __name: str) -> Any:
+        return self._mapped[field]
 
-        attr = self._data[__name]
+    def chunks(self, fields, chunking_style: str, **kwargs):
+        # The overrides are looked up for the halos of each chunk
+        for chunk in self._data.chunks(fields, chunking_style, **kwargs):
+            yield FauxSelection(chunk, self._overrides)
 
-        if __name in ATTRIBUTES_MAP:
-            conv = ATTRIBUTES_MAP[__name]
-            val = self._overrides.get(conv, attr)
-            attr = unyt.unyt_array(val, attr.units)
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
 
-        return attr
+        return getattr(self._data, name)
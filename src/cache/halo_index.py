@@ -0,0 +1,122 @@
+import logging
+from typing import List, Tuple
+
+import numpy as np
+import unyt
+from scipy.spatial import cKDTree
+from src.cache.ragged import RaggedArray
+
+
+class HaloIndex:
+    """
+    Periodic KD-tree over the halo positions of a catalogue, so that the
+    sphere selections for a whole batch of centres can be answered in one
+    query instead of one yt selection per sphere.
+    """
+
+    def __init__(self,
+                 positions: unyt.unyt_array,
+                 masses: unyt.unyt_array,
+                 box_size: unyt.unyt_quantity):
+        logger = logging.getLogger(
+            __name__ + "." + HaloIndex.__name__ + "." + self.__init__.__name__)
+
+        self._units = positions.units
+        self._box_size = float(box_size.to(self._units).value)
+
+        # The periodic tree requires every point to lie within [0, box_size)
+        pos = np.mod(np.asarray(positions.value, dtype=np.float64),
+                     self._box_size)
+        pos[pos >= self._box_size] = 0
+
+        self._positions = pos
+        self._masses = masses
+
+        logger.debug(
+            f"Building periodic KD-tree over {len(pos)} halos with box size {self._box_size} {self._units}")  # noqa: E501
+
+        self._tree = cKDTree(pos, boxsize=self._box_size)
+
+    def __len__(self):
+        return len(self._positions)
+
+    @property
+    def masses(self) -> unyt.unyt_array:
+        return self._masses
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Estimated memory held by the index, the tree storing a copy of the
+        positions alongside its (similarly sized) node indices
+        """
+        return 3 * self._positions.nbytes + self._masses.nbytes
+
+    def _to_index_units(self, val) -> np.ndarray:
+        if isinstance(val, unyt.unyt_array):
+            val = val.to(self._units).value
+        return np.asarray(val, dtype=np.float64)
+
+    def query(self, centres, radius) -> List[np.ndarray]:
+        """
+        Finds the indices of all the halos within the given radius of
+        each centre, using one vectorised ball query for all the centres.
+        """
+        centres = np.atleast_2d(self._to_index_units(centres))
+        r = float(self._to_index_units(radius))
+
+        neighbours = self._tree.query_ball_point(centres, r, workers=-1)
+
+        return [np.asarray(idxs, dtype=np.intp) for idxs in neighbours]
+
+    def query_sorted(self, centres, radius) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Finds the halos within the given radius of each centre, returning
+        their indices sorted by their (periodic) distance from the centre,
+        alongside those distances.
+        """
+        centres = np.atleast_2d(self._to_index_units(centres))
+
+        results = []
+        for c, idxs in zip(centres, self.query(centres, radius)):
+            d = self._positions[idxs] - c
+            # Minimum image convention across the periodic boundaries
+            d -= self._box_size * np.round(d / self._box_size)
+            dists = np.sqrt(np.sum(d**2, axis=1))
+
+            order = np.argsort(dists)
+            results.append((idxs[order], dists[order]))
+
+        return results
+
+    def sphere_masses(self, centres, radius) -> RaggedArray:
+        """
+        Returns the masses of the halos contained within a sphere of the
+        given radius around each centre
+        """
+        neighbours = self.query(centres, radius)
+
+        return self._gather(self._masses, neighbours)
+
+    def sorted_sphere_masses(self, centres, radius) -> Tuple[RaggedArray, np.ndarray]:  # noqa: E501
+        """
+        Returns the masses of the halos contained within a sphere of the
+        given radius around each centre, alongside their (flattened)
+        distances from the centre, sorted by distance within each sphere
+        """
+        results = self.query_sorted(centres, radius)
+        if len(results) == 0:
+            return self._gather(self._masses, []), np.empty(0)
+
+        neighbours, dists = zip(*results)
+
+        return self._gather(self._masses, neighbours), np.concatenate(dists)
+
+    def _gather(self, values, neighbours) -> RaggedArray:
+        ends = np.cumsum([len(idxs) for idxs in neighbours], dtype=np.int64)
+
+        idxs = np.empty(0, dtype=np.intp)
+        if len(neighbours) > 0:
+            idxs = np.concatenate(neighbours)
+
+        return RaggedArray(values[idxs], ends)
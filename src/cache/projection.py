@@ -0,0 +1,134 @@
+import logging
+import re
+from typing import Dict, List, Tuple
+
+import h5py
+import numpy as np
+import unyt
+from src.util import enum
+
+# Catalogues whose fields can be read straight from their HDF5 files
+PROJECTED_TYPES = (enum.DataType.GROUP, enum.DataType.H5)
+
+# Units of the FoF group fields, as given to them by yt's gadget_fof frontend
+GROUP_UNITS = {
+    "GroupMass": "code_mass",
+    "GroupPos": "code_length",
+    "GroupVel": "code_velocity",
+    "GroupLen": "",
+}
+
+# yt splits the vector fields of the FoF groups into one field per column
+column_regex = re.compile("^(.*)_(\d+)$")  # noqa: W605
+first_file_regex = re.compile("\.0\.hdf5$")  # noqa: W605
+
+
+def read_fields(ds, fname: str, halo_type: enum.DataType, fields: List[tuple]) -> Dict[tuple, unyt.unyt_array]:  # noqa: E501
+    """
+    Reads the (yt named) fields of the halo catalogue in one pass over its
+    files with h5py, reading only the columns of the requested fields into
+    contiguous arrays rather than going through yt's per field IO
+    """
+    logger = logging.getLogger(__name__ + "." + read_fields.__name__)
+
+    # Group the fields by the HDF5 dataset they are stored in, so that each
+    # dataset is only read once when several of its columns are needed
+    columns: Dict[str, List[Tuple[tuple, int]]] = {}
+    for field in fields:
+        path, col = _locate(halo_type, field)
+        columns.setdefault(path, []).append((field, col))
+
+    parts = {field: [] for field in fields}
+    units = {}
+
+    fnames = _catalogue_files(fname, halo_type)
+    for fn in fnames:
+        with h5py.File(fn, "r") as f:
+            for path, cols in columns.items():
+                # Files of the catalogue without any halos skip the groups
+                if path not in f:
+                    continue
+
+                dset = f[path]
+                # Malformed fields can resolve to groups rather than
+                # datasets
+                if not isinstance(dset, h5py.Dataset):
+                    raise KeyError(f"'{path}' of '{fn}' isn't a dataset")
+
+                # Only read the columns of the vector fields that are used,
+                # h5py requiring them in increasing order
+                projected = dset.ndim > 1 and \
+                    all(col is not None for _, col in cols)
+                if projected:
+                    idxs = sorted(set(col for _, col in cols))
+                    data = dset[:, idxs]
+                else:
+                    data = dset[()]
+
+                for field, col in cols:
+                    if col is None:
+                        parts[field].append(data)
+                    elif projected:
+                        parts[field].append(data[:, idxs.index(col)])
+                    else:
+                        parts[field].append(data[:, col])
+
+                for field, _ in cols:
+                    units[field] = _units(halo_type, path, dset)
+
+    missing = [field for field in fields if field not in units]
+    if len(missing) > 0:
+        raise KeyError(f"Fields {missing} not found in '{fname}'")
+
+    logger.debug(
+        f"Read {len(fields)} fields from {len(fnames)} files of '{fname}'")
+
+    return {field: ds.arr(np.concatenate(parts[field]), units[field])
+            for field in fields}
+
+
+def _locate(halo_type: enum.DataType, field: tuple) -> Tuple[str, int]:
+    """
+    The path of the HDF5 dataset the field is stored in, with the column
+    of the dataset it is (or None if the dataset is the field)
+    """
+    if not isinstance(field, tuple) or len(field) != 2 or \
+            not all(isinstance(f, str) and f for f in field):
+        raise KeyError(f"Can't locate the field {field}")
+
+    ftype, name = field
+
+    if halo_type is enum.DataType.GROUP:
+        m = column_regex.match(name)
+        if m and m.group(1) in GROUP_UNITS:
+            return f"{ftype}/{m.group(1)}", int(m.group(2))
+
+    return f"{ftype}/{name}", None
+
+
+def _units(halo_type: enum.DataType, path: str, dset: h5py.Dataset) -> str:
+    if halo_type is enum.DataType.GROUP:
+        name = path.split("/")[-1]
+        if name not in GROUP_UNITS:
+            raise KeyError(f"Units of '{name}' unknown")
+
+        return GROUP_UNITS[name]
+
+    # yt data sets store the units of each field with it
+    units = dset.attrs.get("units", "")
+    if isinstance(units, bytes):
+        units = units.decode()
+
+    return units
+
+
+def _catalogue_files(fname: str, halo_type: enum.DataType) -> List[str]:
+    if halo_type is not enum.DataType.GROUP:
+        return [fname]
+
+    # The groups are split over the numbered files of the catalogue
+    with h5py.File(fname, "r") as f:
+        num_files = int(f["Header"].attrs["NumFiles"])
+
+    return [first_file_regex.sub(f".{i}.hdf5", fname)
+            for i in range(num_files)]
@@ -0,0 +1,157 @@
+from typing import Iterator, List
+
+import numpy as np
+import unyt
+
+
+class RaggedArray:
+    """
+    Rows of values of differing lengths (e.g. the halo masses found in each
+    sphere sample), stored as one flat buffer of values sharing a single
+    unit, alongside the end offset of each row in that buffer.
+    """
+
+    def __init__(self, values: np.ndarray, ends: np.ndarray):
+        self._values = values
+        self._ends = np.asarray(ends, dtype=np.int64)
+
+    @classmethod
+    def from_rows(cls, rows: List[np.ndarray], units=None) -> "RaggedArray":
+        """
+        Packs the list of rows into a ragged array, converting them all to
+        the units of the first row
+        """
+        ends = np.cumsum([len(r) for r in rows], dtype=np.int64)
+
+        if len(rows) > 0 and isinstance(rows[0], unyt.unyt_array):
+            units = rows[0].units
+            values = unyt.unyt_array(
+                np.concatenate([r.to_value(units) for r in rows])
+                .astype(np.float64, copy=False), units)
+        elif len(rows) > 0:
+            values = np.concatenate(rows).astype(np.float64, copy=False)
+        else:
+            values = np.empty(0, dtype=np.float64)
+            if units is not None:
+                values = unyt.unyt_array(values, units)
+
+        return cls(values, ends)
+
+    @classmethod
+    def concatenate(cls, arrays: List["RaggedArray"]) -> "RaggedArray":
+        """
+        Joins the rows of the ragged arrays into one ragged array
+        """
+        arrays = [a for a in arrays if a is not None]
+        if len(arrays) == 0:
+            return cls.from_rows([])
+
+        # Empty arrays may not know their units
+        units = next((a.units for a in arrays if a.units is not None), None)
+
+        values, ends = [], []
+        offset = 0
+        for a in arrays:
+            v = a.values
+            if units is not None and isinstance(v, unyt.unyt_array):
+                v = v.to_value(units)
+            values.append(np.asarray(v))
+            ends.append(a.ends + offset)
+            offset += a.num_values
+
+        values = np.concatenate(values)
+        if units is not None:
+            values = unyt.unyt_array(values, units)
+
+        return cls(values, np.concatenate(ends))
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        The values of all the rows, flattened into one array
+        """
+        return self._values
+
+    @property
+    def ends(self) -> np.ndarray:
+        return self._ends
+
+    @property
+    def starts(self) -> np.ndarray:
+        return np.concatenate(([0], self._ends[:-1])).astype(np.int64)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self._ends, prepend=0)
+
+    @property
+    def num_values(self) -> int:
+        return int(self._ends[-1]) if len(self._ends) > 0 else 0
+
+    @property
+    def units(self):
+        if isinstance(self._values, unyt.unyt_array):
+            return self._values.units
+        return None
+
+    def __len__(self) -> int:
+        return len(self._ends)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return RaggedArray.from_rows(
+                    [self[i] for i in range(start, stop, step)], self.units)
+
+            stop = max(start, stop)
+            lo = int(self._ends[start - 1]) if start > 0 else 0
+            hi = int(self._ends[stop - 1]) if stop > 0 else 0
+            hi = max(lo, hi)
+
+            # The rows share the buffer with this array
+            return RaggedArray(self._values[lo:hi], self._ends[start:stop] - lo)
+
+        i = range(len(self))[item]
+        lo = int(self._ends[i - 1]) if i > 0 else 0
+
+        return self._values[lo:self._ends[i]]
+
+    def to(self, units) -> "RaggedArray":
+        return RaggedArray(self._values.to(units), self._ends)
+
+    def sums(self) -> np.ndarray:
+        """
+        The sum of the values in each row
+        """
+        sums = self._reduce_rows(np.asarray(self._values))
+
+        if self.units is not None:
+            return unyt.unyt_array(sums, self.units)
+        return sums
+
+    def select(self, mask: np.ndarray) -> "RaggedArray":
+        """
+        Keeps only the values where the mask (over the flattened values) is
+        True, keeping the rows they belong to
+        """
+        mask = np.asarray(mask, dtype=bool)
+        counts = self._reduce_rows(mask.astype(np.int64))
+
+        return RaggedArray(self._values[mask], np.cumsum(counts))
+
+    def _reduce_rows(self, values: np.ndarray) -> np.ndarray:
+        sums = np.zeros(len(self), dtype=values.dtype)
+
+        # np.add.reduceat can't give an empty sum, so skip the empty rows,
+        # each row then sums up to the start of the next non empty row
+        nonempty = self.lengths > 0
+        if np.any(nonempty):
+            sums[nonempty] = np.add.reduceat(
+                values[:self.num_values], self.starts[nonempty])
+
+        return sums
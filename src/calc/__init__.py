@@ -1,2 +1,3 @@
-from src.calc import (mass_function, overdensity,  # noqa: F401, E501
-                      press_schechter, rho_bar, std_dev)
+from src.calc import (density_field, mass_function,  # noqa: F401, E501
+                      overdensity, power_spectrum, press_schechter,
+                      rho_bar, sigma_model, std_dev)
@@ -0,0 +1,280 @@
+import datetime
+import itertools
+import logging
+import os
+import time
+from typing import Dict
+
+import numpy as np
+import unyt
+from src.calc import rho_bar
+from src.util import units as u
+from src.util.constants import DENSITY_FIELD_KEY
+
+# Order of the mass assignment schemes, i.e. the number of cells along each
+# axis that a particle is shared between
+ASSIGNMENT_ORDER = {
+    "ngp": 1,
+    "cic": 2,
+    "tsc": 3,
+}
+
+
+class DensityField(rho_bar.RhoBar):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Fourier transform of the mesh of the last data set, reused across
+        # radii
+        self._mesh_ffts: Dict[str, np.ndarray] = {}
+
+    def mesh_fname(self, hf) -> str:
+        conf = self.config.density_field
+
+        basename, _ = os.path.splitext(os.path.basename(hf))
+        fname = f"{basename}_{conf.assignment}_{conf.num_cells}.npy"
+
+        return os.path.join("./data/", self.sim_name, self.type.value,
+                            DENSITY_FIELD_KEY, fname)
+
+    def mesh(self, hf) -> np.memmap:
+        """
+        Gets the particle masses of the data set deposited onto a periodic
+        mesh, as a memory mapped array. The mesh is only calculated if it
+        isn't already cached on disk.
+        """
+        logger = logging.getLogger(__name__ + "." + self.mesh.__name__)
+
+        pth = self.mesh_fname(hf)
+        num_cells = self.config.density_field.num_cells
+
+        use_cache = self.config.caches.use_density_field_cache
+        logger.debug(f"Override density field cache? {not use_cache}")
+
+        if os.path.exists(pth) and use_cache:
+            mesh = np.load(pth, mmap_mode="r")
+            if mesh.shape == (num_cells,) * 3:
+                logger.debug(f"Using cached density field mesh at '{pth}'")
+                return mesh
+
+            logger.warning(
+                f"Cached density field at '{pth}' has shape {mesh.shape}, recalculating...")  # noqa: E501
+
+        logger.debug(
+            f"No density field found for '{hf}', depositing particles...")
+
+        dirname = os.path.dirname(pth)
+        try:
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+        except FileExistsError as fee:
+            logger.error(fee)
+
+        # Deposit into a temporary file, so that an interrupted run can't
+        # leave a partially filled mesh in the cache
+        tmp_pth = pth + ".tmp"
+        mesh = np.lib.format.open_memmap(
+            tmp_pth, mode="w+", dtype=np.float64, shape=(num_cells,) * 3)
+        mesh[:] = 0
+
+        self._deposit(hf, mesh)
+
+        mesh.flush()
+        del mesh
+        os.replace(tmp_pth, pth)
+
+        return np.load(pth, mmap_mode="r")
+
+    def _deposit(self, hf, mesh: np.ndarray):
+        logger = logging.getLogger(__name__ + "." + self._deposit.__name__)
+
+        start = time.time()
+
+        ds = self.dataset_cache.load(hf)
+        ad = self.dataset_cache.all_data(hf)
+
+        num_cells = mesh.shape[0]
+        assignment = self.config.density_field.assignment
+
+        left_edge = ds.domain_left_edge.to("code_length").value
+        box_size = ds.domain_width[0].to("code_length").value
+        cell_size = box_size / num_cells
+
+        logger.info(
+            f"Depositing particles onto a {num_cells}^3 mesh using '{assignment}'")  # noqa: E501
+
+        num_particles = 0
+        # Read the particles chunk by chunk to bound the memory usage
+        for chunk in ad.chunks([], "io"):
+            positions = chunk[self.type.coord_index_x()].to("code_length")
+            masses = chunk[self.type.index].to(u.mass(ds))
+
+            cells = (positions.value - left_edge) / cell_size
+            deposit(mesh, cells, masses.value, assignment)
+
+            num_particles += len(masses)
+            logger.debug(f"Deposited {num_particles} particles...")
+
+        end = time.time()
+        logger.info(
+            f"Deposited {num_particles} particles in {datetime.timedelta(seconds=end - start)}")  # noqa: E501
+
+    def _mesh_fft(self, hf) -> np.ndarray:
+        logger = logging.getLogger(__name__ + "." + self._mesh_fft.__name__)
+
+        if hf not in self._mesh_ffts:
+            # Only one transform is held at a time, as each is mesh sized
+            self._mesh_ffts.clear()
+
+            mesh = self.mesh(hf)
+            logger.debug("Calculating the Fourier transform of the mesh")
+
+            self._mesh_ffts[hf] = np.fft.rfftn(mesh)
+
+        return self._mesh_ffts[hf]
+
+    def sphere_masses(self, hf, radius) -> unyt.unyt_array:
+        """
+        Calculates the mass enclosed within a sphere of the given radius
+        centred on every cell of the mesh, by convolving the mesh with a
+        top-hat kernel in Fourier space.
+        """
+        logger = logging.getLogger(
+            __name__ + "." + self.sphere_masses.__name__)
+
+        ds = self.dataset_cache.load(hf)
+
+        num_cells = self.config.density_field.num_cells
+        assignment = self.config.density_field.assignment
+
+        box_size = ds.domain_width[0].to("code_length").value
+        R = ds.quan(radius, u.length_cm(ds)).to("code_length").value
+
+        cell_size = box_size / num_cells
+        if R < cell_size:
+            logger.warning(
+                f"Radius {radius} is smaller than the mesh cell size, the sphere masses will be unresolved")  # noqa: E501
+
+        mesh_k = self._mesh_fft(hf)
+
+        fx, fy, fz = grid_frequencies(num_cells)
+        kR = 2 * np.pi * np.sqrt(fx**2 + fy**2 + fz**2) * num_cells * R / box_size  # noqa: E501
+
+        # Deconvolve the smoothing applied by the mass assignment
+        window = assignment_window(fx, fy, fz, assignment)
+
+        V = 4 / 3 * np.pi * R**3
+        kernel = V / cell_size**3 * top_hat(kR) / window
+
+        logger.debug(f"Convolving mesh with top-hat of radius {R}")
+        masses = np.fft.irfftn(mesh_k * kernel, s=(num_cells,) * 3)
+
+        return ds.arr(masses.ravel(), u.mass(ds))
+
+    def overdensities(self, hf, radius) -> unyt.unyt_array:
+        """
+        Calculates the overdensity of a sphere of the given radius centred
+        on every cell of the mesh
+        """
+        logger = logging.getLogger(
+            __name__ + "." + self.overdensities.__name__)
+
+        ds = self.dataset_cache.load(hf)
+
+        masses = self.sphere_masses(hf, radius)
+
+        # The mean mass of a sphere, taken from the mesh so that the
+        # overdensities have zero mean
+        mesh = self.mesh(hf)
+        box_size = ds.domain_width[0].to("code_length").value
+        R = ds.quan(radius, u.length_cm(ds)).to("code_length").value
+        mean_mass = np.sum(mesh) * (4 / 3 * np.pi * R**3) / box_size**3
+
+        deltas = masses.value / mean_mass - 1
+
+        logger.info(
+            f"Calculated {len(deltas)} overdensities from the density field at r={radius}")  # noqa: E501
+
+        return unyt.unyt_array(deltas, "dimensionless")
+
+
+def deposit(mesh: np.ndarray, cells: np.ndarray, masses: np.ndarray, assignment: str = "cic"):
+    """
+    Deposits the particle masses onto the periodic mesh, with the particle
+    positions given in units of the mesh cell size
+    """
+    num_cells = mesh.shape[0]
+
+    # Nearest cell to each particle, and the offset from its centre
+    nearest = np.floor(cells)
+    d = cells - (nearest + 0.5)
+
+    # The cells each particle contributes to along each axis, and the
+    # weights of the contributions
+    if assignment == "ngp":
+        stencil = [(nearest, np.ones_like(d))]
+    elif assignment == "cic":
+        lower = np.where(d < 0, nearest - 1, nearest)
+        f = np.where(d < 0, d + 1, d)
+        stencil = [(lower, 1 - f), (lower + 1, f)]
+    elif assignment == "tsc":
+        stencil = [(nearest - 1, 0.5 * (0.5 - d)**2),
+                   (nearest, 0.75 - d**2),
+                   (nearest + 1, 0.5 * (0.5 + d)**2)]
+    else:
+        raise ValueError(f"Unknown mass assignment scheme '{assignment}'")
+
+    idxs, weights = [], []
+    for sx, sy, sz in itertools.product(stencil, repeat=3):
+        ix = sx[0][:, 0].astype(np.int64) % num_cells
+        iy = sy[0][:, 1].astype(np.int64) % num_cells
+        iz = sz[0][:, 2].astype(np.int64) % num_cells
+
+        idxs.append((ix * num_cells + iy) * num_cells + iz)
+        weights.append(masses * sx[1][:, 0] * sy[1][:, 1] * sz[1][:, 2])
+
+    # Only sum into the cells the particles touch, rather than a whole mesh
+    # sized array per chunk
+    cells, inverse = np.unique(np.concatenate(idxs), return_inverse=True)
+    deposited = np.bincount(inverse.ravel(), weights=np.concatenate(weights),
+                            minlength=len(cells))
+
+    flat = mesh.reshape(-1)
+    flat[cells] += deposited
+
+
+def grid_frequencies(num_cells: int):
+    """
+    The (sparse) frequencies of the real FFT of the mesh, in cycles per cell
+    """
+    fx = np.fft.fftfreq(num_cells)
+    fz = np.fft.rfftfreq(num_cells)
+
+    return np.meshgrid(fx, fx, fz, indexing="ij", sparse=True)
+
+
+def assignment_window(fx, fy, fz, assignment: str = "cic") -> np.ndarray:
+    """
+    Fourier transform of the smoothing applied to the field by the mass
+    assignment scheme
+    """
+    p = ASSIGNMENT_ORDER[assignment]
+
+    return (np.sinc(fx) * np.sinc(fy) * np.sinc(fz))**p
+
+
+def top_hat(x: np.ndarray) -> np.ndarray:
+    """
+    Fourier transform of the spherical top-hat window, normalised to 1 at
+    x = kR = 0
+    """
+    x = np.asarray(x, dtype=np.float64)
+    w = np.ones_like(x)
+
+    nz = x > 1e-4
+    xn = x[nz]
+    w[nz] = 3 * (np.sin(xn) - xn * np.cos(xn)) / xn**3
+    # Series expansion to avoid cancellation errors at small kR
+    w[~nz] = 1 - x[~nz]**2 / 10
+
+    return w
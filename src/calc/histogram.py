@@ -0,0 +1,203 @@
+from typing import Iterable, Tuple
+
+import numpy as np
+import unyt
+
+EDGES_KEY = "edges"
+COUNTS_KEY = "counts"
+VOLUME_KEY = "volume"
+STATS_KEY = "stats"
+
+
+class LogHistogram:
+    """
+    Counts of masses in fixed log spaced bins, alongside the volume the
+    masses were found in. Histograms sharing the same edges (i.e. from other
+    radii, ranks or redshifts) can be merged without rebinning the masses.
+    """
+
+    def __init__(self, edges: unyt.unyt_array, counts: np.ndarray = None, volume: unyt.unyt_quantity = None):  # noqa: E501
+        self._edges = edges
+        self._counts = np.zeros(len(edges) - 1, dtype=np.int64) \
+            if counts is None else np.asarray(counts, dtype=np.int64)
+        self._volume = volume
+
+        # Summary statistics of all the masses added, in the units of the
+        # edges
+        self.num_masses = 0
+        self.num_skipped = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @classmethod
+    def from_range(cls, lo: float, hi: float, num_bins: int, units, volume: unyt.unyt_quantity = None) -> "LogHistogram":  # noqa: E501
+        edges = unyt.unyt_array(np.geomspace(lo, hi, num_bins + 1), units)
+
+        return cls(edges, volume=volume)
+
+    @property
+    def edges(self) -> unyt.unyt_array:
+        return self._edges
+
+    @property
+    def counts(self) -> np.ndarray:
+        return self._counts
+
+    @property
+    def volume(self) -> unyt.unyt_quantity:
+        return self._volume
+
+    @property
+    def centres(self) -> unyt.unyt_array:
+        """
+        The geometric centre of each bin
+        """
+        return np.sqrt(self._edges[:-1] * self._edges[1:])
+
+    @property
+    def num_outside(self) -> int:
+        """
+        The number of masses added that fell outside of the edges
+        """
+        return self.num_masses - int(np.sum(self._counts))
+
+    def add(self, masses, chunk_size: int = None) -> "LogHistogram":
+        """
+        Counts the masses into the bins chunk by chunk, so that (memory
+        mapped) masses are only read into memory one chunk at a time. Masses
+        that aren't positive (i.e. rockstar's placeholder halos) are skipped.
+        """
+        units = self._edges.units
+        log_edges = np.log10(self._edges.value)
+
+        chunk_size = chunk_size or max(len(masses), 1)
+        for start in range(0, len(masses), chunk_size):
+            chunk = masses[start:start + chunk_size]
+            if isinstance(chunk, unyt.unyt_array):
+                chunk = chunk.to_value(units)
+            chunk = np.asarray(chunk, dtype=np.float64)
+
+            positive = chunk > 0
+            self.num_skipped += len(chunk) - int(np.count_nonzero(positive))
+            chunk = chunk[positive]
+            if len(chunk) == 0:
+                continue
+
+            self._counts += np.histogram(np.log10(chunk), bins=log_edges)[0]
+
+            self.num_masses += len(chunk)
+            self.total += float(np.sum(chunk))
+            self.min = min(self.min, float(np.min(chunk)))
+            self.max = max(self.max, float(np.max(chunk)))
+
+        return self
+
+    def merge(self, other: "LogHistogram") -> "LogHistogram":
+        """
+        Combines the counts, volumes and statistics of the two histograms,
+        which must share the same edges
+        """
+        if len(other.edges) != len(self._edges) or \
+                not np.allclose(other.edges.to_value(self._edges.units),
+                                self._edges.value):
+            raise ValueError("Can't merge histograms with different edges")
+
+        volume = self._volume
+        if volume is None:
+            volume = other.volume
+        elif other.volume is not None:
+            volume = volume + other.volume
+
+        merged = LogHistogram(self._edges, self._counts + other.counts, volume)
+        merged.num_masses = self.num_masses + other.num_masses
+        merged.num_skipped = self.num_skipped + other.num_skipped
+        merged.total = self.total + other.total
+        merged.min = min(self.min, other.min)
+        merged.max = max(self.max, other.max)
+
+        return merged
+
+    def __add__(self, other: "LogHistogram") -> "LogHistogram":
+        return self.merge(other)
+
+    @classmethod
+    def reduce(cls, hists: Iterable["LogHistogram"]) -> "LogHistogram":
+        """
+        Merges the partial histograms (i.e. from each rank) into one
+        """
+        hists = [h for h in hists if h is not None]
+        if len(hists) == 0:
+            return None
+
+        merged = hists[0]
+        for h in hists[1:]:
+            merged = merged.merge(h)
+
+        return merged
+
+    def number_density(self) -> unyt.unyt_array:
+        """
+        The number of masses in each bin per unit of the volume sampled
+        """
+        if self._volume is None:
+            raise ValueError("Histogram has no sampling volume")
+
+        return self._counts / self._volume
+
+    def nonzero(self) -> Tuple[unyt.unyt_array, unyt.unyt_array]:
+        """
+        The number densities of the non-empty bins, alongside the centres of
+        those bins
+        """
+        valid_idxs = np.where(self._counts > 0)
+
+        return self.number_density()[valid_idxs], self.centres[valid_idxs]
+
+    def stats(self) -> dict:
+        units = self._edges.units
+
+        return {
+            "num_masses": self.num_masses,
+            "num_skipped": self.num_skipped,
+            "num_outside": self.num_outside,
+            "min": unyt.unyt_quantity(self.min, units),
+            "max": unyt.unyt_quantity(self.max, units),
+            "total": unyt.unyt_quantity(self.total, units),
+        }
+
+    def to_dict(self) -> dict:
+        """
+        Compact form of the histogram for caching, the edges being stored by
+        their range and number as they are log spaced
+        """
+        units = str(self._edges.units)
+        volume = None
+        if self._volume is not None:
+            volume = (float(self._volume.value), str(self._volume.units))
+
+        return {
+            EDGES_KEY: (float(self._edges[0].value),
+                        float(self._edges[-1].value), len(self._counts),
+                        units),
+            COUNTS_KEY: self._counts,
+            VOLUME_KEY: volume,
+            STATS_KEY: (self.num_masses, self.num_skipped, self.total,
+                        self.min, self.max),
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict, registry=None) -> "LogHistogram":
+        lo, hi, num_bins, units = d[EDGES_KEY]
+        edges = unyt.unyt_array(np.geomspace(lo, hi, num_bins + 1), units,
+                                registry=registry)
+
+        volume = None
+        if d[VOLUME_KEY] is not None:
+            volume = unyt.unyt_quantity(*d[VOLUME_KEY], registry=registry)
+
+        hist = cls(edges, d[COUNTS_KEY], volume)
+        hist.num_masses, hist.num_skipped, hist.total, hist.min, hist.max = \
+            d[STATS_KEY]
+
+        return hist
@@ -1,61 +1,36 @@
 import logging
-from typing import Tuple
 
 import numpy as np
 import src.calc.sample as sample
-import unyt
 import yt
-from src.util import enum
+from src.calc.histogram import LogHistogram
+from src.util import enum, parallel
 from src.util import units as u
-from src.util.constants import MASS_FUNCTION_KEY, TOTAL_MASS_FUNCTION_KEY
+from src.util.constants import (MASS_FUNCTION_KEY, TOTAL_MASS_FUNCTION_KEY,
+                                TOTAL_MASS_HIST_KEY)
 
 
 class MassFunction(sample.Sampler):
 
-    def total_mass_function(self, hf) -> Tuple[np.ndarray, np.ndarray]:
+    def total_mass_function(self, hf) -> LogHistogram:
         # Only need to run this once per file, so run only on root
-        if not yt.is_root():
-            return
+        if not parallel.is_root():
+            return None
 
         logger = logging.getLogger(
             __name__ + "." + self.total_mass_function.__name__)
 
         logger.debug("Calculating total mass function...")
 
-        # Load in the halo data set, potentially from
-        # a cache to optimise it
-        ds = self.dataset_cache.load(hf)
-
-        # Get the redshift from the data set
-        z = ds.current_redshift
-
-        # Cache the masses if they are not already
-
-        # Get the cached values
-        masses = self.cache_total_mass_function(hf)
-        if masses is None:
+        # Only the histogram of the masses is cached
+        hist = self.total_mass_histogram(hf)
+        if hist is None:
             logger.debug("Skipping plotting this total mass function...")
-            return None, None
-
-        if len(masses) > 0:
-            logger.info(f"Mass units are: {masses.units}")
+            return None
 
-        hist, bins = create_histogram(masses, self.config.sampling.num_hist_bins)
+        logger.info(f"Volume units are: {hist.volume.units}")
 
-        # Calculate the scale factor
-        a = 1 / (1+z)
-
-        # Calculate the area of the box (is a cube)
-        sim_size = ds.domain_width[0].to(u.length(ds))
-        V = (a * sim_size)**3
-
-        logger.info(f"Volume units are: {V.units}")
-
-        # Divide the number of halos per bin by the
-        # volume to get the number density
-        hist = (hist / V).to(1 / u.volume(ds))
-
-        return hist, bins
+        return hist
 
     def cache_total_mass_function(self, hf: str):
         """
@@ -85,23 +60,8 @@ class MassFunction(sample.Sampler):
 
             logger.debug(f"No masses cached for '{hf}' data set, caching...")
 
-            # Try to read all the particle data from the data set
-            # (can error with the earlierredshift data sets due
-            # to box issues??)
-            try:
-                ad = self.dataset_cache.all_data(hf)
-            except TypeError as te:
-                logger.error("error reading all_data(), ignoring...")
-                logger.error(te)
-                return
-
-            logger.info("Reading all halos in data set")
-            # Get the halo virial masses from the data
-            try:
-                masses = ad[self.type.index]
-            except yt.utilities.exceptions.YTFieldNotFound as ytfnf:
-                logger.error(f"error reading masses from dataset!")
-                logger.error(ytfnf)
+            masses = self._read_total_masses(hf)
+            if masses is None:
                 return
 
             if self.type is enum.DataType.ROCKSTAR:
@@ -119,7 +79,122 @@ class MassFunction(sample.Sampler):
 
         return masses
 
-    def mass_function(self, hf, radius):
+    def total_mass_histogram(self, hf: str) -> LogHistogram:
+        """
+        Bins the masses of all the halos in the data set into the fixed log
+        spaced bins, streaming the mass column through in chunks so that only
+        the histogram and the summary statistics of the masses are cached
+        """
+        logger = logging.getLogger(
+            __name__ + "." + self.total_mass_histogram.__name__)
+
+        ds = self.dataset_cache.load(hf)
+        z = ds.current_redshift
+
+        key = (hf, self.type.value, TOTAL_MASS_HIST_KEY, z)
+        results = self.cache[key].val
+        needs_recalculation = results is None
+        needs_recalculation |= not self.config.caches.use_total_cache
+
+        if needs_recalculation:
+            logger.debug(
+                f"Calculating cache values for '{TOTAL_MASS_HIST_KEY}'...")
+
+            # Calculate the scale factor
+            a = 1 / (1+z)
+
+            # Calculate the volume of the box (is a cube)
+            sim_size = ds.domain_width[0].to(u.length(ds))
+            V = ((a * sim_size)**3).to(u.volume(ds))
+
+            hist = self._histogram(ds, V)
+
+            # Caching the raw masses too if they are wanted, which needs
+            # them all in memory, otherwise they are streamed through
+            if self.config.caches.keep_total_masses:
+                masses = self.cache_total_mass_function(hf)
+                if masses is None:
+                    return None
+
+                hist.add(masses, self.config.sampling.hist_chunk_size)
+
+            elif not self._add_total_masses(hf, hist):
+                return None
+
+            logger.info(f"Binned the masses of {hist.stats()}")
+
+            self.cache[key] = hist.to_dict()
+
+        else:
+            logger.debug("Using cached total mass histogram...")
+            hist = LogHistogram.from_dict(results, ds.unit_registry)
+
+        return hist
+
+    def _histogram(self, ds, volume) -> LogHistogram:
+        """
+        An empty histogram with the (fixed) mass bins shared by all the mass
+        functions
+        """
+        sampling = self.config.sampling
+
+        return LogHistogram.from_range(
+            sampling.hist_min_mass, sampling.hist_max_mass,
+            sampling.num_hist_bins, u.mass(ds), volume)
+
+    def _read_total_masses(self, hf: str):
+        logger = logging.getLogger(
+            __name__ + "." + self._read_total_masses.__name__)
+
+        # Try to read all the particle data from the data set
+        # (can error with the earlierredshift data sets due
+        # to box issues??)
+        logger.info("Reading all halos in data set")
+        # Get the halo virial masses from the data (prefetched if
+        # declared by the task, or memory mapped if exported)
+        try:
+            return self.dataset_cache.field(hf, self.type.index)
+        except TypeError as te:
+            logger.error("error reading all_data(), ignoring...")
+            logger.error(te)
+        except yt.utilities.exceptions.YTFieldNotFound as ytfnf:
+            logger.error("error reading masses from dataset!")
+            logger.error(ytfnf)
+
+        return None
+
+    def _add_total_masses(self, hf: str, hist: LogHistogram) -> bool:
+        """
+        Bins the masses of all the halos chunk by chunk, returning whether
+        they could be read
+        """
+        logger = logging.getLogger(
+            __name__ + "." + self._add_total_masses.__name__)
+
+        # Try to read all the particle data from the data set
+        # (can error with the earlierredshift data sets due
+        # to box issues??)
+        logger.info("Reading all halos in data set")
+        # Stream the halo virial masses from the data (memory mapped if
+        # exported, prefetched if declared by the task, otherwise through
+        # yt's IO chunks)
+        chunk_size = self.config.sampling.hist_chunk_size
+        try:
+            for masses in self.dataset_cache.field_chunks(
+                    hf, self.type.index, chunk_size):
+                hist.add(masses, chunk_size)
+
+            return True
+        except TypeError as te:
+            logger.error("error reading all_data(), ignoring...")
+            logger.error(te)
+        except yt.utilities.exceptions.YTFieldNotFound as ytfnf:
+            logger.error("error reading masses from dataset!")
+            logger.error(ytfnf)
+
+        return False
+
+    def mass_function(self, hf, radius) -> LogHistogram:
         logger = logging.getLogger(
             __name__ + "." + self.mass_function.__name__)
 
@@ -153,15 +228,12 @@ class MassFunction(sample.Sampler):
 
         logger.info(f"Mass units are: {masses.units}")
 
-        mass_hist, mass_bin_edges = create_histogram(masses, self.config.sampling.num_hist_bins)
-
         # Scale the histogram bins by the total volume sampled.
         a = 1 / (1+z)
-        V = 4/3 * np.pi * (a*radius)**3 * num_sphere_samples
-
-        mass_hist = mass_hist / V
+        V = ds.quan(4/3 * np.pi * (a*radius)**3 * num_sphere_samples,
+                    u.volume(ds))
 
-        return mass_hist, mass_bin_edges
+        return self._histogram(ds, V).add(masses)
 
     def sample_masses(self, hf, radius):
         """
@@ -179,35 +251,12 @@ class MassFunction(sample.Sampler):
 
         sphere_samples = self.sample(hf, radius, z)
 
-        # Convert the list of masses per sample, into a 1D list
-        masses = ds.arr([], u.mass(ds))
+        # The masses of all the samples are already stored as one flat array
+        masses = sphere_samples.values
 
         logger.info(f"Masses units are: {masses.units}")
 
-        for m in sphere_samples:
-            # Ensure the units match
-            m = m.to(masses.units)
-            masses = unyt.uconcatenate((masses, m))
-
         # Convert mass units to Msun
         masses = masses.to(u.mass(ds))
 
         return masses
-
-
-def create_histogram(masses: unyt.unyt_array, bins) -> Tuple[
-        np.ndarray,
-        np.ndarray]:
-    logger = logging.getLogger(__name__ + "." + create_histogram.__name__)
-
-    logger.debug("Creating histogram")
-
-    hist, bins = np.histogram(masses,
-                              bins=bins)
-
-    # Filter hist/bins for non-zero masses
-    valid_idxs = np.where(hist > 0)
-    hist = hist[valid_idxs]
-    bins = bins[valid_idxs]
-
-    return hist, bins
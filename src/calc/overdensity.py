@@ -1,19 +1,36 @@
 import logging
-import math
+from typing import Dict, Tuple
 
 import numpy as np
 import unyt
-from src.calc import rho_bar
+from src.cache.ragged import RaggedArray
+from src.calc import density_field, rho_bar
+from src.fitting import estimators
+from src.util import enum
 from src.util.constants import OVERDENSITIES_KEY
 from src.util import units as u
 
 
 class Overdensity(rho_bar.RhoBar):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Factors converting the sphere masses to overdensities, by data
+        # set, radius and mass units
+        self._delta_factors: Dict[tuple, float] = {}
+        # Reused across radii, so the Fourier transform of the mesh is only
+        # calculated once
+        self._field: density_field.DensityField = None
+
     def calc_overdensities(self, hf, radius):
         logger = logging.getLogger(
             __name__ + "." + self.calc_overdensities.__name__)
 
+        # Snapshots can take the overdensities from the full density field
+        if self.uses_density_field():
+            logger.debug("Calculating overdensities from the density field...")
+            return self._density_field().overdensities(hf, radius)
+
         logger.debug(
             f"Calculating cache values for '{OVERDENSITIES_KEY}'...")
 
@@ -26,8 +43,11 @@ class Overdensity(rho_bar.RhoBar):
         # Attempt to get the existing overdensities if they exist
         key = (hf, self.type.value, OVERDENSITIES_KEY, z, float(radius))
 
-        # Determine if new entries need to be calculates
-        deltas = self.cache[key].val
+        # Determine if new entries need to be calculates, only reading as
+        # many overdensities as are needed from the cache
+        deltas = None
+        if self.config.caches.use_overdensities_cache:
+            deltas = self.cache[key].read(0, num_sphere_samples)
         needs_recalculation = deltas is None
 
         # Calculation required if not enough entries cached
@@ -36,6 +56,14 @@ class Overdensity(rho_bar.RhoBar):
             logger.debug(
                 f"Cache entries exist: Have {amount_entries}, need {num_sphere_samples}")  # noqa: E501
             needs_recalculation = amount_entries < num_sphere_samples
+            # Fewer entries are enough if they had already converged to
+            # within the tolerance
+            if needs_recalculation and self.config.sampling.converge_std_dev:
+                convergence = self.get_convergence(hf, radius, z)
+                if convergence is not None:
+                    num_converged, tol = convergence
+                    needs_recalculation = amount_entries < num_converged or \
+                        tol > self.config.sampling.overdensity_std_dev_tol
             logger.debug(f"Need more calculations: {needs_recalculation}")
         # Could force recalculation
         needs_recalculation |= not self.config.caches.use_overdensities_cache
@@ -47,66 +75,125 @@ class Overdensity(rho_bar.RhoBar):
         if needs_recalculation:
             # Do the full sampling and save the cache to disk
 
+            # The overdensities already on disk, which only need appending to
+            num_saved = len(deltas) if deltas is not None else 0
+
             # Increase the sampling size per iteration until the std dev
             # converges
+            converged_tol = None
             if self.config.sampling.converge_std_dev:
-                std_dev_tol = self.config.sampling.overdensity_std_dev_tol
-                logger.debug(
-                    f"Running iterations until the standard deviation converges to within {std_dev_tol}")
-
-                prev_std_dev, std_dev = 0, -1
-                upper_lim_num_sp_samples = self.config.sampling.num_sp_samples
-
-                self.config.sampling.num_sp_samples = self.config.sampling.sample_iteration
-                logger.info(
-                    f"Initial number of sphere samples = {self.config.sampling.num_sp_samples}")
-
-                while not math.isclose(std_dev, prev_std_dev, abs_tol=std_dev_tol) \
-                        or self.config.sampling.num_sp_samples <= upper_lim_num_sp_samples:
-                    prev_std_dev = std_dev
-                    deltas = self._overdensities(hf, radius)
-                    std_dev = np.std(deltas)
-                    logger.debug(f"Old Std dev: {prev_std_dev}")
-                    logger.debug(f"New std dev: {std_dev}")
-                    self.config.sampling.num_sp_samples += self.config.sampling.sample_iteration
-                    logger.debug(
-                        f"Increasing number of sphere samples to: {self.config.sampling.num_sp_samples}")
-
-                logger.info(
-                    f"Took {self.config.sampling.num_sp_samples} sphere samples to converge!")
+                deltas, converged = self._converge_overdensities(
+                    hf, radius, deltas, num_sphere_samples)
+                if converged:
+                    converged_tol = \
+                        self.config.sampling.overdensity_std_dev_tol
             else:
-                num_samples = self.config.sampling.num_sp_samples
                 logger.debug(
-                    f"Running overdensity calculation for {num_samples} iterations...")
-                deltas = self._overdensities(hf, radius)
+                    f"Running overdensity calculation for {num_sphere_samples} iterations...")  # noqa: E501
+                deltas = self._overdensities(hf, radius, existing=deltas)
 
             # Cache the new values
-            self.cache[key] = deltas
+            if num_saved == 0:
+                self.cache[key] = deltas
+            elif len(deltas) > num_saved:
+                self.cache[key].append(deltas[num_saved:])
             # Keep a record of the number of samples used...
-            self.save_num_samples(
-                hf, radius, z, self.config.sampling.num_sp_samples)
+            self.save_num_samples(hf, radius, z, len(deltas), converged_tol)
         else:
             logger.debug("Using cached overdensities...")
 
         return deltas
 
-    def _overdensities(self, hf, radius):
+    def _converge_overdensities(self, hf, radius, existing: unyt.unyt_array, max_num_samples: int) -> Tuple[unyt.unyt_array, bool]:  # noqa: E501
         """
-        Calculates the overdensities of a sample of spheres
-        of a given radius over the given dataset, if there
-        are existing samples, only calculates the extra
-        samples required to get the total desired.
+        Draws batches of overdensities, reusing all the earlier ones, until
+        the error on their standard deviation is within the tolerance or the
+        maximum number of samples is reached, returning the overdensities
+        and whether they converged
         """
         logger = logging.getLogger(
-            __name__ + "." + self._overdensities.__name__)
+            __name__ + "." + self._converge_overdensities.__name__)
 
-        # Load the (cached?) data set
-        ds = self.dataset_cache.load(hf)
+        std_dev_tol = self.config.sampling.overdensity_std_dev_tol
+        batch_size = self.config.sampling.sample_iteration or \
+            self.config.sampling.sphere_sample_iteration
+        logger.debug(
+            f"Running iterations until the standard deviation converges to within {std_dev_tol}")  # noqa: E501
 
-        z = ds.current_redshift
-        logger.debug(f"Redshift z={z}")
+        deltas = existing
+        num_samples = len(deltas) if deltas is not None else 0
+        num_samples = min(max(num_samples, batch_size), max_num_samples)
+        logger.info(f"Initial number of sphere samples = {num_samples}")
+
+        # The moments are updated with each new batch of samples only
+        moments = estimators.Moments()
+        while True:
+            deltas = self._overdensities(
+                hf, radius, existing=deltas, num_samples=num_samples)
+            moments.update(deltas[moments.n:])
+
+            converged = self._converged(deltas, moments)
+            if converged or num_samples >= max_num_samples:
+                break
+
+            num_samples = min(num_samples + batch_size, max_num_samples)
+            logger.debug(
+                f"Increasing number of sphere samples to: {num_samples}")
+
+        if converged:
+            logger.info(
+                f"Took {len(deltas)} sphere samples to converge at r={radius}")
+        else:
+            logger.warning(
+                f"Standard deviation not converged at r={radius} after {len(deltas)} sphere samples")  # noqa: E501
+
+        return deltas, converged
+
+    def _converged(self, deltas: unyt.unyt_array, moments: estimators.Moments = None) -> bool:  # noqa: E501
+        """
+        Whether the standard error of the standard deviation of the
+        overdensities is within the tolerance
+        """
+        logger = logging.getLogger(__name__ + "." + self._converged.__name__)
+
+        if self.config.sampling.std_dev_error == estimators.BOOTSTRAP_ERROR:
+            std_error = estimators.bootstrap_std_error(
+                deltas, self.config.sampling.num_bootstrap_resamples)
+        else:
+            if moments is None:
+                moments = estimators.Moments.of(deltas)
+            std_error = moments.std_error()
+
+        logger.debug(
+            f"Std dev of {len(deltas)} overdensities has error {std_error}")
+
+        return std_error < self.config.sampling.overdensity_std_dev_tol
 
-        sphere_samples = self.sample(hf, radius, z)
+    def _density_field(self) -> density_field.DensityField:
+        if self._field is None:
+            self._field = density_field.DensityField(
+                self, self.type, self.sim_name)
+
+        return self._field
+
+    def uses_density_field(self) -> bool:
+        return self.type is enum.DataType.SNAPSHOT and \
+            self.config.density_field.enabled
+
+    def _delta_factor(self, hf, radius, mass_units: str) -> float:
+        """
+        The factor converting the (raw) total mass of a sphere of the given
+        radius to its density relative to the mean density, 1 / (V rho_bar),
+        resolved once per data set and radius
+        """
+        logger = logging.getLogger(
+            __name__ + "." + self._delta_factor.__name__)
+
+        key = (hf, radius, mass_units)
+        if key in self._delta_factors:
+            return self._delta_factors[key]
+
+        ds = self.dataset_cache.load(hf)
 
         # Get the units used in the simulation
         # Convert the given radius to an unyt unit object
@@ -119,36 +206,70 @@ class Overdensity(rho_bar.RhoBar):
         # Get existing rhos
         rb = self.rho_bar(hf).to(u.density_cm(ds))
 
-        deltas = []
-
         logger.info(f"Given rho_bar = {rb}")
         logger.info(f"Radius units are: {R.units}")
         logger.info(f"Volume of sphere is: {V}")
 
-        total_mass = ds.quan(0, u.mass(ds))
-        rho = unyt.unyt_quantity(0)
+        unit_mass = ds.quan(1, mass_units)
 
-        for sphere_sample in sphere_samples:
-            total_mass = np.sum(sphere_sample)
-            total_mass = total_mass.to(u.mass(ds))
+        factor = float((unit_mass / (V * rb)).to("dimensionless").value)
+        self._delta_factors[key] = factor
 
-            # Get the density
-            rho = total_mass / V
+        return factor
 
-            # Ensure the density units match to get a dimensionless quantity
-            rho = rho.to(rb.units)
+    def _overdensities(self, hf, radius, existing: unyt.unyt_array = None, num_samples: int = None):  # noqa: E501
+        """
+        Calculates the overdensities of a sample of spheres
+        of a given radius over the given dataset, if there
+        are existing overdensities, only calculates the extra
+        samples required to get the total desired (the configured
+        number of samples unless given).
+        """
+        logger = logging.getLogger(
+            __name__ + "." + self._overdensities.__name__)
 
-            # The overdensity
-            delta = (rho - rb) / rb
+        # Load the (cached?) data set
+        ds = self.dataset_cache.load(hf)
+
+        z = ds.current_redshift
+        logger.debug(f"Redshift z={z}")
 
-            deltas.append(delta)
+        sphere_samples = self.sample(hf, radius, z, num_samples)
 
-        logger.info(f"Total mass units are: {total_mass.units}")
-        logger.info(f"Rho units are: {rho.units}")
+        # Only the samples beyond the existing overdensities are needed
+        num_existing = len(existing) if existing is not None else 0
+        if num_existing >= len(sphere_samples):
+            return existing[:len(sphere_samples)]
+        sphere_samples = sphere_samples[num_existing:]
+
+        # Samples without any halos don't know the units of their masses,
+        # which are all 0 so take the units of the data set
+        mass_units = sphere_samples.units
+        if mass_units is None or sphere_samples.num_values == 0:
+            mass_units = u.mass(ds)
+
+        factor = self._delta_factor(hf, radius, str(mass_units))
+        logger.debug(f"Mass to overdensity conversion factor = {factor}")
 
         # Return the units array of overdensities
-        unyt_deltas = unyt.unyt_array(deltas, delta.units)
+        unyt_deltas = unyt.unyt_array(
+            sphere_overdensities(sphere_samples, factor), "dimensionless")
 
         logger.info(f"Deltas units are: {unyt_deltas.units}")
 
+        if num_existing > 0:
+            unyt_deltas = unyt.uconcatenate(
+                (existing, unyt_deltas.to(existing.units)))
+
         return unyt_deltas
+
+
+def sphere_overdensities(sphere_samples: RaggedArray, factor: float) -> np.ndarray:  # noqa: E501
+    """
+    Calculates the overdensities of all the sphere samples at once on the
+    raw mass values, delta = M / (V rho_bar) - 1, where the factor is
+    1 / (V rho_bar) in the units of the sample masses
+    """
+    total_masses = np.asarray(sphere_samples.sums(), dtype=np.float64)
+
+    return total_masses * factor - 1
@@ -0,0 +1,228 @@
+import atexit
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Tuple
+
+import numpy as np
+
+# Number of chunks each worker's share of the centres is split into, so that
+# slow spheres don't leave the other workers idle
+CHUNKS_PER_WORKER = 4
+
+# The sampler of each worker process, set up once when the worker starts
+_worker = {}
+
+_pool = None
+
+
+def _init_worker(config, type_value: str, sim_name: str, hf: str):
+    from src.cache import caching, columns, dataset
+    from src.calc import sample
+    from src.util import data, enum
+    from src.util.init import setup
+
+    # Spawned workers start without the parent's logging and cache backend
+    setup.setup_logging()
+    caching.set_default_backend(config.caches.backend)
+
+    cols = columns.ColumnStore() if config.caches.use_column_store else None
+    ds_cache = dataset.new(int(config.caches.dataset_cache_bytes), cols,
+                           int(config.caches.dataset_cache_entries),
+                           int(config.caches.dataset_base_bytes))
+
+    d = data.Data(config, ds_cache, caching.Cache())
+    sampler = sample.Sampler(d, enum.DataType(type_value), sim_name)
+
+    # Open the data set once, for all the spheres read by this worker
+    ds = sampler.dataset_cache.load(hf)
+
+    _worker["sampler"] = sampler
+    _worker["ds"] = ds
+    _worker["hf"] = hf
+
+
+def _sample_chunk(start: int, centres: np.ndarray, R: float, with_distances: bool) -> Tuple[str, np.ndarray, str]:  # noqa: E501
+    """
+    Reads the spheres around the centres (in code_length) in the worker,
+    returning the name of the shared memory block the masses (followed by
+    the distances) are written to, the number of halos in each sphere (-1
+    if the sample errored) and the units of the masses
+    """
+    sampler, ds, hf = _worker["sampler"], _worker["ds"], _worker["hf"]
+
+    R = ds.quan(R, "code_length")
+
+    masses, dists = [], []
+    lengths = np.full(len(centres), -1, dtype=np.int64)
+    units = ""
+
+    for i, c in enumerate(centres):
+        res = sampler._read_sphere(
+            hf, start + i, ds.arr(c, "code_length"), R,
+            with_distances=with_distances)
+        if res is None:
+            continue
+
+        m = res[0] if with_distances else res
+        if with_distances:
+            dists.append(res[1])
+
+        lengths[i] = len(m)
+        units = str(m.units)
+        masses.append(m.value)
+
+    flat = np.concatenate(masses + dists) if len(masses) > 0 else np.empty(0)
+    flat = flat.astype(np.float64, copy=False)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(flat.nbytes, 1))
+    np.ndarray(flat.shape, dtype=np.float64, buffer=shm.buf)[:] = flat
+
+    # The parent process unlinks the block once it has read it
+    name = shm.name
+    shm.close()
+    resource_tracker.unregister(shm._name, "shared_memory")
+
+    return name, lengths, units
+
+
+class SamplePool:
+    """
+    Pool of worker processes that read the sphere samples of one data set,
+    for single node runs without MPI
+    """
+
+    def __init__(self, config, type_value: str, sim_name: str, hf: str, num_workers: int = None):  # noqa: E501
+        logger = logging.getLogger(
+            __name__ + "." + SamplePool.__name__ + "." + self.__init__.__name__)  # noqa: E501
+
+        if not num_workers:
+            num_workers = os.cpu_count()
+
+        self.key = (type_value, sim_name, hf)
+        self.num_workers = num_workers
+
+        logger.info(
+            f"Starting {num_workers} sampling worker processes for '{hf}'")
+
+        # Spawn rather than fork, as the parent can hold open HDF5 handles
+        self._executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(config, type_value, sim_name, hf))
+
+    def sample(self, ds, coords, R, with_distances=False) -> list:
+        """
+        Reads the sphere samples around each of the coordinates, returning
+        the results in the order of the coordinates, with None for the
+        samples that errored
+        """
+        centres = np.asarray(coords.to("code_length").value)
+        R = float(R.to("code_length").value)
+
+        num_chunks = self.num_workers * CHUNKS_PER_WORKER
+        chunks = [idxs for idxs in np.array_split(
+            np.arange(len(centres)), num_chunks) if len(idxs) > 0]
+
+        futures = [self._executor.submit(
+            _sample_chunk, int(idxs[0]), centres[idxs], R, with_distances)
+            for idxs in chunks]
+
+        results = []
+        num_read = 0
+        try:
+            for future in futures:
+                name, lengths, units = future.result()
+                num_read += 1
+                results += _unpack(ds, name, lengths, units, with_distances)
+        finally:
+            # The blocks of the chunks that weren't read (i.e. if a chunk
+            # failed or the parent is interrupted) would otherwise outlive
+            # the run
+            _release(futures[num_read:])
+
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+def _release(futures: list):
+    """
+    Unlinks the shared memory blocks of the chunks that are done, cancelling
+    those that haven't started
+    """
+    for future in futures:
+        if future.cancel():
+            continue
+
+        try:
+            name, _, _ = future.result()
+        except Exception:
+            continue
+
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+
+        shm.close()
+        shm.unlink()
+
+
+def _unpack(ds, name: str, lengths: np.ndarray, units: str, with_distances: bool) -> list:  # noqa: E501
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        num_values = int(np.sum(lengths[lengths > 0]))
+        size = 2 * num_values if with_distances else num_values
+
+        flat = np.ndarray((size,), dtype=np.float64, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+    # Units are only known if any of the samples didn't error
+    masses = ds.arr(flat[:num_values], units) if units else None
+    dists = flat[num_values:]
+
+    results = []
+    offset = 0
+    for n in lengths:
+        if n < 0:
+            results.append(None)
+            continue
+
+        m = masses[offset:offset + n]
+        results.append((m, dists[offset:offset + n]) if with_distances else m)
+
+        offset += n
+
+    return results
+
+
+def get(config, type_value: str, sim_name: str, hf: str) -> SamplePool:
+    """
+    Gets the pool of workers for the data set, replacing the pool of the
+    previous data set
+    """
+    global _pool
+
+    key = (type_value, sim_name, hf)
+    if _pool is None or _pool.key != key:
+        shutdown()
+        _pool = SamplePool(config, type_value, sim_name, hf,
+                           config.sampling.num_workers)
+
+    return _pool
+
+
+@atexit.register
+def shutdown():
+    global _pool
+
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
@@ -0,0 +1,120 @@
+import logging
+from typing import List, Tuple
+
+import numpy as np
+from scipy import integrate
+from src.calc import density_field
+from src.util import units as u
+from src.util.constants import POWER_SPECTRUM_KEY
+
+
+class PowerSpectrum(density_field.DensityField):
+
+    def power_spectrum(self, hf) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Gets the matter power spectrum P(k) of the data set, measured from
+        the gridded density field and binned in spherical shells. k is in
+        comoving h/Mpc and P(k) in comoving (Mpc/h)^3.
+        """
+        logger = logging.getLogger(
+            __name__ + "." + self.power_spectrum.__name__)
+
+        ds = self.dataset_cache.load(hf)
+        z = ds.current_redshift
+
+        key = (hf, self.type.value, POWER_SPECTRUM_KEY, z)
+        results = self.cache[key].val
+        needs_recalculation = results is None
+        needs_recalculation |= not self.config.caches.use_power_spectrum_cache
+
+        logger.debug(
+            f"Override power spectrum cache? {not self.config.caches.use_power_spectrum_cache}")  # noqa: E501
+
+        if needs_recalculation:
+            logger.debug(
+                f"Calculating cache values for '{POWER_SPECTRUM_KEY}'...")
+
+            results = self._measure(hf)
+            self.cache[key] = results
+
+        else:
+            logger.debug("Using cached power spectrum...")
+
+        return results
+
+    def _measure(self, hf) -> Tuple[np.ndarray, np.ndarray]:
+        logger = logging.getLogger(__name__ + "." + self._measure.__name__)
+
+        ds = self.dataset_cache.load(hf)
+
+        num_cells = self.config.density_field.num_cells
+        assignment = self.config.density_field.assignment
+
+        box_size = ds.domain_width[0].to(u.length_cm(ds)).value
+        k_fund = 2 * np.pi / box_size
+
+        mesh_k = self._mesh_fft(hf)
+
+        # Normalising by the total mass gives the transform of the
+        # overdensity field (away from k=0)
+        total_mass = mesh_k[0, 0, 0].real
+        fx, fy, fz = density_field.grid_frequencies(num_cells)
+        window = density_field.assignment_window(fx, fy, fz, assignment)
+
+        pk = box_size**3 * np.abs(mesh_k / (total_mass * window))**2
+
+        k = 2 * np.pi * np.sqrt(fx**2 + fy**2 + fz**2) * num_cells / box_size  # noqa: E501
+        k = np.broadcast_to(k, pk.shape)
+
+        # The real FFT only stores half the modes, so count the modes that
+        # have a (missing) complex conjugate twice
+        weights = np.full(pk.shape[-1], 2.0)
+        weights[0] = 1
+        if num_cells % 2 == 0:
+            weights[-1] = 1
+        weights = np.broadcast_to(weights, pk.shape)
+
+        # Bin the modes in spherical shells one fundamental mode wide
+        num_bins = num_cells // 2
+        bin_idxs = np.floor(k.ravel() / k_fund + 0.5).astype(np.int64)
+        valid = (bin_idxs > 0) & (bin_idxs <= num_bins)
+
+        bin_idxs = bin_idxs[valid]
+        w = weights.ravel()[valid]
+
+        counts = np.bincount(bin_idxs, weights=w, minlength=num_bins + 1)
+        k_sum = np.bincount(bin_idxs, weights=w * k.ravel()[valid],
+                            minlength=num_bins + 1)
+        pk_sum = np.bincount(bin_idxs, weights=w * pk.ravel()[valid],
+                             minlength=num_bins + 1)
+
+        filled = counts > 0
+        k_binned = k_sum[filled] / counts[filled]
+        pk_binned = pk_sum[filled] / counts[filled]
+
+        logger.info(
+            f"Measured the power spectrum in {len(k_binned)} bins between k={k_binned[0]:.4f} and k={k_binned[-1]:.4f} h/Mpc")  # noqa: E501
+
+        return k_binned, pk_binned
+
+    def sigmas(self, hf, radii: List[float]) -> np.ndarray:
+        """
+        Calculates the standard deviation of the density field smoothed
+        with a top-hat of each of the given (comoving Mpc/h) radii, by
+        integrating the power spectrum against the top-hat window:
+
+        sigma^2(R) = 1 / (2 pi^2) int P(k) W^2(kR) k^2 dk
+        """
+        logger = logging.getLogger(__name__ + "." + self.sigmas.__name__)
+
+        k, pk = self.power_spectrum(hf)
+
+        R = np.asarray(radii, dtype=np.float64)[:, np.newaxis]
+        integrand = pk * density_field.top_hat(k * R)**2 * k**2 / (2 * np.pi**2)  # noqa: E501
+
+        sigma2 = integrate.trapezoid(integrand, k, axis=1)
+
+        logger.debug(
+            f"Calculated sigma(R) for {len(radii)} radii from the power spectrum")  # noqa: E501
+
+        return np.sqrt(sigma2)
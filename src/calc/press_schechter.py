@@ -3,8 +3,9 @@ from typing import List
 
 import numpy as np
 import unyt
-from scipy import integrate
+from scipy.interpolate import PchipInterpolator
 from src.calc import rho_bar, sample, std_dev
+from src.calc.sigma_model import SigmaModel
 from src.util import enum
 from src.util.constants import DELTA_CRIT, PRESS_SCHECHTER_KEY
 from src.util.halos import halo_finder
@@ -14,31 +15,56 @@ from src.fitting import funcs
 
 class PressSchechter(sample.Sampler):
 
-    def analytic_press_schechter(self, avg_den: float, masses: List[float], sigmas: List[float]):
-        frac = np.abs(sigmas / masses).value
+    def analytic_press_schechter(self, avg_den: float, masses: List[float], sigmas: List[float], dsigma_dmass: List[float] = None):  # noqa: E501
+        # Without the slope of sigma(M), sigma is taken to go as the mass
+        if dsigma_dmass is None:
+            frac = np.abs(sigmas / masses).value
+        else:
+            frac = np.abs(dsigma_dmass).value
 
         press_schechter = np.sqrt(2 / np.pi) * (DELTA_CRIT / sigmas**2) * (
             avg_den / masses) * frac * np.exp(-DELTA_CRIT**2 / (2 * sigmas**2))
 
         return press_schechter
 
-    def numerical_mass_function(self, avg_den: float, radii: List[float], masses: List[List[float]], fitting_func: Callable, func_params):
-
-        F = []
-
-        for i in range(len(radii)):
-            popt = func_params[i]
-
-            def f(x):
-                y = fitting_func(x, *popt)
-                return funcs.filter_val(y)
-
-            integrand, err = integrate.quad(f, DELTA_CRIT, np.inf)
-            F.append(integrand)
-
-        dF_dR = np.abs(np.gradient(F, radii))
+    def numerical_mass_function(self, avg_den: float, radii: List[float], masses: List[List[float]], fitting_func: Callable, func_params, model: SigmaModel):  # noqa: E501
+        """
+        The mass function at the given masses (within the range of the
+        radii) from the fraction of the fitted overdensities beyond the
+        critical overdensity at each radius, differentiated through a
+        monotone spline in log radius and the radius of each mass given by
+        the sigma(M) model
+        """
+        logger = logging.getLogger(
+            __name__ + "." + self.numerical_mass_function.__name__)
+
+        # Fraction of the overdensities beyond the critical overdensity at
+        # each radius, from the tails of the fits
+        F = funcs.tail_integrals(fitting_func, func_params, DELTA_CRIT)
+
+        order = np.argsort(radii)
+        log_radii = np.log(np.asarray(radii, dtype=np.float64)[order])
+        F = F[order]
+
+        # The radii of the masses at the ends of the range can round to just
+        # outside of it
+        R = model.radius(masses)
+        log_R = np.clip(np.log(R), log_radii[0], log_radii[-1])
+
+        # Leave out the radii whose fits gave no finite tail, the masses
+        # beyond the remaining radii being left undefined
+        finite = np.isfinite(F)
+        if not np.all(finite):
+            logger.warning(
+                f"Leaving out radii {np.exp(log_radii[~finite])} without a finite tail")  # noqa: E501
+        if np.count_nonzero(finite) >= 2:
+            dF_dlnR = PchipInterpolator(
+                log_radii[finite], F[finite], extrapolate=False).derivative()
+            dF_dR = np.abs(dF_dlnR(log_R) / R)
+        else:
+            dF_dR = np.full(len(log_R), np.nan)
 
-        dR_dM = np.abs(np.gradient(radii, masses))
+        dR_dM = np.abs(model.dradius_dmass(masses))
 
         dF_dM = dF_dR * dR_dM
 
@@ -95,10 +121,13 @@ class PressSchechter(sample.Sampler):
             logger.debug(
                 f"Calculating cache values for '{PRESS_SCHECHTER_KEY}'...")
 
-            # Run the full sample, and save the result to the cache
-            masses, sigmas = sd.masses_sigmas(
-                sf, self.config.sampling.std_dev_from_fit)
-            ps = self.analytic_press_schechter(avg_den, masses, sigmas)
+            # Evaluate on a dense mass grid through the smooth sigma(M)
+            # model, and save the result to the cache
+            model = sd.sigma_model(sf, self.config.sampling.std_dev_from_fit)
+            masses = model.mass_grid(self.config.sampling.num_model_masses)
+            ps = self.analytic_press_schechter(
+                avg_den, masses, model.sigma(masses),
+                model.dsigma_dmass(masses))
 
             self.cache[key] = (masses, ps)
 
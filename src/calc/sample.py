@@ -1,25 +1,38 @@
 import datetime
 import logging
 import time
+from typing import Dict, List, Tuple
 
 import numpy as np
 import yt
-from src.util import enum, interface
+from src.cache.ragged import RaggedArray
+from src.calc import pool
+from src.util import enum, interface, parallel
 from src.util import units as u
-from src.util.constants import SAMPLES_KEY, SPHERES_KEY
+from src.util.constants import (CONVERGED_KEY, PROCESS_POOL_KEY, SAMPLES_KEY,
+                                SPHERES_KEY)
 from src.util.halos import coordinates
 
 
 class Sampler(interface.Interface):
 
-    def sample(self, hf, radius, z) -> list:
-
+    def sample(self, hf, radius, z, num_samples: int = None) -> RaggedArray:
+        """
+        The sphere samples of the given radius, the number of samples
+        defaulting to the configured number
+        """
         logger = logging.getLogger(
             __name__ + "." + Sampler.__name__ + "." + self.sample.__name__)
 
         key = (hf, self.type.value, SPHERES_KEY, z, float(radius))
-        num_sphere_samples = self.config.sampling.num_sp_samples
-        samples = self.cache[key].val
+        num_sphere_samples = num_samples or self.config.sampling.num_sp_samples
+        use_cache = self.config.caches.use_sphere_samples
+
+        # Only read as many samples as are needed from the cache, clearing
+        # existing if overwriting
+        samples = None
+        if use_cache:
+            samples = self.cache[key].read_ragged(num_sphere_samples)
         needs_recalculation = samples is None
         # run calculation if not enough values cached
         if not needs_recalculation:
@@ -29,40 +42,223 @@ class Sampler(interface.Interface):
             needs_recalculation = amount_entries < num_sphere_samples
             logger.debug(f"Need more calculations: {needs_recalculation}")
         # Could force recalculation
-        needs_recalculation |= not self.config.caches.use_sphere_samples
-        logger.debug(
-            f"Override spheres cache? {not self.config.caches.use_sphere_samples}")  # noqa: E501
-
-        # Clear existing if overwriting
-        if not self.config.caches.use_sphere_samples:
-            samples = None
+        logger.debug(f"Override spheres cache? {not use_cache}")
 
         if needs_recalculation:
             num_samples = len(samples) if samples is not None else 0
+            # Nothing on disk to append to
+            overwrite = samples is None
+
+            batches = [samples]
+            unsaved = []
 
             # Calculate the sphere samples in batches to allow us to hotsave results for long calculations...
-            max_num_samples_needed = self.config.sampling.num_sp_samples
             iteration_count = self.config.sampling.sphere_sample_iteration
-            self.config.sampling.num_sp_samples = num_samples + iteration_count
-            while num_samples < max_num_samples_needed:
-                samples = self._cache_sample(hf, radius, existing=samples)
-                self.config.sampling.num_sp_samples += iteration_count
-                num_samples = len(samples)
+            while num_samples < num_sphere_samples:
+                batch = self._cache_sample(
+                    hf, radius, num_existing=num_samples,
+                    num_samples=num_samples + iteration_count)
+                num_samples += len(batch)
+
+                batches.append(batch)
+                unsaved.append(batch)
 
                 if self.config.sampling.sphere_sample_hotsave:
                     logger.info(
                         f"Hotsaving sphere samples at {num_samples} samples")
-                    self.cache[key] = samples
+                    self._save_samples(key, unsaved, overwrite)
+                    overwrite = False
+                    unsaved = []
+
+            if len(unsaved) > 0:
+                self._save_samples(key, unsaved, overwrite)
 
-            self.cache[key] = samples
+            samples = RaggedArray.concatenate(batches)
 
         # Limit the sphere samples to be the number required if too many
         return samples[:num_sphere_samples]
 
-    def _cache_sample(self, hf, radius, existing: list = None) -> list:
+    def _save_samples(self, key, batches: List[RaggedArray], overwrite: bool):
+        """
+        Writes the batches of samples that aren't yet on disk to the cache,
+        only appending them to an existing entry unless overwriting
+        """
+        samples = RaggedArray.concatenate(batches)
+
+        if overwrite:
+            self.cache[key].save_ragged(samples)
+        else:
+            self.cache[key].append_ragged(samples)
+
+        # Only the root rank writes the samples, the others have to wait
+        # for them to be on disk before reading the cache again
+        parallel.barrier()
+
+    def sample_radii(self, hf, radii: List[float], z) -> Dict[float, RaggedArray]:  # noqa: E501
+        """
+        Samples the data set for all the given radii in one pass, querying
+        each sphere centre once at the largest radius and deriving the
+        samples of the smaller radii from the nested selections
+        """
+        logger = logging.getLogger(
+            __name__ + "." + Sampler.__name__ + "." + self.sample_radii.__name__)  # noqa: E501
+
+        num_sphere_samples = self.config.sampling.num_sp_samples
+        use_cache = self.config.caches.use_sphere_samples
+        logger.debug(f"Override spheres cache? {not use_cache}")
+
+        samples = {}
+        needed = []
+        for radius in radii:
+            key = (hf, self.type.value, SPHERES_KEY, z, float(radius))
+
+            # Clear existing if overwriting
+            existing = None
+            if use_cache:
+                existing = self.cache[key].read_ragged(num_sphere_samples)
+            samples[radius] = existing
+
+            num_existing = len(existing) if existing is not None else 0
+            logger.debug(
+                f"Cache entries exist at r={radius}: Have {num_existing}, need {num_sphere_samples}")  # noqa: E501
+            if num_existing < num_sphere_samples:
+                needed.append(radius)
+
+        if len(needed) > 0:
+            logger.info(f"Sampling radii {needed} in a single pass")
+            self._cache_sample_radii(hf, needed, z, samples)
+
+        # Limit the sphere samples to be the number required if too many
+        return {r: samples[r][:num_sphere_samples] for r in radii}
+
+    def _cache_sample_radii(self, hf, radii: List[float], z, samples: Dict[float, RaggedArray]):  # noqa: E501
+        logger = logging.getLogger(
+            __name__ + "." + self._cache_sample_radii.__name__)
+
+        start = time.time()
+
+        ds = self.dataset_cache.load(hf)
+
+        num_sphere_samples = self.config.sampling.num_sp_samples
+        iteration_count = self.config.sampling.sphere_sample_iteration
+
+        # Only sample the centres missing from the least complete radius
+        num_existing = {}
+        overwrite, batches, unsaved = {}, {}, {}
+        for radius in radii:
+            num_existing[radius] = 0
+            if samples[radius] is not None:
+                num_existing[radius] = len(samples[radius])
+            # Nothing on disk to append to
+            overwrite[radius] = samples[radius] is None
+            batches[radius] = [samples[radius]]
+            unsaved[radius] = []
+        first = min(num_existing.values())
+
+        # All radii share the same set of random centres
+        coords = self._sample_coords(ds, num_sphere_samples)
+
+        Rs = {r: ds.quan(r, u.length_cm(ds)).to("code_length").value
+              for r in radii}
+        R_max = ds.quan(max(Rs.values()), "code_length")
+
+        for batch_start in range(first, num_sphere_samples, iteration_count):
+            batch = coords[batch_start:batch_start + iteration_count]
+
+            masses, dists, valid = self._nested_sample(hf, batch, R_max)
+
+            # If all sampling errored, return an exception...
+            if not np.any(valid):
+                raise ValueError("Couldn't get any non erroring samples!")
+
+            for radius in radii:
+                # Skip the centres that are already sampled at this radius,
+                # the errored centres having no row of masses
+                skip = max(num_existing[radius] - batch_start, 0)
+                skip = int(np.count_nonzero(valid[:skip]))
+                split = _split_radius(masses, dists, Rs[radius], skip)
+
+                batches[radius].append(split)
+                unsaved[radius].append(split)
+
+            if self.config.sampling.sphere_sample_hotsave:
+                logger.info(
+                    f"Hotsaving sphere samples at {batch_start + len(batch)} samples")  # noqa: E501
+                self._save_radii(hf, z, radii, unsaved, overwrite)
+
+        self._save_radii(hf, z, radii, unsaved, overwrite)
+
+        for radius in radii:
+            samples[radius] = RaggedArray.concatenate(batches[radius])
+
+        end = time.time()
+        logger.info(
+            f"Sampled {len(radii)} radii in {datetime.timedelta(seconds=end - start)}")  # noqa: E501
+
+    def _save_radii(self, hf, z, radii: List[float], unsaved: Dict[float, List[RaggedArray]], overwrite: Dict[float, bool]):  # noqa: E501
+        for radius in radii:
+            if len(unsaved[radius]) == 0:
+                continue
+
+            key = (hf, self.type.value, SPHERES_KEY, z, float(radius))
+            self._save_samples(key, unsaved[radius], overwrite[radius])
+
+            overwrite[radius] = False
+            unsaved[radius] = []
+
+    def _nested_sample(self, hf, coords, R) -> Tuple[RaggedArray, np.ndarray, np.ndarray]:  # noqa: E501
+        """
+        Samples the data set with spheres of the given radius around each
+        of the coordinates, returning the masses found in each sphere,
+        alongside the (flattened) distances of the halos from the centre
+        and whether each centre was sampled without erroring (the errored
+        centres having no row of masses).
+        """
+        logger = logging.getLogger(
+            __name__ + "." + self._nested_sample.__name__)
+
+        index = None
+        if self._use_halo_index():
+            index = self._halo_index(hf)
+
+        valid = np.ones(len(coords), dtype=bool)
+
+        if index is not None:
+            logger.debug(
+                f"Querying the halo index for {len(coords)} spheres with radius {R}")  # noqa: E501
+
+            masses, dists = index.sorted_sphere_masses(coords, R)
+
+        else:
+            results = self._distributed_sample(
+                hf, coords, R, with_distances=True)
+
+            mass_rows, dist_rows = [], []
+            for i, res in enumerate(results):
+                if res is None:
+                    valid[i] = False
+                    continue
+
+                mass_rows.append(res[0])
+                dist_rows.append(res[1])
+
+            masses = RaggedArray.from_rows(mass_rows)
+            dists = np.concatenate(dist_rows) if len(dist_rows) > 0 \
+                else np.empty(0)
+
+        if self.type is enum.DataType.ROCKSTAR:
+            # filter for negative (!!!) masses
+            positive = np.asarray(masses.values) > 0
+            masses = masses.select(positive)
+            dists = dists[positive]
+
+        return masses, dists, valid
+
+    def _cache_sample(self, hf, radius, num_existing: int = 0, num_samples: int = None) -> RaggedArray:  # noqa: E501
         """
         Randomly samples the data set with spheres of the given radius to find
-        halos within that sample
+        halos within that sample, only sampling the centres beyond the given
+        number of existing samples up to the total number of samples
         """
         logger = logging.getLogger(
             __name__ + "." + self._cache_sample.__name__)
@@ -78,105 +274,273 @@ class Sampler(interface.Interface):
 
         z = ds.current_redshift
 
-        # Get the redshift from the cache
-        # a = 1 / (1+z)
-
         logger.debug(f"Redshift z={z}")
 
-        # Get the size of the simulation
-        sim_size = ds.domain_width[0]
-        logger.debug(f"Simulation size = {sim_size}")
-
-        # Bound the coordinate sampling, so that the spheres only overlap with
-        # volumes within the simulation region
-        max_radius = self.config.max_radius
-        coord_min = max_radius
-        coord_max = sim_size.value - max_radius
-
         # Get the desired number of random coords for this sampling
-        coords = coordinates.rand_coords(
-            self.config.sampling.num_sp_samples, min=coord_min, max=coord_max)
-        coords = ds.arr(coords, u.length_cm(ds)).to("code_length")
+        num_sp_samples = num_samples or self.config.sampling.num_sp_samples
+        coords = self._sample_coords(ds, num_sp_samples)
 
         # Truncate the number of values to calculate, if some already exist...
-        sphere_samples = []
-        if existing is not None:
-            coords = coords[len(existing):]
-            sphere_samples = existing
+        if num_existing > 0:
+            coords = coords[num_existing:]
 
-            num_sp_samples = self.config.sampling.num_sp_samples
             num_samples_needed = min(
-                num_sp_samples - len(existing), num_sp_samples)
+                num_sp_samples - num_existing, num_sp_samples)
             logger.debug(
-                f"Have {len(existing)} existing samples, need {num_samples_needed} more...")  # noqa: E501
+                f"Have {num_existing} existing samples, need {num_samples_needed} more...")  # noqa: E501
 
         num_coords = len(coords)
-        indexed_coords = [(i, coords[i]) for i in range(num_coords)]
         num_errors = 0
 
-        # Iterate over all the randomly sampled coordinates
-        for ic in yt.parallel_objects(indexed_coords):
-            it_start = time.time()
-
-            i, c = ic[0], ic[1]
+        # Halo catalogues can be sampled for all the centres at once
+        # through a spatial index of the halo positions
+        index = None
+        if self._use_halo_index():
+            index = self._halo_index(hf)
 
+        if index is not None:
             logger.debug(
-                f"({i}) Creating sphere @ ({c[0]}, {c[1]}, {c[2]}) with radius {R}")  # noqa: E501
-
-            # Try to sample a sphere of the given radius at this coord
-            try:
-                sp = self.dataset_cache.sphere(hf, c, R)
-            # Can error on higher redshift data sets due to sampling regions
-            # erroring in yt
-            except TypeError as te:
-                logger.error("error creating sphere sample")
-                logger.error(te)
-                num_errors += 1
-                continue
+                f"Querying the halo index for {num_coords} spheres with radius {R}")  # noqa: E501
 
-            # Try to read the masses of halos in this sphere
-            try:
-                masses = sp[self.type.index]
-            except TypeError as te:
-                logger.error("error reading sphere halo masses")
-                logger.error(te)
-                num_errors += 1
-                continue
-            except yt.utilities.exceptions.YTFieldNotFound as ytfnf:
-                logger.error("Could not access masses field")
-                logger.error(ytfnf)
-                num_errors += 1
-                continue
+            sphere_samples = index.sphere_masses(coords, R)
 
             if self.type is enum.DataType.ROCKSTAR:
                 # filter for negative (!!!) masses
-                masses = masses[np.where(masses > 0)]
-
-            logger.debug(f"Found {len(masses)} halos in this sphere sample")
+                sphere_samples = sphere_samples.select(
+                    np.asarray(sphere_samples.values) > 0)
 
-            it_end = time.time()
-            logger.debug(
-                f"Took {datetime.timedelta(seconds=it_end - it_start)}")
-
-            # Add these masses to the list
-            sphere_samples.append(masses)
+        else:
+            sphere_samples, num_errors = self._sphere_sample(hf, coords, R)
 
         # If all sampling errored, return an exception...
         if num_errors == num_coords:
             raise ValueError("Couldn't get any non erroring samples!")
 
         logger.info(
-            f"DONE reading {self.config.sampling.num_sp_samples} sphere samples\n")  # noqa: E501
+            f"DONE reading {num_sp_samples} sphere samples\n")
 
         end = time.time()
         logger.info(f"Took {datetime.timedelta(seconds=end - start)}")
 
         return sphere_samples
 
-    def save_num_samples(self, hf: str, radius: float, z: float, num: int):
+    def _sphere_sample(self, hf, coords, R) -> Tuple[RaggedArray, int]:
+        """
+        Samples the data set with a yt sphere selection around each of the
+        given coordinates, returning the masses found and the number of
+        samples that errored
+        """
+        sphere_samples = []
+        num_errors = 0
+
+        for masses in self._distributed_sample(hf, coords, R):
+            if masses is None:
+                num_errors += 1
+                continue
+
+            # Add these masses to the list
+            sphere_samples.append(masses)
+
+        return RaggedArray.from_rows(sphere_samples), num_errors
+
+    def _distributed_sample(self, hf, coords, R, with_distances=False) -> list:  # noqa: E501
+        """
+        Reads the yt sphere selections around each of the coordinates,
+        partitioning the coordinates across the ranks sharing this unit of
+        work (or the worker processes of the process pool backend). The
+        results are gathered back in the order of the coordinates, with
+        None for the samples that errored.
+        """
+        logger = logging.getLogger(
+            __name__ + "." + self._distributed_sample.__name__)
+
+        # Single node runs can share the samples across worker processes
+        if self.config.sampling.sphere_backend == PROCESS_POOL_KEY:
+            ds = self.dataset_cache.load(hf)
+            sample_pool = pool.get(
+                self.config, self.type.value, self.sim_name, hf)
+
+            logger.debug(
+                f"Sampling {len(coords)} spheres across {sample_pool.num_workers} worker processes")  # noqa: E501
+
+            return sample_pool.sample(ds, coords, R, with_distances)
+
+        indexed_coords = [(i, coords[i]) for i in range(len(coords))]
+        storage = {}
+
+        logger.debug(
+            f"Sampling {len(coords)} spheres across {parallel.size()} ranks")
+
+        # Iterate over this rank's share of the randomly sampled coordinates
+        for sto, ic in yt.parallel_objects(indexed_coords, storage=storage):
+            it_start = time.time()
+
+            i, c = ic[0], ic[1]
+
+            sto.result_id = i
+            sto.result = self._read_sphere(
+                hf, i, c, R, with_distances=with_distances)
+
+            it_end = time.time()
+            logger.debug(
+                f"Took {datetime.timedelta(seconds=it_end - it_start)}")
+
+        return [storage[i] for i in sorted(storage.keys())]
+
+    def _read_sphere(self, hf, i, c, R, with_distances=False):
+        """
+        Reads the masses of the halos within a yt sphere selection at the
+        given coordinate, optionally sorted by their distance from the
+        centre alongside those distances. Returns None if the sample errors.
+        """
+        logger = logging.getLogger(
+            __name__ + "." + self._read_sphere.__name__)
+
+        logger.debug(
+            f"({i}) Creating sphere @ ({c[0]}, {c[1]}, {c[2]}) with radius {R}")  # noqa: E501
+
+        # Try to sample a sphere of the given radius at this coord
+        try:
+            sp = self.dataset_cache.sphere(hf, c, R)
+        # Can error on higher redshift data sets due to sampling regions
+        # erroring in yt
+        except TypeError as te:
+            logger.error("error creating sphere sample")
+            logger.error(te)
+            return None
+
+        # Try to read the masses of halos in this sphere
+        try:
+            masses = sp[self.type.index]
+            if with_distances:
+                positions = self._read_positions(sp)
+        except TypeError as te:
+            logger.error("error reading sphere halo masses")
+            logger.error(te)
+            return None
+        except yt.utilities.exceptions.YTFieldNotFound as ytfnf:
+            logger.error("Could not access masses field")
+            logger.error(ytfnf)
+            return None
+
+        if self.type is enum.DataType.ROCKSTAR and not with_distances:
+            # filter for negative (!!!) masses
+            masses = masses[np.where(masses > 0)]
+
+        logger.debug(f"Found {len(masses)} halos in this sphere sample")
+
+        if not with_distances:
+            return masses
+
+        centre = c.to("code_length").value
+        dists = np.sqrt(np.sum((positions - centre)**2, axis=1))
+        order = np.argsort(dists)
+
+        return masses[order], dists[order]
+
+    def _read_positions(self, selection) -> np.ndarray:
+        x_field = self.type.coord_index_x()
+
+        # Snapshot coordinates are stored as a single vector field
+        if x_field == self.type.coord_index_y():
+            return selection[x_field].to("code_length").value
+
+        fields = [x_field, self.type.coord_index_y(),
+                  self.type.coord_index_z()]
+
+        return np.stack(
+            [selection[f].to("code_length").value for f in fields], axis=1)
+
+    def _sample_coords(self, ds, amount: int):
+        logger = logging.getLogger(
+            __name__ + "." + self._sample_coords.__name__)
+
+        # Get the size of the simulation
+        sim_size = ds.domain_width[0]
+        logger.debug(f"Simulation size = {sim_size}")
+
+        # Bound the coordinate sampling, so that the spheres only overlap with
+        # volumes within the simulation region
+        max_radius = self.config.max_radius
+        coord_min = max_radius
+        coord_max = sim_size.value - max_radius
+
+        # Get the desired number of random coords for this sampling, every
+        # rank has to sample the same coords so they're taken from the root
+        coords = None
+        if parallel.is_root():
+            coords = coordinates.rand_coords(
+                amount, min=coord_min, max=coord_max)
+        coords = parallel.broadcast(coords)
+
+        return ds.arr(coords, u.length_cm(ds)).to("code_length")
+
+    def _use_halo_index(self) -> bool:
+        # Snapshots contain far too many particles to index
+        if self.type is enum.DataType.SNAPSHOT:
+            return False
+
+        return self.config.sampling.use_halo_index
+
+    def _halo_index(self, hf):
+        """
+        Gets the (cached) spatial index of the halos in the data set,
+        returning None if the index could not be built
+        """
+        logger = logging.getLogger(
+            __name__ + "." + self._halo_index.__name__)
+
+        try:
+            return self.dataset_cache.halo_index(hf, self.type)
+        # Can error on higher redshift data sets due to box issues in yt
+        except TypeError as te:
+            logger.error(
+                "error building halo index, falling back to sphere sampling")
+            logger.error(te)
+        except yt.utilities.exceptions.YTFieldNotFound as ytfnf:
+            logger.error(
+                "Could not access halo fields, falling back to sphere sampling")  # noqa: E501
+            logger.error(ytfnf)
+
+        return None
+
+    def save_num_samples(self, hf: str, radius: float, z: float, num: int, converged_tol: float = None):  # noqa: E501
+        """
+        Records the number of samples used at the radius, alongside the
+        tolerance their standard deviation converged to if it did
+        """
         key = (hf, self.type.value, SPHERES_KEY, z, float(radius), SAMPLES_KEY)
         self.cache[key] = num
 
+        if converged_tol is not None:
+            self.cache[key + (CONVERGED_KEY,)] = np.array(
+                [num, converged_tol], dtype=np.float64)
+
+    def get_convergence(self, hf: str, radius: float, z: float) -> Tuple[int, float]:  # noqa: E501
+        """
+        The number of samples the standard deviation at the radius converged
+        with and the tolerance it converged to, or None if it hasn't
+        """
+        key = (hf, self.type.value, SPHERES_KEY, z, float(radius),
+               SAMPLES_KEY, CONVERGED_KEY)
+        convergence = self.cache[key].val
+        if convergence is None:
+            return None
+
+        num, tol = convergence
+        return int(num), float(tol)
+
     def get_num_samples(self, hf: str, radius: float, z: float) -> int:
         key = (hf, self.type.value, SPHERES_KEY, z, float(radius), SAMPLES_KEY)
         return self.cache[key].val
+
+
+def _split_radius(masses: RaggedArray, dists: np.ndarray, R: float, skip: int = 0) -> RaggedArray:  # noqa: E501
+    """
+    Truncates the sphere samples (after the first skip samples) to the halos
+    within the given radius
+    """
+    skip = min(skip, len(masses))
+    lo = int(masses.ends[skip - 1]) if skip > 0 else 0
+
+    return masses[skip:].select(dists[lo:] <= R)
@@ -0,0 +1,100 @@
+from typing import List
+
+import numpy as np
+import unyt
+from scipy.interpolate import PchipInterpolator
+
+MASSES_KEY = "masses"
+RADII_KEY = "radii"
+SIGMAS_KEY = "sigmas"
+
+
+class SigmaModel:
+    """
+    Smooth model of the standard deviation of the overdensities as a function
+    of mass (and sampling radius), through a monotone (PCHIP) spline of the
+    measured sigmas in log-log space. The spline gives sigma and its analytic
+    derivative on any mass grid within the measured range, so the mass
+    functions can be evaluated densely without sampling more radii.
+    """
+
+    def __init__(self, masses: unyt.unyt_array, radii: List[float], sigmas: np.ndarray):  # noqa: E501
+        order = np.argsort(np.asarray(masses))
+
+        self._masses = masses[order]
+        self._radii = np.asarray(radii, dtype=np.float64)[order]
+        self._sigmas = np.abs(np.asarray(sigmas, dtype=np.float64))[order]
+
+        log_masses = np.log(self._masses.value)
+        self._log_sigma = PchipInterpolator(
+            log_masses, np.log(self._sigmas), extrapolate=False)
+        self._dlog_sigma = self._log_sigma.derivative()
+        # The masses go as the cube of the radii
+        self._log_radius = PchipInterpolator(
+            log_masses, np.log(self._radii), extrapolate=False)
+
+    @property
+    def units(self) -> unyt.Unit:
+        return self._masses.units
+
+    def _log_mass(self, masses) -> np.ndarray:
+        if isinstance(masses, unyt.unyt_array):
+            masses = masses.to_value(self.units)
+
+        return np.log(np.asarray(masses, dtype=np.float64))
+
+    def mass_grid(self, num_masses: int) -> unyt.unyt_array:
+        """
+        Log spaced masses spanning the measured range of the model
+        """
+        lo, hi = self._masses[0].value, self._masses[-1].value
+
+        return unyt.unyt_array(np.geomspace(lo, hi, num_masses), self.units,
+                               registry=self._masses.units.registry)
+
+    def sigma(self, masses) -> np.ndarray:
+        return np.exp(self._log_sigma(self._log_mass(masses)))
+
+    def dln_sigma_dln_mass(self, masses) -> np.ndarray:
+        return self._dlog_sigma(self._log_mass(masses))
+
+    def dsigma_dmass(self, masses) -> unyt.unyt_array:
+        """
+        The analytic derivative of sigma with respect to mass, in the inverse
+        units of the masses of the model
+        """
+        log_masses = self._log_mass(masses)
+        dsigma = np.exp(self._log_sigma(log_masses)) * \
+            self._dlog_sigma(log_masses) / np.exp(log_masses)
+
+        return unyt.unyt_array(dsigma, 1 / self.units,
+                               registry=self._masses.units.registry)
+
+    def radius(self, masses) -> np.ndarray:
+        """
+        The sampling radius corresponding to each mass
+        """
+        return np.exp(self._log_radius(self._log_mass(masses)))
+
+    def dradius_dmass(self, masses) -> unyt.unyt_array:
+        log_masses = self._log_mass(masses)
+        dradius = np.exp(self._log_radius(log_masses) - log_masses) / 3
+
+        return unyt.unyt_array(dradius, 1 / self.units,
+                               registry=self._masses.units.registry)
+
+    def to_dict(self) -> dict:
+        """
+        The measured sigmas the model is built from, for caching
+        """
+        return {
+            MASSES_KEY: (self._masses.value, str(self.units)),
+            RADII_KEY: self._radii,
+            SIGMAS_KEY: self._sigmas,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict, registry=None) -> "SigmaModel":
+        masses = unyt.unyt_array(*d[MASSES_KEY], registry=registry)
+
+        return cls(masses, d[RADII_KEY], d[SIGMAS_KEY])
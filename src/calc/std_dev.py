@@ -2,32 +2,42 @@ import logging
 from typing import Tuple
 
 import numpy as np
-from src.calc import overdensity
+from src.calc import overdensity, power_spectrum
+from src.calc.sigma_model import SigmaModel
 import src.calc.rho_bar as rho_bar
 import src.util.units as u
 import unyt
-from src.fitting import fits
-from src.util.constants import DELTA_CRIT, OVERDENSITIES_KEY, STD_DEV_KEY
+from src.fitting import estimators, fits
+from src.util import enum
+from src.util.constants import (DELTA_CRIT, OVERDENSITIES_KEY,
+                                POWER_SPECTRUM_KEY, SIGMA_MODEL_KEY,
+                                STD_DEV_KEY)
 from src.util.halos import halo_finder
 
 
 class StandardDeviation(rho_bar.RhoBar):
 
-    def masses_sigmas(self, hf, from_fit=True) -> Tuple[unyt.unyt_array, np.ndarray]:
+    def masses_sigmas(self, hf, from_fit=True, radii=None) -> Tuple[unyt.unyt_array, np.ndarray]:
         logger = logging.getLogger(
             __name__ + "." + self.masses_sigmas.__name__)
 
         ds = self.dataset_cache.load(hf)
 
-        sigmas = []
-
-        radii = self.config.radii
+        if radii is None:
+            radii = self.config.radii
         logger.debug(f"Creating std devs for radii '{radii}'")
 
-        for radius in radii:
-            sdev = self.std_dev(hf, radius, from_fit=from_fit)
+        if self.uses_power_spectrum():
+            logger.debug("Using the power spectrum to calculate the std devs")
+            ps = power_spectrum.PowerSpectrum(self, self.type, self.sim_name)
+            sigmas = ps.sigmas(hf, radii)
+
+        else:
+            sigmas = []
+            for radius in radii:
+                sdev = self.std_dev(hf, radius, from_fit=from_fit)
 
-            sigmas.append(sdev)
+                sigmas.append(sdev)
 
         av_den = self.rho_bar_0() * DELTA_CRIT
 
@@ -42,6 +52,62 @@ class StandardDeviation(rho_bar.RhoBar):
 
         return ds.arr(masses, u.mass(ds)), np.abs(sigmas)
 
+    def sigma_model(self, hf, from_fit=True) -> SigmaModel:
+        """
+        The smooth sigma(M) model of the data set, built from the standard
+        deviations at each radius and cached per data set
+        """
+        logger = logging.getLogger(
+            __name__ + "." + self.sigma_model.__name__)
+
+        ds = self.dataset_cache.load(hf)
+        z = ds.current_redshift
+
+        # The sigmas differ with how they are estimated
+        method = POWER_SPECTRUM_KEY if self.uses_power_spectrum() \
+            else self.std_dev_estimator(from_fit)
+        key = (hf, self.type.value, SIGMA_MODEL_KEY, z, from_fit, method)
+        results = self.cache[key].val
+        needs_recalculation = results is None
+        needs_recalculation |= not self.config.caches.use_standard_deviation_cache  # noqa: E501
+
+        if needs_recalculation:
+            logger.debug(
+                f"Calculating cache values for '{SIGMA_MODEL_KEY}'...")
+
+            # The power spectrum gives sigma(R) at any radius, so can be
+            # evaluated on a dense radius grid
+            radii = self.config.radii
+            if self.uses_power_spectrum():
+                radii = np.geomspace(min(self.config.radii),
+                                     max(self.config.radii),
+                                     self.config.power_spectrum.num_radii)
+
+            masses, sigmas = self.masses_sigmas(hf, from_fit, radii=radii)
+            model = SigmaModel(masses, radii, sigmas)
+
+            self.cache[key] = model.to_dict()
+
+            return model
+
+        logger.debug("Using cached sigma model...")
+
+        return SigmaModel.from_dict(results, ds.unit_registry)
+
+    def uses_power_spectrum(self) -> bool:
+        return self.type is enum.DataType.SNAPSHOT and \
+            self.config.sampling.std_dev_backend == POWER_SPECTRUM_KEY
+
+    def std_dev_estimator(self, from_fit=True) -> str:
+        """
+        The estimator the standard deviations are calculated with, the
+        samples' own standard deviation being the Gaussian estimate
+        """
+        if not from_fit:
+            return estimators.GAUSSIAN_ESTIMATOR
+
+        return self.config.sampling.std_dev_estimator
+
     def std_dev(self, hf: str, radius: float, from_fit=True):
         logger = logging.getLogger(__name__ + "." + self.std_dev.__name__)
 
@@ -49,7 +115,9 @@ class StandardDeviation(rho_bar.RhoBar):
         z = ds.current_redshift
 
         # If cache entries exist, may not need to recalculate
-        key = (hf, self.type.value, STD_DEV_KEY, z, float(radius))
+        estimator = self.std_dev_estimator(from_fit)
+        key = (hf, self.type.value, STD_DEV_KEY, z, float(radius), from_fit,
+               estimator)
         std_dev = self.cache[key].val
         needs_recalculation = std_dev is None
         # Could force recalculation
@@ -66,7 +134,7 @@ class StandardDeviation(rho_bar.RhoBar):
             od = overdensity.Overdensity(self, self.type, self.sim_name)
             overdensities = od.calc_overdensities(hf, radius)
 
-            if from_fit:
+            if estimator == estimators.HISTOGRAM_ESTIMATOR:
                 # Reads gaussian fits by default
                 fitter = fits.Fits(self, self.type, self.sim_name)
                 _, _, _, popt = fitter.calc_fit(
@@ -76,9 +144,16 @@ class StandardDeviation(rho_bar.RhoBar):
                 # Make sure the sigma is positive
                 std_dev = np.abs(std_dev)
 
-            else:
+            elif estimator == estimators.SKEW_NORMAL_ESTIMATOR:
+                # The standard deviation of the most likely skew normal
+                _, omega, alpha = estimators.skew_normal_mle(overdensities)
+                std_dev = estimators.skew_normal_std(omega, alpha)
 
-                std_dev = np.std(overdensities)
+            else:
+                # The Gaussian maximum likelihood estimate is the standard
+                # deviation of the samples, no fitting needed
+                _, std_dev = estimators.gaussian_mle(
+                    estimators.Moments.of(overdensities))
 
             self.cache[key] = std_dev
 
@@ -0,0 +1,280 @@
+import logging
+from typing import Tuple
+
+import numpy as np
+import scipy.special as sp
+
+GAUSSIAN_ESTIMATOR = "gaussian"
+SKEW_NORMAL_ESTIMATOR = "skew_normal"
+HISTOGRAM_ESTIMATOR = "histogram"
+
+ANALYTIC_ERROR = "analytic"
+BOOTSTRAP_ERROR = "bootstrap"
+
+# Largest skewness a skew normal distribution can have
+MAX_SKEW_NORMAL_SKEWNESS = 0.995
+
+
+class Moments:
+    """
+    Streaming mean, variance, skewness and kurtosis of the samples, updated
+    batch by batch (with the pairwise update of Chan et al. and Pebay) so
+    that the samples never need to be held or revisited
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        # Sums of the powers of the deviations from the mean
+        self._m2 = 0.0
+        self._m3 = 0.0
+        self._m4 = 0.0
+
+    @classmethod
+    def of(cls, values: np.ndarray) -> "Moments":
+        return cls().update(values)
+
+    def update(self, values: np.ndarray) -> "Moments":
+        """
+        Adds the batch of samples to the moments
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return self
+
+        batch = Moments()
+        batch.n = len(values)
+        batch.mean = float(np.mean(values))
+        d = values - batch.mean
+        batch._m2 = float(np.sum(d**2))
+        batch._m3 = float(np.sum(d**3))
+        batch._m4 = float(np.sum(d**4))
+
+        return self._combine(batch)
+
+    def merge(self, other: "Moments") -> "Moments":
+        """
+        Combines the moments of another set of samples (i.e. from another
+        rank) into these
+        """
+        return self._combine(other)
+
+    def _combine(self, other: "Moments") -> "Moments":
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n, self.mean = other.n, other.mean
+            self._m2, self._m3, self._m4 = other._m2, other._m3, other._m4
+            return self
+
+        na, nb = self.n, other.n
+        n = na + nb
+        delta = other.mean - self.mean
+
+        m2 = self._m2 + other._m2 + delta**2 * na * nb / n
+        m3 = self._m3 + other._m3 + \
+            delta**3 * na * nb * (na - nb) / n**2 + \
+            3 * delta * (na * other._m2 - nb * self._m2) / n
+        m4 = self._m4 + other._m4 + \
+            delta**4 * na * nb * (na**2 - na * nb + nb**2) / n**3 + \
+            6 * delta**2 * (na**2 * other._m2 + nb**2 * self._m2) / n**2 + \
+            4 * delta * (na * other._m3 - nb * self._m3) / n
+
+        self.n = n
+        self.mean += delta * nb / n
+        self._m2, self._m3, self._m4 = m2, m3, m4
+
+        return self
+
+    @property
+    def variance(self) -> float:
+        """
+        The (biased, maximum likelihood) variance, as np.var
+        """
+        return self._m2 / self.n if self.n > 0 else np.nan
+
+    @property
+    def std(self) -> float:
+        return np.sqrt(self.variance)
+
+    @property
+    def skewness(self) -> float:
+        if self.n == 0 or self._m2 == 0:
+            return np.nan
+        return np.sqrt(self.n) * self._m3 / self._m2**1.5
+
+    @property
+    def kurtosis(self) -> float:
+        """
+        The excess kurtosis, 0 for a Gaussian
+        """
+        if self.n == 0 or self._m2 == 0:
+            return np.nan
+        return self.n * self._m4 / self._m2**2 - 3
+
+    def std_error(self) -> float:
+        """
+        The standard error of the standard deviation, from the variance of
+        the sample variance, (mu_4 - sigma^4) / n, so that it holds for non
+        Gaussian samples too
+        """
+        if self.n < 2 or self._m2 == 0:
+            return np.inf
+
+        mu4 = self._m4 / self.n
+        var_of_var = max(mu4 - self.variance**2, 0) / self.n
+
+        return np.sqrt(var_of_var) / (2 * self.std)
+
+
+def bootstrap_std_error(values: np.ndarray, num_resamples: int = 200, seed: int = None) -> float:  # noqa: E501
+    """
+    The standard error of the standard deviation from the spread of the
+    standard deviations of the samples resampled with replacement
+    """
+    x = np.asarray(values, dtype=np.float64).ravel()
+    if len(x) < 2:
+        return np.inf
+
+    rng = np.random.default_rng(seed)
+    std_devs = np.empty(num_resamples)
+    for i in range(num_resamples):
+        std_devs[i] = np.std(x[rng.integers(0, len(x), len(x))])
+
+    return float(np.std(std_devs, ddof=1))
+
+
+def gaussian_mle(moments: Moments) -> Tuple[float, float]:
+    """
+    The maximum likelihood mean and standard deviation of a Gaussian, which
+    are the sample mean and (biased) standard deviation
+    """
+    return moments.mean, moments.std
+
+
+def skew_normal_std(omega: float, alpha: float) -> float:
+    """
+    The standard deviation of the skew normal distribution with the given
+    scale and shape
+    """
+    delta = alpha / np.sqrt(1 + alpha**2)
+
+    return omega * np.sqrt(1 - 2 * delta**2 / np.pi)
+
+
+def skew_normal_moments_estimate(moments: Moments) -> Tuple[float, float, float]:  # noqa: E501
+    """
+    Method of moments estimate of the location, scale and shape of a skew
+    normal distribution, used to start the likelihood maximisation
+    """
+    gamma = np.clip(moments.skewness, -MAX_SKEW_NORMAL_SKEWNESS,
+                    MAX_SKEW_NORMAL_SKEWNESS)
+    if not np.isfinite(gamma):
+        gamma = 0.0
+
+    g = np.abs(gamma)**(2 / 3)
+    delta = np.sign(gamma) * np.sqrt(
+        np.pi / 2 * g / (g + ((4 - np.pi) / 2)**(2 / 3)))
+    delta = np.clip(delta, -0.99, 0.99)
+
+    alpha = delta / np.sqrt(1 - delta**2)
+    omega = moments.std / np.sqrt(1 - 2 * delta**2 / np.pi)
+    xi = moments.mean - omega * delta * np.sqrt(2 / np.pi)
+
+    return xi, omega, alpha
+
+
+def skew_normal_mle(values: np.ndarray, p0: Tuple[float, float, float] = None, max_iter: int = 50, tol: float = 1e-8) -> Tuple[float, float, float]:  # noqa: E501
+    """
+    The maximum likelihood location, scale and shape (xi, omega, alpha) of a
+    skew normal distribution, from Newton iterations on the log likelihood
+    with its analytic gradient and Hessian. Starts from p0 (i.e. the fit to
+    the previous batch of samples) or the method of moments estimate.
+    """
+    logger = logging.getLogger(__name__ + "." + skew_normal_mle.__name__)
+
+    x = np.asarray(values, dtype=np.float64).ravel()
+    if p0 is None:
+        p0 = skew_normal_moments_estimate(Moments.of(x))
+
+    p = np.array(p0, dtype=np.float64)
+    ll = _skew_normal_log_likelihood(x, p)
+
+    for i in range(max_iter):
+        grad, hess = _skew_normal_derivatives(x, p)
+
+        try:
+            step = np.linalg.solve(hess, -grad)
+        except np.linalg.LinAlgError:
+            step = grad
+
+        # Ascend if the Hessian isn't negative definite there
+        if np.dot(step, grad) <= 0:
+            step = grad / max(np.max(np.abs(hess)), 1)
+
+        # Halve the step until the likelihood increases
+        scale = 1.0
+        while scale > 1e-10:
+            trial = p + scale * step
+            if trial[1] > 0:
+                trial_ll = _skew_normal_log_likelihood(x, trial)
+                if trial_ll >= ll:
+                    break
+            scale /= 2
+        else:
+            break
+
+        converged = abs(trial_ll - ll) < tol * max(abs(ll), 1)
+        p, ll = trial, trial_ll
+        if converged:
+            break
+
+    logger.debug(f"Skew normal fit {p} after {i + 1} iterations")
+
+    return tuple(float(v) for v in p)
+
+
+def _skew_normal_log_likelihood(x: np.ndarray, p: np.ndarray) -> float:
+    xi, omega, alpha = p
+    z = (x - xi) / omega
+
+    return float(np.sum(-np.log(omega) - z**2 / 2 + sp.log_ndtr(alpha * z)))
+
+
+def _skew_normal_derivatives(x: np.ndarray, p: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:  # noqa: E501
+    xi, omega, alpha = p
+    z = (x - xi) / omega
+    t = alpha * z
+
+    # zeta_1 = phi / Phi (computed in logs to avoid underflow) and its
+    # derivative
+    zeta1 = np.exp(-t**2 / 2 - np.log(np.sqrt(2 * np.pi)) - sp.log_ndtr(t))
+    zeta2 = -zeta1 * (t + zeta1)
+
+    # Derivatives of the log likelihood of each sample with respect to the
+    # standardised value z and the shape
+    l_z = -z + alpha * zeta1
+    l_zz = -1 + alpha**2 * zeta2
+    l_za = zeta1 + t * zeta2
+    l_aa = z**2 * zeta2
+
+    grad = np.array([
+        np.sum(-l_z / omega),
+        np.sum(-1 / omega - z * l_z / omega),
+        np.sum(z * zeta1),
+    ])
+
+    h_xx = np.sum(l_zz) / omega**2
+    h_xw = np.sum(l_z + z * l_zz) / omega**2
+    h_xa = -np.sum(l_za) / omega
+    h_ww = np.sum(1 + 2 * z * l_z + z**2 * l_zz) / omega**2
+    h_wa = -np.sum(z * l_za) / omega
+    h_aa = np.sum(l_aa)
+
+    hess = np.array([
+        [h_xx, h_xw, h_xa],
+        [h_xw, h_ww, h_wa],
+        [h_xa, h_wa, h_aa],
+    ])
+
+    return grad, hess
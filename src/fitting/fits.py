@@ -1,8 +1,9 @@
 import logging
 import os
-from typing import Callable, Dict, Tuple
+from typing import Callable, Dict, List, Tuple
 
 import numpy as np
+import scipy.linalg
 import scipy.optimize
 import scipy.stats
 import unyt
@@ -32,86 +33,214 @@ class Fits(FittingParameters):
                  radius: float,
                  deltas: unyt.unyt_array,
                  num_bins: int) -> Tuple[np.ndarray, np.ndarray, float, list]:
-        logger = logging.getLogger(__name__ + "." + self.calc_fit.__name__)
+        return self.calc_fits(z, [radius], [deltas], num_bins)[0]
+
+    def calc_fits(self,
+                  z: float,
+                  radii: List[float],
+                  deltas: List[unyt.unyt_array],
+                  num_bins: int) -> List[Tuple[np.ndarray, np.ndarray, float, list]]:  # noqa: E501
+        """
+        Fits the function to the histograms of the overdensities at each of
+        the radii, binning them all at once and fitting them together as one
+        least squares problem. Each radius is started from the cached
+        solution at the neighbouring radius where there is one, and radii
+        the joint fit fails on are refitted on their own.
+        """
+        logger = logging.getLogger(__name__ + "." + self.calc_fits.__name__)
 
         logger.debug(
-            f"Calculating fitting parameters for function '{self.func.__name__}' at z={z:.2f}; r={radius:.2f}...")
+            f"Calculating fitting parameters for function '{self.func.__name__}' at z={z:.2f}; r={radii}...")  # noqa: E501
 
-        key = (self.sim_name, self.type.value, FITS_KEY,
-               self.func.__name__, z, float(radius))
-        cache_vals = self._cache[key].val
+        keys = [(self.sim_name, self.type.value, FITS_KEY,
+                 self.func.__name__, z, float(radius)) for radius in radii]
+        cache_vals = [self._cache[key].val for key in keys]
+        if not self.config.caches.use_fits_cache:
+            cache_vals = [None] * len(keys)
 
-        if cache_vals is None or not self.config.caches.use_fits_cache:
-            logger.debug(f"Recalculating cached fit values...")
+        missing = [i for i, vals in enumerate(cache_vals) if vals is None]
+
+        if len(missing) > 0:
+            logger.debug("Recalculating cached fit values...")
 
             # ================
             # Fit the Function
             # ================
             od_bins = np.linspace(start=-1, stop=2, num=num_bins)
+            bin_centres = (od_bins[:-1] + od_bins[1:])/2
 
-            hist, bin_edges = np.histogram(deltas,
-                                           bins=od_bins)
-            bin_centres = (bin_edges[:-1] + bin_edges[1:])/2
+            hists = histogram_stack([deltas[i] for i in missing], od_bins)
 
-            repeat = True
-            while repeat:
-                try:
-                    popt, pcov = scipy.optimize.curve_fit(
-                        self.func, bin_centres, hist, p0=self._p0)
-                    repeat = False
-                except RuntimeError as re:
-                    logger.error(
-                        "Could not fit curve to data, defaulting to initial guess parameters!")
-                    logger.error(re)
+            jac = funcs.JACOBIANS.get(self.func.__name__)
+            initial_p0 = list(self._p0)
 
-                    if self.func is funcs.n_gaussian:
-                        p0s = self._p0
-                        p0s = p0s[:-3]
-                        if len(p0s) > 0:
-                            self._p0 = p0s
+            p0s = []
+            for i in missing:
+                p0 = initial_p0
+                if i > 0 and cache_vals[i - 1] is not None and \
+                        len(cache_vals[i - 1][POPT_KEY]) == len(initial_p0):
+                    p0 = cache_vals[i - 1][POPT_KEY]
+                p0s.append(p0)
 
-                            logger.info(
-                                f"Repeating calculation for N={len(p0s) // 3}")
-                            continue
+            popts = self._fit_batch(
+                bin_centres, hists, np.array(p0s, dtype=np.float64), jac)
 
-                    unpacker = lambda *x: x
-                    popt = unpacker(*self._p0)
+            for i, hist, popt in zip(missing, hists, popts):
+                if not np.all(np.isfinite(popt)):
+                    logger.debug(
+                        f"Joint fit failed at r={radii[i]}, refitting alone...")  # noqa: E501
 
-                    repeat = False
-                    break
+                    # Each refit starts from the full initial guess
+                    self._p0 = list(initial_p0)
+                    popt = self._fit(bin_centres, hist, jac)
 
-            logger.debug(f"Curve fit coefficients are: {popt}")
+                cache_vals[i] = self._fit_values(bin_centres, hist, popt)
 
-            # Get the fitted curve
-            hist_fit = self.func(bin_centres, *popt)
+                self._cache[keys[i]] = cache_vals[i]
+        else:
+            logger.debug("Using cached fits values...")
 
-            # Filter the result:
-            # hist_fit = funcs.filter_fit(hist_fit)
+        return [(vals[BIN_CENTRE_KEY], vals[HIST_FIT_KEY], vals[R2_KEY],
+                 vals[POPT_KEY]) for vals in cache_vals]
+
+    def _fit_batch(self, bin_centres: np.ndarray, hists: np.ndarray, p0s: np.ndarray, jac: Callable) -> np.ndarray:  # noqa: E501
+        """
+        Fits the function to every histogram (a row each) as one stacked
+        least squares problem, with the same Levenberg-Marquardt solver as
+        curve_fit. The parameters of each histogram only affect its own
+        residuals, so the Jacobian is block diagonal. Returns a row of
+        parameters per histogram, NaN where the fit failed.
+        """
+        logger = logging.getLogger(__name__ + "." + self._fit_batch.__name__)
+
+        num_hists, num_params = p0s.shape
+        popts = np.full((num_hists, num_params), np.nan)
+
+        # Each histogram needs at least as many bins as parameters
+        if len(bin_centres) < num_params:
+            return popts
+
+        x = np.tile(bin_centres, (num_hists, 1))
+        hists = np.asarray(hists, dtype=np.float64)
+
+        def residuals(p):
+            p = p.reshape(num_hists, num_params)
+            return (self.func(x, *p.T[:, :, None]) - hists).ravel()
+
+        def jacobian(p):
+            p = p.reshape(num_hists, num_params)
+            return scipy.linalg.block_diag(*jac(x, *p.T[:, :, None]))
+
+        try:
+            res = scipy.optimize.least_squares(
+                residuals, p0s.ravel(), method="lm",
+                jac=jacobian if jac is not None else "2-point")
+        except (ValueError, np.linalg.LinAlgError) as e:
+            logger.debug("Joint fit failed")
+            logger.debug(e)
+            return popts
+
+        if not res.success:
+            logger.debug(f"Joint fit didn't converge: {res.message}")
+            return popts
+
+        popts[:] = res.x.reshape(num_hists, num_params)
+        logger.debug(
+            f"Fitted {num_hists} histograms jointly in {res.nfev} evaluations")  # noqa: E501
 
-            # =============================================================
-            # R^2 QUALITY OF FIT TEST
-            # =============================================================
-            logger.debug("Calculating R^2 value")
+        return popts
 
-            ss_res = np.sum((hist - hist_fit)**2)
-            ss_tot = np.sum((hist - np.mean(hist))**2)
+    def _fit(self, bin_centres: np.ndarray, hist: np.ndarray, jac: Callable) -> list:  # noqa: E501
+        logger = logging.getLogger(__name__ + "." + self._fit.__name__)
 
-            r2 = 1 - (ss_res / ss_tot)
+        repeat = True
+        while repeat:
+            try:
+                popt, pcov = scipy.optimize.curve_fit(
+                    self.func, bin_centres, hist, p0=self._p0, jac=jac)
+                repeat = False
+            except RuntimeError as re:
+                logger.error(
+                    "Could not fit curve to data, defaulting to initial guess parameters!")
+                logger.error(re)
 
-            logger.debug(f"R^2 is = {r2}")
+                if self.func is funcs.n_gaussian:
+                    p0s = self._p0
+                    p0s = p0s[:-3]
+                    if len(p0s) > 0:
+                        self._p0 = p0s
 
-            # =============================================================
-            # CACHE RESULTS
-            # =============================================================
-            cache_vals = {
-                BIN_CENTRE_KEY: bin_centres,
-                HIST_FIT_KEY: hist_fit,
-                R2_KEY: r2,
-                POPT_KEY: popt
-            }
+                        logger.info(
+                            f"Repeating calculation for N={len(p0s) // 3}")
+                        continue
 
-            self._cache[key] = cache_vals
-        else:
-            logger.debug("Using cached fits values...")
+                unpacker = lambda *x: x
+                popt = unpacker(*self._p0)
+
+                repeat = False
+                break
+
+        logger.debug(f"Curve fit coefficients are: {popt}")
+
+        return popt
+
+    def _fit_values(self, bin_centres: np.ndarray, hist: np.ndarray, popt: list) -> dict:  # noqa: E501
+        logger = logging.getLogger(__name__ + "." + self._fit_values.__name__)
+
+        # Get the fitted curve
+        hist_fit = self.func(bin_centres, *popt)
+
+        # Filter the result:
+        # hist_fit = funcs.filter_fit(hist_fit)
+
+        # =============================================================
+        # R^2 QUALITY OF FIT TEST
+        # =============================================================
+        logger.debug("Calculating R^2 value")
+
+        ss_res = np.sum((hist - hist_fit)**2)
+        ss_tot = np.sum((hist - np.mean(hist))**2)
+
+        r2 = 1 - (ss_res / ss_tot)
+
+        logger.debug(f"R^2 is = {r2}")
+
+        # =============================================================
+        # CACHE RESULTS
+        # =============================================================
+        return {
+            BIN_CENTRE_KEY: bin_centres,
+            HIST_FIT_KEY: hist_fit,
+            R2_KEY: r2,
+            POPT_KEY: popt
+        }
+
+
+def histogram_stack(deltas: List[np.ndarray], bins: np.ndarray) -> np.ndarray:
+    """
+    Bins each of the arrays into the same (evenly spaced) bins at once,
+    giving one histogram per row, matching np.histogram's bin edges
+    """
+    num_bins = len(bins) - 1
+    lo, hi = bins[0], bins[-1]
+
+    rows = np.repeat(np.arange(len(deltas)), [len(d) for d in deltas])
+    values = np.empty(0)
+    if len(deltas) > 0:
+        values = np.concatenate(
+            [np.asarray(d, dtype=np.float64) for d in deltas])
+
+    inside = (values >= lo) & (values <= hi)
+    rows, values = rows[inside], values[inside]
+
+    idxs = ((values - lo) / (hi - lo) * num_bins).astype(np.int64)
+    # The last bin includes its right edge
+    idxs = np.minimum(idxs, num_bins - 1)
+    # Correct for rounding at the edges, as np.histogram does
+    idxs[values < bins[idxs]] -= 1
+    idxs[(values >= bins[idxs + 1]) & (idxs != num_bins - 1)] += 1
+
+    counts = np.bincount(rows * num_bins + idxs,
+                         minlength=len(deltas) * num_bins)
 
-        return cache_vals[BIN_CENTRE_KEY], cache_vals[HIST_FIT_KEY], cache_vals[R2_KEY], cache_vals[POPT_KEY]
+    return counts.reshape(len(deltas), num_bins)
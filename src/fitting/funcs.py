@@ -1,6 +1,8 @@
+import logging
 from typing import Any, Callable
 
 import numpy as np
+import scipy.optimize as optimize
 import scipy.special as sp
 
 FuncType = Callable[[np.ndarray, Any], np.ndarray]
@@ -48,3 +50,204 @@ def n_gaussian(x, *params):
         y = y + amp * np.exp(-((x - ctr) / wid)**2)
 
     return y
+
+
+# Analytic Jacobians of the fitting functions with respect to their
+# parameters, with a column per parameter
+
+
+def gaussian_jac(x, *p):
+    A, mu, sigma = p
+    e = np.exp(-(x - mu)**2 / (2 * sigma**2))
+    f = A * e
+
+    return np.stack([e,
+                     f * (x - mu) / sigma**2,
+                     f * (x - mu)**2 / sigma**3], axis=-1)
+
+
+def skew_gaussian_jac(x, sigmag, mu, alpha, c, a):
+    t = (x - mu) / sigmag
+    normpdf = (1 / (sigmag * np.sqrt(2 * np.pi))) * np.exp(-t**2 / 2)
+    normcdf = 0.5 * (1 + sp.erf(alpha * t / np.sqrt(2)))
+    # Derivative of the normal CDF with respect to alpha * t
+    g = np.exp(-(alpha * t)**2 / 2) / np.sqrt(2 * np.pi)
+
+    d_sigmag = 2 * a * normpdf * ((t**2 - 1) * normcdf - alpha * t * g) / sigmag  # noqa: E501
+    d_mu = 2 * a * normpdf * (t * normcdf - alpha * g) / sigmag
+    d_alpha = 2 * a * normpdf * t * g
+    d_c = np.ones_like(x, dtype=np.float64)
+    d_a = 2 * normpdf * normcdf
+
+    return np.stack([d_sigmag, d_mu, d_alpha, d_c, d_a], axis=-1)
+
+
+def n_gaussian_jac(x, *params):
+    cols = []
+
+    for i in range(0, len(params), 3):
+        ctr = params[i]
+        amp = params[i+1]
+        wid = params[i+2]
+
+        u = (x - ctr) / wid
+        e = np.exp(-u**2)
+        cols += [amp * e * 2 * u / wid, e, amp * e * 2 * u**2 / wid]
+
+    return np.stack(cols, axis=-1)
+
+
+JACOBIANS = {
+    gaussian.__name__: gaussian_jac,
+    skew_gaussian.__name__: skew_gaussian_jac,
+    n_gaussian.__name__: n_gaussian_jac,
+}
+
+
+# Integrals of the fitting functions from x0 to infinity, with any negative
+# values of the functions taken as 0 (as filter_val). These are NaN where no
+# closed form holds, i.e. where the function goes negative beyond x0.
+
+
+def gaussian_tail(x0, A, mu, sigma):
+    if A <= 0 or sigma == 0:
+        return 0.0
+
+    sigma = np.abs(sigma)
+
+    return A * sigma * np.sqrt(np.pi / 2) * \
+        sp.erfc((x0 - mu) / (np.sqrt(2) * sigma))
+
+
+def skew_gaussian_tail(x0, sigmag, mu, alpha, c, a):
+    logger = logging.getLogger(__name__ + "." + skew_gaussian_tail.__name__)
+
+    # A negative width mirrors the skew normal
+    if sigmag < 0:
+        sigmag, alpha, a = -sigmag, -alpha, -a
+    if a <= 0 or sigmag == 0:
+        a = 0.0
+
+    # A positive offset never decays, so its tail would diverge. It only
+    # lifts the fit over the (finite) range of the histogram, so the tail is
+    # taken from the skew normal part alone.
+    if c > 0:
+        logger.warning(
+            f"Ignoring the positive offset c={c} of the skew gaussian in its tail")  # noqa: E501
+        c = 0.0
+
+    if a == 0:
+        return 0.0
+
+    # The skew normal part is unimodal, so is only above the (negative)
+    # offset between two crossings, beyond which the function is clipped
+    lo, hi = x0, np.inf
+    if c < 0:
+        crossings = _skew_gaussian_crossings(sigmag, mu, alpha, c, a)
+        if crossings is None:
+            return 0.0
+
+        lo, hi = max(x0, crossings[0]), crossings[1]
+        if lo >= hi:
+            return 0.0
+
+    def survival(x):
+        # 1 - the skew normal CDF, Phi(h) - 2 T(h, alpha)
+        if np.isinf(x):
+            return 0.0
+
+        h = (x - mu) / sigmag
+        return sp.erfc(h / np.sqrt(2)) / 2 + 2 * sp.owens_t(h, alpha)
+
+    integral = a * (survival(lo) - survival(hi))
+    if c < 0:
+        integral += c * (hi - lo)
+
+    return max(integral, 0.0)
+
+
+def _skew_gaussian_crossings(sigmag, mu, alpha, c, a):
+    """
+    Where the (positive) skew gaussian part crosses the magnitude of the
+    negative offset, or None if it never reaches it
+    """
+    def excess(x):
+        return skew_gaussian(x, sigmag, mu, alpha, c, a)
+
+    # The mode of a skew normal is within a few widths of its location
+    res = optimize.minimize_scalar(
+        lambda x: -excess(x), bounds=(mu - 3 * sigmag, mu + 3 * sigmag),
+        method="bounded")
+    mode = res.x
+    if excess(mode) <= 0:
+        return None
+
+    # The skew normal part is negligible this many widths from its mode
+    far = 40 * sigmag
+    left = optimize.brentq(excess, mode - far, mode)
+    right = optimize.brentq(excess, mode, mode + far)
+
+    return left, right
+
+
+def n_gaussian_tail(x0, *params):
+    amps = np.asarray(params[1::3])
+    if np.any(amps < 0):
+        return np.nan
+
+    ctrs = np.asarray(params[0::3])
+    wids = np.abs(params[2::3])
+
+    return float(np.sum(amps * wids * np.sqrt(np.pi) / 2 *
+                        sp.erfc((x0 - ctrs) / wids)))
+
+
+TAILS = {
+    gaussian.__name__: gaussian_tail,
+    skew_gaussian.__name__: skew_gaussian_tail,
+    n_gaussian.__name__: n_gaussian_tail,
+}
+
+# Number of nodes of the fixed grid quadrature of the tails
+NUM_TAIL_NODES = 1024
+
+
+def tail_integrals(func: FuncType, params: list, x0: float) -> np.ndarray:
+    """
+    Integrals of the fitting function with each set of parameters from x0
+    to infinity, with negative values of the function taken as 0. Closed
+    forms are used where they exist, with the rest integrated together on
+    a fixed grid.
+    """
+    tail = TAILS.get(func.__name__)
+
+    F = np.full(len(params), np.nan)
+    if tail is not None:
+        for i, popt in enumerate(params):
+            F[i] = tail(x0, *popt)
+
+    # Integrate the rest with the same number of parameters in one call
+    remaining = np.flatnonzero(np.isnan(F))
+    for num_params in set(len(params[i]) for i in remaining):
+        idxs = [i for i in remaining if len(params[i]) == num_params]
+        popts = np.array([params[i] for i in idxs], dtype=np.float64)
+
+        F[idxs] = _grid_tail_integrals(func, popts, x0)
+
+    return F
+
+
+def _grid_tail_integrals(func: FuncType, popts: np.ndarray, x0: float) -> np.ndarray:  # noqa: E501
+    # Gauss-Legendre nodes on [0, 1), mapped onto [x0, inf) by
+    # x = x0 + t / (1 - t)
+    t, w = np.polynomial.legendre.leggauss(NUM_TAIL_NODES)
+    t, w = (t + 1) / 2, w / 2
+
+    x = x0 + t / (1 - t)
+    dx_dt = 1 / (1 - t)**2
+
+    # Evaluate every set of parameters at once, a row each
+    y = func(np.tile(x, (len(popts), 1)), *popts.T[:, :, None])
+    y = np.clip(y, 0, None)
+
+    return np.sum(y * w * dx_dt, axis=-1)
@@ -9,8 +9,6 @@ import sys
 if os.getcwd() not in sys.path:
     sys.path.append(os.getcwd())
 
-import yt
-
 from src.actions import (mass_function, overdensity, press_schechter, rho_bar,
                          std_dev)
 from src.util import orchestrator
@@ -45,6 +43,6 @@ def main(args):
 
 
 if __name__ == "__main__":
-    if yt.is_root():
-        # Drop the program name from the sys.args
-        main(sys.argv[1:])
+    # Every rank runs the pipeline, so that the work can be shared
+    # Drop the program name from the sys.args
+    main(sys.argv[1:])
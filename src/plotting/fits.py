@@ -7,9 +7,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 import src.plotting.interface as I
 import unyt
-import yt
 from src.fitting import fits, funcs
-from src.util import data, enum
+from src.util import data, enum, parallel
 
 
 class Fits(I.IPlot):
@@ -27,7 +26,7 @@ class Fits(I.IPlot):
                  fig: plt.Figure = None) -> Tuple[plt.Figure, np.ndarray]:
         logger = logging.getLogger(__name__ + "." + self._gen_fit.__name__)
 
-        if not yt.is_root():
+        if not parallel.is_root():
             return
 
         logger.debug(
@@ -4,9 +4,9 @@ import os
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import numpy as np
-from src.calc.mass_function import create_histogram
+from src.calc.histogram import LogHistogram
 import src.plotting.interface as I
-import yt
+from src.util import parallel
 
 
 class MassFunction(I.IPlot):
@@ -55,12 +55,13 @@ class MassFunction(I.IPlot):
     def mass_function(self,
                       z: float,
                       radius: float,
-                      mass_hist: np.ndarray,
-                      bin_edges: np.ndarray,
+                      hist: LogHistogram,
                       sim_name: str):
-        if not yt.is_root():
+        if not parallel.is_root():
             return
 
+        mass_hist, bin_centres = hist.nonzero()
+
         logger = logging.getLogger(
             __name__ + "." + self.mass_function.__name__)
         logger.debug(f"Plotting mass function at z={z:.2f}...")
@@ -69,15 +70,16 @@ class MassFunction(I.IPlot):
         save_dir = self.mass_fn_dir(sim_name)
         plot_name = self.mass_fn_fname(sim_name, radius, z)
 
-        self._mass_function(bin_edges, mass_hist, title,
+        self._mass_function(bin_centres, mass_hist, title,
                             save_dir, plot_name)
         logger.debug(f"Saved mass function figure to '{plot_name}'")
 
     def total_mass_function(self,
                             z: float,
-                            mass_hist: np.ndarray,
-                            mass_bins: np.ndarray,
+                            total: LogHistogram,
                             sim_name: str):
+        mass_hist, mass_bins = total.nonzero()
+
         # Set the parameters used for the plotting & plot the mass function
         title = f"Total Mass Function for z={z:.2f}"
         save_dir = self.total_dir(sim_name)
@@ -128,11 +130,16 @@ class MassFunction(I.IPlot):
 
     def press_schechter_total_comparison(self,
                                          z: float,
-                                         total_bins: np.ndarray,
-                                         total_hist: np.ndarray,
+                                         total: LogHistogram,
                                          Ms: np.ndarray,
                                          ps_fit: np.ndarray,
                                          sim_name: str):
+        # The total mass function is only calculated on the root rank
+        if total is None:
+            return
+
+        total_hist, total_bins = total.nonzero()
+
         fig = self.new_figure()
 
         title = f"Compared Press Schecter Mass Function at z={z:.2f}"  # noqa: E501
@@ -174,11 +181,12 @@ class MassFunction(I.IPlot):
     def press_schechter_analytic_comparison(self,
                                             z: float,
                                             radius: float,
-                                            analytic_masses: np.ndarray,
-                                            analytic: np.ndarray,
+                                            hist: LogHistogram,
                                             ps_masses: np.ndarray,
                                             ps_fit: np.ndarray,
                                             sim_name: str):
+        analytic, analytic_masses = hist.nonzero()
+
         fig = self.new_figure()
         logger = logging.getLogger(
             __name__ + "." + self.press_schechter_analytic_comparison.__name__)
@@ -260,12 +268,16 @@ class MassFunction(I.IPlot):
 
     def total_to_numerical_comparison(self,
                                       z: float,
-                                      total_bins: np.ndarray,
-                                      total_hist: np.ndarray,
+                                      total: LogHistogram,
                                       Ms: np.ndarray,
                                       numeric: np.ndarray,
                                       sim_name: str,
                                       fit_name: str):
+        if total is None:
+            return
+
+        total_hist, total_bins = total.nonzero()
+
         fig = self.new_figure()
         logger = logging.getLogger(
             __name__ + "." + self.total_to_numerical_comparison.__name__)
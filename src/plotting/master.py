@@ -2,8 +2,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 import src.fitting.funcs as f
 import unyt
-import yt
 from src.plotting import fits, mass_function, overdensity, std_dev
+from src.util import parallel
 
 
 class Plotter(mass_function.MassFunction, overdensity.Overdensity, std_dev.StandardDeviation, fits.Fits):
@@ -15,7 +15,7 @@ class Plotter(mass_function.MassFunction, overdensity.Overdensity, std_dev.Stand
                  num_bins: int,
                  fig: plt.Figure = None):
 
-        if not yt.is_root():
+        if not parallel.is_root():
             return
 
         autosave = fig is None
@@ -4,9 +4,9 @@ import os
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import unyt
-import yt
 import numpy as np
 import src.plotting.interface as I
+from src.util import parallel
 
 
 class Overdensity(I.IPlot):
@@ -18,7 +18,7 @@ class Overdensity(I.IPlot):
                       sim_name: str,
                       num_bins: int,
                       fig: plt.Figure = None):
-        if not yt.is_root():
+        if not parallel.is_root():
             return
 
         autosave = fig is None
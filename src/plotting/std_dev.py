@@ -4,7 +4,7 @@ import os
 import matplotlib.pyplot as plt
 import numpy as np
 import src.plotting.interface as I
-import yt
+from src.util import parallel
 
 
 class StandardDeviation(I.IPlot):
@@ -20,7 +20,7 @@ class StandardDeviation(I.IPlot):
                  legend=str,
                  logscale=False,
                  fig: plt.Figure = None):
-        if not yt.is_root():
+        if not parallel.is_root():
             return
 
         autosave = fig is None
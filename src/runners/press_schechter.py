@@ -9,6 +9,8 @@ import sys
 if os.getcwd() not in sys.path:
     sys.path.append(os.getcwd())
 
+from typing import List
+
 import yt
 from src.calc import (mass_function, overdensity, press_schechter, rho_bar,
                       std_dev)
@@ -21,6 +23,9 @@ from src.util import units as u
 
 class PressSchechterRunner(orchestrator.Orchestrator):
 
+    def fields(self) -> List[tuple]:
+        return self.type.sample_fields()
+
     def tasks(self, hf: str):
         logger = logging.getLogger(
             __name__ + "." +
@@ -86,34 +91,28 @@ class PressSchechterRunner(orchestrator.Orchestrator):
             avg_den = rb.rho_bar(hf)
             num_bins = self.config.sampling.num_hist_bins
 
-            masses, _ = sd.masses_sigmas(hf)
+            # Evaluate on a dense mass grid through the sigma(M) model
+            model = sd.sigma_model(hf)
+            masses = model.mass_grid(self.config.sampling.num_model_masses)
 
             for func_name, fitting_func in fitter.fit_functions().items():
                 logger.info(f"Plotting '{func_name}'")
 
                 # Set the fitting function to use
                 plotter.func = fitting_func
-                # Track the fitting parameters across radii
-                func_params = []
-
-                # Iterate over the radii
+                # Calculate the overdensities at each sampling radius
                 radii = self.config.radii
-                for radius in radii:
+                od = [ods.calc_overdensities(hf, radius) for radius in radii]
 
-                    # Calculate the overdensities at this sampling radius
-                    od = ods.calc_overdensities(hf, radius)
-
-                    # Get the fitting parameters to this overdensity
-                    fitter.setup_parameters(func_name)
-                    _, _, _, popt = fitter.calc_fit(
-                        z, radius, od, num_bins)
-
-                    # Track the fitting parameters
-                    func_params.append(popt)
+                # Fit all the radii together, tracking the fitting
+                # parameters across radii
+                fitter.setup_parameters(func_name)
+                func_params = [popt for _, _, _, popt in fitter.calc_fits(
+                    z, radii, od, num_bins)]
 
                 # Calculate the numerical mass function for this fit model
                 numerical_mass_function = ps.numerical_mass_function(
-                    avg_den, radii, masses, fitting_func, func_params)
+                    avg_den, radii, masses, fitting_func, func_params, model)
                 # Plot the mass function
                 plotter.numerical_mass_function(
                     z, numerical_mass_function, masses, self.sim_name, func_name)
@@ -178,13 +177,12 @@ class PressSchechterRunner(orchestrator.Orchestrator):
 
                     z = ds.current_redshift
 
-                    total_mass_hist, total_mass_bins = mf.total_mass_function(
-                        hf)
+                    total = mf.total_mass_function(hf)
                     masses, ps_fit = ps.mass_function(sf)
                     ps_fit = ps_fit.to(1 / u.volume(ds))
 
                     plotter.press_schechter_total_comparison(
-                        z, total_mass_bins, total_mass_hist, masses, ps_fit, self.sim_name)
+                        z, total, masses, ps_fit, self.sim_name)
 
         else:
             logger.info(
@@ -238,10 +236,10 @@ class PressSchechterRunner(orchestrator.Orchestrator):
                         logger.info(
                             f"Working on mass function: r={radius}")
 
-                        mass_hist, bin_edges = mf.mass_function(hf, radius)
+                        hist = mf.mass_function(hf, radius)
 
                         plotter.press_schechter_analytic_comparison(
-                            z, radius, bin_edges, mass_hist, masses, ps_fit, self.sim_name)
+                            z, radius, hist, masses, ps_fit, self.sim_name)
 
         else:
             logger.info("Skipping comparing analytic mass function plots...")
@@ -296,33 +294,27 @@ class PressSchechterRunner(orchestrator.Orchestrator):
                     # Get the PS mass function
                     masses, ps_fit = ps.mass_function(sf)
                     ps_fit = ps_fit.to(1 / u.volume(ds))
+                    model = sd.sigma_model(
+                        sf, self.config.sampling.std_dev_from_fit)
 
                     for func_name, fitting_func in fitter.fit_functions().items():
                         logger.info(f"Plotting '{func_name}'")
 
                         # Set the fitting function to use
                         plotter.func = fitting_func
-                        # Track the fitting parameters across radii
-                        func_params = []
-
-                        # Iterate over the radii
+                        # Calculate the overdensities at each sampling radius
                         radii = self.config.radii
-                        for radius in radii:
+                        od = [ods.calc_overdensities(sf, radius) for radius in radii]
 
-                            # Calculate the overdensities at this sampling radius
-                            od = ods.calc_overdensities(sf, radius)
-
-                            # Get the fitting parameters to this overdensity
-                            fitter.setup_parameters(func_name)
-                            _, _, _, popt = fitter.calc_fit(
-                                z, radius, od, num_bins)
-
-                            # Track the fitting parameters
-                            func_params.append(popt)
+                        # Fit all the radii together, tracking the fitting
+                        # parameters across radii
+                        fitter.setup_parameters(func_name)
+                        func_params = [popt for _, _, _, popt in fitter.calc_fits(
+                            z, radii, od, num_bins)]
 
                         # Calculate the numerical mass function for this fit model
                         numerical_mass_function = ps.numerical_mass_function(
-                            avg_den, radii, masses, fitting_func, func_params)
+                            avg_den, radii, masses, fitting_func, func_params, model)
                         # Plot the mass function
                         plotter.press_schechter_numerical_comparison(
                             z, masses, numerical_mass_function, ps_fit, self.sim_name, fitting_func.__name__)
@@ -384,40 +376,35 @@ class PressSchechterRunner(orchestrator.Orchestrator):
                     num_bins = self.config.sampling.num_hist_bins
 
                     # Total mass
-                    total_hist, total_bins = mf.total_mass_function(hf)
+                    total = mf.total_mass_function(hf)
 
-                    # Get the PS mass function
-                    masses, _ = sd.masses_sigmas(sf)
+                    # Evaluate on a dense mass grid through the sigma(M)
+                    # model
+                    model = sd.sigma_model(sf)
+                    masses = model.mass_grid(
+                        self.config.sampling.num_model_masses)
 
                     for func_name, fitting_func in fitter.fit_functions().items():
                         logger.info(f"Plotting '{func_name}'")
 
                         # Set the fitting function to use
                         plotter.func = fitting_func
-                        # Track the fitting parameters across radii
-                        func_params = []
-
-                        # Iterate over the radii
+                        # Calculate the overdensities at each sampling radius
                         radii = self.config.radii
-                        for radius in radii:
-
-                            # Calculate the overdensities at this sampling radius
-                            od = ods.calc_overdensities(sf, radius)
-
-                            # Get the fitting parameters to this overdensity
-                            fitter.setup_parameters(func_name)
-                            _, _, _, popt = fitter.calc_fit(
-                                z, radius, od, num_bins)
+                        od = [ods.calc_overdensities(sf, radius) for radius in radii]
 
-                            # Track the fitting parameters
-                            func_params.append(popt)
+                        # Fit all the radii together, tracking the fitting
+                        # parameters across radii
+                        fitter.setup_parameters(func_name)
+                        func_params = [popt for _, _, _, popt in fitter.calc_fits(
+                            z, radii, od, num_bins)]
 
                         # Calculate the numerical mass function for this fit model
                         numerical_mass_function = ps.numerical_mass_function(
-                            avg_den, radii, masses, fitting_func, func_params)
+                            avg_den, radii, masses, fitting_func, func_params, model)
                         # Compare to total mass function
                         plotter.total_to_numerical_comparison(
-                            z, total_bins, total_hist, masses, numerical_mass_function, self.sim_name, fitting_func.__name__)
+                            z, total, masses, numerical_mass_function, self.sim_name, fitting_func.__name__)
 
         else:
             logger.info(
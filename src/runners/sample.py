@@ -7,13 +7,18 @@ import sys
 if os.getcwd() not in sys.path:
     sys.path.append(os.getcwd())
 
+from typing import List
+
 import yt
-from src.util import orchestrator
+from src.util import orchestrator, parallel
 from src.calc.sample import Sampler
 
 
 class SampleRunner(orchestrator.Orchestrator):
 
+    def fields(self) -> List[tuple]:
+        return self.type.sample_fields()
+
     def tasks(self, hf: str):
         logger = logging.getLogger(
             __name__ + "." + SampleRunner.__name__ + "." + self.tasks.__name__)
@@ -25,7 +30,12 @@ class SampleRunner(orchestrator.Orchestrator):
         logger.info(f"Redshift is: {z}")
 
         radii = self.config.radii
-        for radius in yt.parallel_objects(radii):
+        if self.config.sampling.multi_radius:
+            logger.info(f"Generating samples at r={radii} & z={z}")
+            sampler.sample_radii(hf, radii, z)
+            return
+
+        for radius in yt.parallel_objects(radii, njobs=parallel.njobs(self.config)):
             logger.info(f"Generating samples at r={radius} & z={z}")
             sampler.sample(hf, radius, z)
 
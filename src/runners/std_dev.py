@@ -21,6 +21,9 @@ class StdDevRunner(orchestrator.Orchestrator):
         super().__init__(args)
         self.fig = None
 
+    def fields(self) -> List[tuple]:
+        return self.type.sample_fields()
+
     def tasks(self, hf: str):
         logger = logging.getLogger(
             __name__ + "." + StdDevRunner.__name__ + "." + self.tasks.__name__)
@@ -30,25 +30,33 @@ sim_regex = re.compile("^.*(GVD_C(\d{3})_l(\d+)n(\d+)_SLEGAC).*$")  # noqa: W605
 
 # Keys used in the helpers cache:
 REDSHIFTS_KEY = "redshifts"
+REDSHIFT_INDEX_KEY = "redshift_index"
 DIR_KEY = "dirs"
+DIR_INDEX_KEY = "dir_index"
 
 COORDINATES_CACHE_NAME = "coordinates"
 COORDINATES_CACHE_TOP5_NAME = "top5_halos"
 
 # Keys used in the cache
 TOTAL_MASS_FUNCTION_KEY = "all_masses"
+TOTAL_MASS_HIST_KEY = "total_hist"
 MASS_FUNCTION_KEY = "masses"
 RHO_BAR_KEY = "rho_bar"
 RHO_BAR_0_KEY = "rho_bar_0"
 OVERDENSITIES_KEY = "overdensities"
 STD_DEV_KEY = "standard_deviation"
+SIGMA_MODEL_KEY = "sigma_model"
 PRESS_SCHECHTER_KEY = "press_schechter"
 UNITS_KEY = "units"
 UNITS_PS_MASS = "ps_mass"
 UNITS_PS_STD_DEV = "ps_std_dev"
 SPHERES_KEY = "spheres"
 SAMPLES_KEY = "num_samples"
+CONVERGED_KEY = "converged"
 FITS_KEY = "fits"
+DENSITY_FIELD_KEY = "density_field"
+POWER_SPECTRUM_KEY = "power_spectrum"
+PROCESS_POOL_KEY = "process_pool"
 
 # Keys used in the fits cache:
 BIN_CENTRE_KEY = "bin_centres"
@@ -74,6 +74,13 @@ class DataType(enum.Enum):
     def index(self):
         return self._index()
 
+    def sample_fields(self):
+        """
+        The fields read when sampling spheres of the halos
+        """
+        return [self.index, self.coord_index_x(), self.coord_index_y(),
+                self.coord_index_z()]
+
     def get_regex(self) -> re.Pattern:
         if self is DataType.GROUP:
             return groups_regex
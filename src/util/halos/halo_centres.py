@@ -55,25 +55,28 @@ def _top_5_halo_data(halo_type: enum.DataType, root: str, sim_name: str, ds_cach
 
         fname = halo_fname[0]
 
-        ad = ds_cache.all_data(fname)
+        fields = [halo_type.index, halo_type.coord_index_x(),
+                  halo_type.coord_index_y(), halo_type.coord_index_z(),
+                  halo_type.virial_radii()]
+        ds_cache.prefetch(fname, halo_type, fields)
 
         logger.debug("Reading halo masses from dataset")
-        masses = ad[halo_type.index]
+        masses = ds_cache.field(fname, halo_type.index)
 
         logger.debug("Filtering masses for top 5 most massive")
         top5_idxs = np.argpartition(masses, -5)[-5:]
 
         logger.debug("Finding matching coords")
         top5_masses = masses[top5_idxs]
-        xs = ad[halo_type.coord_index_x()]
-        ys = ad[halo_type.coord_index_y()]
-        zs = ad[halo_type.coord_index_z()]
+        xs = ds_cache.field(fname, halo_type.coord_index_x())
+        ys = ds_cache.field(fname, halo_type.coord_index_y())
+        zs = ds_cache.field(fname, halo_type.coord_index_z())
 
         x = xs[top5_idxs]
         y = ys[top5_idxs]
         z = zs[top5_idxs]
 
-        virial_radii = ad[halo_type.virial_radii()]
+        virial_radii = ds_cache.field(fname, halo_type.virial_radii())
         v_radius = virial_radii[top5_idxs]
 
         logger.debug("Compiling cache data...")
@@ -2,12 +2,18 @@ import logging
 import math
 import os
 import re
-from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 
-import yt
+import numpy as np
 from src.cache import caching
-from src.util.constants import DIR_KEY, REDSHIFTS_KEY, sim_regex
+from src.util.constants import DIR_INDEX_KEY, REDSHIFT_INDEX_KEY, sim_regex
 from src.util import enum
+from src.util.halos import headers
+
+# Number of directories listed at once, the listing is bound by the file
+# system latency rather than the CPU
+SCAN_WORKERS = 16
 
 
 class HalosFinder(caching.Cache):
@@ -16,6 +22,7 @@ class HalosFinder(caching.Cache):
         self._type = halo_type
         self._root = root
         self._sim_name = sim_name
+        self._data_files = None
 
         cache_dir = f"./data/{sim_name}/{halo_type.value}/"
         super().__init__(caches_dir=cache_dir)
@@ -40,66 +47,98 @@ class HalosFinder(caching.Cache):
         logger = logging.getLogger(
             __name__ + "." + self._find_data_files.__name__)
 
-        def find(dirname: str, file_reg: re.Pattern, root_reg: re.Pattern = None):
-            lg = logging.getLogger(logger.name + "." + find.__name__)
-            halo_files = []
+        # Only scan the directories once per finder
+        if self._data_files is not None:
+            return self._data_files
+
+        dir_root = self._find_directory()
+        file_reg = self._type.get_regex()
+        root_reg = self._type.get_root_regex()
 
-            for root, dirs, files in os.walk(dirname):
-                for file in files:
-                    if file_reg.match(file):
-                        if root_reg is not None:
-                            if not root_reg.match(root):
-                                continue
-                        lg.debug(
-                            f"File '{file}' matched the provided regex, allocating to the paths")  # noqa: E501
-                        pth = os.path.join(root, file)
+        # Listing of each directory, alongside the directory's mtime when it
+        # was listed, so only the directories that changed are listed again
+        index = self[(DIR_INDEX_KEY,)].val
+        if index is None:
+            logger.debug(
+                f"'{DIR_INDEX_KEY}' key not found in cache, compiling new entry...")  # noqa: E501
+            index = {}
 
-                        halo_files.append(pth)
+        def scan(dirname: str):
+            return dirname, _scan_directory(
+                dirname, index.get(dirname), file_reg, root_reg)
 
-            return halo_files
+        new_index = {}
 
-        halo_dirs = self[(DIR_KEY,)].val
-        if halo_dirs is None:
-            logger.debug(
-                f"'{DIR_KEY}' key not found in cache, compiling new entry...")
+        # Walk the tree a level at a time, listing the sibling directories
+        # (i.e. the snapdir_* directories) in parallel
+        frontier = [dir_root]
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+            while len(frontier) > 0:
+                next_frontier = []
 
-            dir_root = self._find_directory()
+                for dirname, entry in executor.map(scan, frontier):
+                    if entry is None:
+                        continue
 
-            files = find(dir_root, self._type.get_regex(),
-                         self._type.get_root_regex())
+                    new_index[dirname] = entry
+                    next_frontier += [os.path.join(dirname, d)
+                                      for d in entry[2]]
 
-            halo_dirs = sorted(files)
+                frontier = next_frontier
 
-            self[(DIR_KEY,)] = halo_dirs
+        if new_index != index:
+            logger.debug(f"Updating '{DIR_INDEX_KEY}' cache entry")
+            self[(DIR_INDEX_KEY,)] = new_index
 
-        return halo_dirs
+        self._data_files = sorted(
+            f for entry in new_index.values() for f in entry[1])
+
+        return self._data_files
 
     def _determine_redshifts(self) -> Dict[float, str]:
         logger = logging.getLogger(
             __name__ + "." + self._determine_redshifts.__name__)
 
-        map = self[(REDSHIFTS_KEY,)].val
-        # If the map is an empty dictionary
-        if map is None:
+        halo_files = self._find_data_files()
+        fname_regex = self._type.get_regex()
+
+        # Index of the redshift of each file, alongside the file's mtime and
+        # size when it was read, so only new or changed files are read
+        index = self[(REDSHIFT_INDEX_KEY,)].val
+        if index is None:
             logger.warning(
-                f"'{REDSHIFTS_KEY}' key not found in cache, creating entry...")
+                f"'{REDSHIFT_INDEX_KEY}' key not found in cache, creating entry...")  # noqa: E501
+            index = {}
+
+        updated = False
 
-            halo_files = self._find_data_files()
-            fname_regex = self._type.get_regex()
+        for hf in halo_files:
+            stat = os.stat(hf)
 
-            map = {}
+            entry = index.get(hf)
+            if entry is not None and entry[0] == stat.st_mtime \
+                    and entry[1] == stat.st_size:
+                continue
 
-            for hf in halo_files:
-                ds = yt.load(hf)
-                z = ds.current_redshift
+            z = headers.read_redshift(hf, self._type)
+            logger.debug(f"Read a redshift of z={z} from '{hf}'")
 
-                hf_num = fname_regex.match(hf).group(2)
+            index[hf] = (stat.st_mtime, stat.st_size, z)
+            updated = True
 
-                logger.debug(f"Read a redshift of z={z} from '{hf}'")
+        # Forget the files that no longer exist
+        for hf in set(index.keys()) - set(halo_files):
+            logger.debug(f"'{hf}' no longer exists, removing from index")
+            del index[hf]
+            updated = True
 
-                map[z] = hf_num
+        if updated:
+            self[(REDSHIFT_INDEX_KEY,)] = index
 
-            self[(REDSHIFTS_KEY,)] = map
+        map = {}
+        for hf in halo_files:
+            hf_num = fname_regex.match(hf).group(2)
+            map[index[hf][2]] = hf_num
 
         return map
 
@@ -110,29 +149,17 @@ class HalosFinder(caching.Cache):
 
         # map of redshift to halo file name
         all_redshifts = self._determine_redshifts()
+        if len(all_redshifts) == 0:
+            logger.warning("No redshifts found to match against!")
+            return {}
 
-        redshifts = {}
-        matchs = {}
-
-        for k in all_redshifts.keys():
-            for z in desired:
-
-                if z not in matchs:
-                    matchs[z] = k
-                    logger.debug(
-                        f"No match yet for '{z}' initialising match as '{k}'")
-
-                current_diff = abs(matchs[z] - z)
-                new_diff = abs(k - z)
+        zs = np.array(sorted(all_redshifts.keys()))
+        matchs = nearest_redshifts(zs, desired)
 
-                if new_diff < current_diff:
-                    matchs[z] = k
-                    logger.debug(
-                        f"Redshift of '{k}' is closer to '{z}' storing in dict...")
-
-        for k, v in matchs.items():
-            redshifts[v] = all_redshifts[v]
-            logger.debug(f"Final match of '{k}' = '{v}'")
+        redshifts = {}
+        for z, k in zip(desired, matchs):
+            logger.debug(f"Final match of '{z}' = '{k}'")
+            redshifts[k] = all_redshifts[k]
 
         return redshifts
 
@@ -143,18 +170,68 @@ class HalosFinder(caching.Cache):
 
         redshifts = self._filter_redshifts(desired)
         halo_dirs = self._find_data_files()
+        fname_regex = self._type.get_regex()
 
         logger.debug(f"Filtering data files around redshifts '{desired}'")
 
-        file_idxs = redshifts.values()
-
-        halo_fnames = [os.path.basename(f) for f in halo_dirs]
+        # The files of each snapshot number
+        snapshots: Dict[str, List[str]] = {}
+        for hf in halo_dirs:
+            snapshots.setdefault(fname_regex.match(hf).group(2), []).append(hf)
 
         filtered_dirs = []
-        for idx in file_idxs:
-            for i in range(len(halo_fnames)):
-                fname = halo_fnames[i]
-                if idx in fname:
-                    filtered_dirs.append(halo_dirs[i])
+        for idx in redshifts.values():
+            filtered_dirs += snapshots.get(idx, [])
 
         return filtered_dirs
+
+
+def nearest_redshifts(zs: np.ndarray, desired: List[float]) -> np.ndarray:
+    """
+    Finds the closest of the (sorted) redshifts to each of the desired
+    redshifts, taking the higher redshift on ties
+    """
+    desired = np.atleast_1d(np.asarray(desired, dtype=np.float64))
+
+    if len(zs) == 1:
+        return np.repeat(zs, len(desired))
+
+    idxs = np.clip(np.searchsorted(zs, desired), 1, len(zs) - 1)
+
+    lower, upper = zs[idxs - 1], zs[idxs]
+    idxs -= (desired - lower) < (upper - desired)
+
+    return zs[idxs]
+
+
+def _scan_directory(dirname: str, cached: tuple, file_reg: re.Pattern, root_reg: re.Pattern = None) -> Tuple[float, List[str], List[str]]:  # noqa: E501
+    """
+    Lists the data files matching the regexes and the sub directories of the
+    directory, reusing the cached listing if the directory hasn't changed.
+    Returns None if the directory no longer exists.
+    """
+    logger = logging.getLogger(__name__ + "." + _scan_directory.__name__)
+
+    try:
+        mtime = os.stat(dirname).st_mtime
+    except FileNotFoundError:
+        return None
+
+    if cached is not None and cached[0] == mtime:
+        return cached
+
+    logger.debug(f"Listing directory '{dirname}'")
+
+    files, subdirs = [], []
+    matches_root = root_reg is None or root_reg.match(dirname)
+
+    with os.scandir(dirname) as it:
+        for entry in it:
+            if entry.is_dir():
+                # Like os.walk, don't follow symlinked directories
+                if not entry.is_symlink():
+                    subdirs.append(entry.name)
+            elif matches_root and file_reg.match(entry.name):
+                files.append(os.path.join(dirname, entry.name))
+
+    return mtime, sorted(files), sorted(subdirs)
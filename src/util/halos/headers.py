@@ -0,0 +1,63 @@
+import logging
+import struct
+
+import h5py
+import yt
+from src.util import enum
+from src.util.constants import halos_h5_regex
+
+# Rockstar binary outputs start with the magic number, snapshot and chunk
+# numbers (all 64 bit) followed by the (32 bit float) scale factor
+ROCKSTAR_SCALE_FORMAT = "<Qqqf"
+
+
+def read_redshift(fname: str, halo_type: enum.DataType) -> float:
+    """
+    Reads the redshift of the data file from its header (or name) without
+    loading the data set, falling back on yt if the header can't be read
+    """
+    logger = logging.getLogger(__name__ + "." + read_redshift.__name__)
+
+    try:
+        if halo_type is enum.DataType.ROCKSTAR:
+            return _rockstar_redshift(fname)
+        elif halo_type is enum.DataType.H5:
+            return _halos_h5_redshift(fname)
+
+        return _hdf5_redshift(fname)
+
+    except (OSError, KeyError, ValueError, struct.error) as e:
+        logger.warning(
+            f"Couldn't read the redshift from the header of '{fname}', loading the data set instead")  # noqa: E501
+        logger.warning(e)
+
+    return yt.load(fname).current_redshift
+
+
+def _hdf5_redshift(fname: str) -> float:
+    with h5py.File(fname, "r") as f:
+        header = f["Header"].attrs
+
+        if "Redshift" in header:
+            return float(header["Redshift"])
+
+        # Otherwise stored as the scale factor
+        return 1 / float(header["Time"]) - 1
+
+
+def _halos_h5_redshift(fname: str) -> float:
+    # The scale factor is in the name of the file
+    m = halos_h5_regex.match(fname)
+    if not m:
+        raise ValueError(f"'{fname}' isn't named with a scale factor")
+
+    return 1 / float(m.group(2)) - 1
+
+
+def _rockstar_redshift(fname: str) -> float:
+    size = struct.calcsize(ROCKSTAR_SCALE_FORMAT)
+
+    with open(fname, "rb") as f:
+        _, _, _, scale = struct.unpack(ROCKSTAR_SCALE_FORMAT, f.read(size))
+
+    return 1 / float(scale) - 1
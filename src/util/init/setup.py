@@ -4,7 +4,7 @@ import os
 
 import yaml
 import yt
-from src.cache import caching, dataset
+from src.cache import caching, columns, dataset
 from src.util.constants import LOG_FILENAME
 from src.util.init import conf as config
 from src.util.data import Data
@@ -28,8 +28,15 @@ def setup(args) -> Data:
     yt.enable_parallelism()
     logger.info("Parallelism enabled...")
 
-    ds_cache = dataset.new()
-    logger.debug("Created data set cached reader")
+    cols = columns.ColumnStore() if conf.caches.use_column_store else None
+    ds_cache = dataset.new(int(conf.caches.dataset_cache_bytes), cols,
+                           int(conf.caches.dataset_cache_entries),
+                           int(conf.caches.dataset_base_bytes))
+    logger.debug(
+        f"Created data set cached reader with a budget of {ds_cache.max_bytes} bytes and {ds_cache.max_entries} data sets")  # noqa: E501
+
+    caching.set_default_backend(conf.caches.backend)
+    logger.debug(f"Using the '{conf.caches.backend}' cache backend")
 
     cache = caching.Cache()
 
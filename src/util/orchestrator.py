@@ -4,7 +4,7 @@ from typing import List
 import yt
 from src.util.halos import halo_finder
 from src.util.init import setup
-from src.util import enum, interface
+from src.util import enum, interface, parallel
 
 
 class Orchestrator(interface.Interface):
@@ -15,13 +15,15 @@ class Orchestrator(interface.Interface):
 
     def run(self):
         yt.enable_parallelism()
-        if not yt.is_root():
-            return
+
+        # Every rank runs the pipeline, sharing the work through the
+        # parallel_objects loops
+        njobs = parallel.njobs(self.config)
 
         logger = logging.getLogger(self.run.__name__)
 
         # Iterate over the simulations
-        for sim_name in yt.parallel_objects(self.config.sim_data.simulation_names):
+        for sim_name in yt.parallel_objects(self.config.sim_data.simulation_names, njobs=njobs):
 
             # Save the current sim name into the data object
             self.sim_name = sim_name
@@ -38,7 +40,7 @@ class Orchestrator(interface.Interface):
             self.config.max_radius = max(radii)
             logger.debug(f"Maximum radius is: {self.config.max_radius}")
 
-            for tp in yt.parallel_objects(enum.DataType):
+            for tp in yt.parallel_objects(enum.DataType, njobs=njobs):
                 self.type = tp
 
                 logger.info(f"Working on {tp.value} datasets:")
@@ -57,18 +59,28 @@ class Orchestrator(interface.Interface):
                     f"Found {n_hfs} halo files that match these redshifts")
 
                 # Run halo file calculations...
-                for hf in yt.parallel_objects(halo_files):
+                for hf in yt.parallel_objects(halo_files, njobs=njobs):
+                    # Read the fields the tasks use in one pass up front
+                    self.dataset_cache.prefetch(hf, self.type, self.fields())
+
                     self.tasks(hf)
 
-                    # Clear the data set cache between iterations as the
-                    # data isn't persistent anyway, and this saves memory
-                    logger.debug("Clearing dataset cache for new iteration")
-                    self.dataset_cache.clear()
+                    # The data set cache evicts the least recently used
+                    # data sets itself once over its memory budget
+                    logger.debug(
+                        f"Data set cache stats: {self.dataset_cache.stats()}")
 
                 # Reset the cache between simulations to save memory
                 self._cache.reset()
 
             logger.info("DONE calculations\n")
 
+    def fields(self) -> List[tuple]:
+        """
+        The fields of the halo catalogues read by the tasks, prefetched
+        before the tasks are run on each halo file
+        """
+        return []
+
     def tasks(self, hf: str):
         pass
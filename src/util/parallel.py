@@ -0,0 +1,53 @@
+import logging
+
+from yt.utilities.parallel_tools.parallel_analysis_interface import \
+    communication_system
+
+
+def communicator():
+    """
+    The communicator of the ranks sharing the current unit of work, i.e.
+    the ranks assigned the same object by the innermost parallel_objects
+    loop
+    """
+    return communication_system.communicators[-1]
+
+
+def is_root() -> bool:
+    """
+    Whether this is the root rank of the ranks sharing the current unit of
+    work
+    """
+    return communicator().rank == 0
+
+
+def size() -> int:
+    return communicator().size
+
+
+def broadcast(obj):
+    """
+    Sends the object from the root rank to every rank sharing the current
+    unit of work
+    """
+    return communicator().mpi_bcast(obj, root=0)
+
+
+def barrier():
+    communicator().barrier()
+
+
+def njobs(config) -> int:
+    """
+    The number of jobs to split the pipeline loops into. In distributed mode
+    every rank runs every step of the pipeline together, so that the sphere
+    samples can be partitioned across all of them, otherwise each rank takes
+    its own share of the objects.
+    """
+    logger = logging.getLogger(__name__ + "." + njobs.__name__)
+
+    if config.sampling.distributed:
+        logger.debug(f"Sharing the pipeline across {size()} ranks")
+        return 1
+
+    return 0
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+import scipy.stats
+from src.fitting import estimators
+
+
+def test_moments_match_numpy():
+    x = np.random.default_rng(1).gamma(2.0, size=1000)
+
+    moments = estimators.Moments.of(x)
+
+    assert moments.n == len(x)
+    assert moments.mean == pytest.approx(np.mean(x))
+    assert moments.variance == pytest.approx(np.var(x))
+    assert moments.skewness == pytest.approx(scipy.stats.skew(x))
+    assert moments.kurtosis == pytest.approx(scipy.stats.kurtosis(x))
+
+
+def test_moments_combine_batches():
+    x = np.random.default_rng(2).gamma(2.0, size=1000)
+
+    # Uneven batches, updated in turn and merged across "ranks"
+    a = estimators.Moments()
+    for batch in np.split(x[:600], [1, 50, 333]):
+        a.update(batch)
+    b = estimators.Moments.of(x[600:])
+    merged = a.merge(b).merge(estimators.Moments())
+
+    whole = estimators.Moments.of(x)
+    assert merged.n == whole.n
+    assert merged.mean == pytest.approx(whole.mean)
+    assert merged.variance == pytest.approx(whole.variance)
+    assert merged.skewness == pytest.approx(whole.skewness)
+    assert merged.kurtosis == pytest.approx(whole.kurtosis)
+
+
+def test_empty_moments():
+    moments = estimators.Moments.of([])
+
+    assert moments.n == 0
+    assert np.isnan(moments.variance)
+    assert np.isnan(moments.skewness)
+    assert moments.std_error() == np.inf
+
+
+def test_std_error_of_gaussian():
+    x = np.random.default_rng(3).normal(0.0, 2.0, 10000)
+
+    # sigma / sqrt(2 n) for a Gaussian
+    expected = 2.0 / np.sqrt(2 * len(x))
+    assert estimators.Moments.of(x).std_error() == \
+        pytest.approx(expected, rel=0.1)
+
+
+def test_skew_normal_mle_recovers_parameters():
+    xi, omega, alpha = 0.5, 2.0, 4.0
+    x = scipy.stats.skewnorm.rvs(alpha, loc=xi, scale=omega, size=20000,
+                                 random_state=4)
+
+    fit = estimators.skew_normal_mle(x)
+
+    assert fit == pytest.approx((xi, omega, alpha), rel=0.1)
+    assert estimators.skew_normal_std(fit[1], fit[2]) == \
+        pytest.approx(np.std(x), rel=1e-2)
+
+
+def test_skew_normal_mle_matches_scipy():
+    x = scipy.stats.skewnorm.rvs(-3.0, loc=1.0, scale=0.5, size=2000,
+                                 random_state=5)
+
+    xi, omega, alpha = estimators.skew_normal_mle(x)
+    ll = np.sum(scipy.stats.skewnorm.logpdf(x, alpha, xi, omega))
+
+    a, loc, scale = scipy.stats.skewnorm.fit(x)
+    scipy_ll = np.sum(scipy.stats.skewnorm.logpdf(x, a, loc, scale))
+
+    # At least as likely as scipy's (general purpose) fit
+    assert ll >= scipy_ll - 1e-6 * abs(scipy_ll)
+
+
+def test_bootstrap_std_error_of_gaussian():
+    x = np.random.default_rng(3).normal(0.0, 2.0, 10000)
+
+    expected = 2.0 / np.sqrt(2 * len(x))
+    assert estimators.bootstrap_std_error(x, seed=1) == \
+        pytest.approx(expected, rel=0.2)
+    assert estimators.bootstrap_std_error(x[:1]) == np.inf
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import scipy.optimize
+import scipy.stats
+
+# The fits module imports the mass functions, which need yt
+pytest.importorskip("yt")
+
+from src.fitting import fits, funcs  # noqa: E402
+
+
+def test_histogram_stack_matches_np_histogram():
+    rng = np.random.default_rng(1)
+    bins = np.linspace(-1, 2, 31)
+    deltas = [rng.normal(0.3, 0.6, n) for n in (0, 1, 100, 1000)]
+    # Values on (and just beyond) the edges of the bins
+    deltas.append(np.concatenate([bins, [-1.5, 2.5, np.nextafter(2, 3)]]))
+
+    counts = fits.histogram_stack(deltas, bins)
+
+    assert counts.shape == (len(deltas), len(bins) - 1)
+    for row, d in zip(counts, deltas):
+        np.testing.assert_array_equal(row, np.histogram(d, bins=bins)[0])
+
+
+def test_histogram_stack_no_rows():
+    bins = np.linspace(0, 1, 11)
+
+    assert fits.histogram_stack([], bins).shape == (0, 10)
+
+
+@pytest.mark.parametrize("func, p0", [
+    (funcs.gaussian, [1, 0, 0.01]),
+    (funcs.skew_gaussian, [1, 0, 1, 0, 0]),
+], ids=["gaussian", "skew_gaussian"])
+def test_joint_fit_matches_curve_fit(func, p0):
+    bins = np.linspace(-1, 2, 100)
+    bin_centres = (bins[:-1] + bins[1:]) / 2
+    deltas = [scipy.stats.skewnorm.rvs(3, loc=-0.3 * s, scale=s, size=5000,
+                                       random_state=i)
+              for i, s in enumerate([0.1, 0.2, 0.3, 0.5])]
+    hists = fits.histogram_stack(deltas, bins)
+
+    fitter = fits.Fits.__new__(fits.Fits)
+    fitter.func = func
+    jac = funcs.JACOBIANS[func.__name__]
+
+    popts = fitter._fit_batch(
+        bin_centres, hists, np.tile(np.array(p0, dtype=np.float64),
+                                    (len(hists), 1)), jac)
+
+    for hist, popt in zip(hists, popts):
+        expected, _ = scipy.optimize.curve_fit(
+            func, bin_centres, hist, p0=p0, jac=jac)
+
+        ss_res = np.sum((func(bin_centres, *popt) - hist)**2)
+        expected_ss_res = np.sum((func(bin_centres, *expected) - hist)**2)
+        assert ss_res == pytest.approx(expected_ss_res, rel=1e-4)
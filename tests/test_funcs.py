@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from scipy.integrate import quad
+from src.fitting import funcs
+
+PARAMS = {
+    funcs.gaussian: [(1.0, 0.5, 1.0), (2.0, -1.0, -0.5)],
+    funcs.skew_gaussian: [(1.0, 0.0, 2.0, 0.0, 1.0),
+                          (-1.5, 0.5, -3.0, 0.0, 2.0),
+                          # Negative offsets, clipped away from the peak
+                          (1.0, 0.0, 2.0, -0.05, 1.0),
+                          (0.8, 1.0, -1.0, -0.2, 0.5)],
+    funcs.n_gaussian: [(0.0, 1.0, 1.0, 2.0, 0.5, 0.3),
+                       # A negative component, so no closed form
+                       (0.0, 1.0, 1.0, 0.5, -0.2, 0.5)],
+}
+
+
+@pytest.mark.parametrize("func", list(PARAMS), ids=lambda f: f.__name__)
+def test_jacobians_match_finite_differences(func):
+    x = np.linspace(-3, 3, 25)
+    jac = funcs.JACOBIANS[func.__name__]
+
+    for params in PARAMS[func]:
+        p = np.array(params, dtype=np.float64)
+
+        numerical = np.empty((len(x), len(p)))
+        for i in range(len(p)):
+            h = 1e-6 * max(abs(p[i]), 1)
+            up, down = p.copy(), p.copy()
+            up[i] += h
+            down[i] -= h
+            numerical[:, i] = (func(x, *up) - func(x, *down)) / (2 * h)
+
+        np.testing.assert_allclose(jac(x, *p), numerical, rtol=1e-5,
+                                   atol=1e-7)
+
+
+def quad_tail(func, params, x0):
+    def integrand(x):
+        return funcs.filter_val(float(func(np.array([x]), *params)[0]))
+
+    # Split at the origin so the peaks aren't missed
+    points = sorted({x0, max(x0, 0.0)})
+    total = 0.0
+    for lo, hi in zip(points, points[1:] + [np.inf]):
+        total += quad(integrand, lo, hi, limit=200)[0]
+
+    return total
+
+
+@pytest.mark.parametrize("func", list(PARAMS), ids=lambda f: f.__name__)
+@pytest.mark.parametrize("x0", [-2.0, 0.0, 1.5])
+def test_tail_integrals_match_quad(func, x0):
+    params = PARAMS[func]
+
+    integrals = funcs.tail_integrals(func, params, x0)
+
+    expected = [quad_tail(func, p, x0) for p in params]
+    np.testing.assert_allclose(integrals, expected, rtol=1e-5, atol=1e-9)
+
+
+def test_grid_tail_integrals_match_quad():
+    params = np.array(PARAMS[funcs.skew_gaussian])
+
+    integrals = funcs._grid_tail_integrals(funcs.skew_gaussian, params, 0.5)
+
+    expected = [quad_tail(funcs.skew_gaussian, p, 0.5) for p in params]
+    np.testing.assert_allclose(integrals, expected, rtol=1e-4, atol=1e-9)
+
+
+def test_skew_gaussian_tail_ignores_positive_offset():
+    tail = funcs.skew_gaussian_tail(0.0, 1.0, 0.0, 2.0, 0.1, 1.0)
+
+    assert np.isfinite(tail)
+    assert tail == pytest.approx(
+        funcs.skew_gaussian_tail(0.0, 1.0, 0.0, 2.0, 0.0, 1.0))
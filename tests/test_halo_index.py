@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import unyt
+from src.cache.halo_index import HaloIndex
+
+BOX_SIZE = 10.0
+
+
+def periodic_dists(positions, centre):
+    d = positions - centre
+    d -= BOX_SIZE * np.round(d / BOX_SIZE)
+    return np.sqrt(np.sum(d**2, axis=1))
+
+
+@pytest.fixture
+def halos():
+    rng = np.random.default_rng(1)
+    positions = rng.uniform(0, BOX_SIZE, (500, 3))
+    masses = rng.uniform(1, 100, 500)
+    centres = np.vstack([rng.uniform(0, BOX_SIZE, (10, 3)),
+                         # Spheres crossing the periodic boundaries
+                         [[0.1, 0.1, 0.1], [9.9, 5.0, 0.2]]])
+
+    index = HaloIndex(unyt.unyt_array(positions, "Mpc"),
+                      unyt.unyt_array(masses, "Msun"),
+                      unyt.unyt_quantity(BOX_SIZE, "Mpc"))
+
+    return index, positions, masses, centres
+
+
+def test_query_matches_brute_force(halos):
+    index, positions, _, centres = halos
+    radius = 2.0
+
+    found = index.query(unyt.unyt_array(centres, "Mpc"),
+                        unyt.unyt_quantity(radius, "Mpc"))
+
+    for c, idxs in zip(centres, found):
+        expected = np.flatnonzero(periodic_dists(positions, c) <= radius)
+        np.testing.assert_array_equal(np.sort(idxs), expected)
+
+
+def test_query_sorted(halos):
+    index, positions, _, centres = halos
+
+    found = index.query_sorted(unyt.unyt_array(centres, "Mpc"),
+                               unyt.unyt_quantity(2.0, "Mpc"))
+
+    for c, (idxs, dists) in zip(centres, found):
+        assert np.all(np.diff(dists) >= 0)
+        np.testing.assert_allclose(dists, periodic_dists(positions[idxs], c))
+
+
+def test_sphere_masses(halos):
+    index, positions, masses, centres = halos
+    radius = 1.5
+
+    spheres = index.sphere_masses(unyt.unyt_array(centres, "Mpc"),
+                                  unyt.unyt_quantity(radius, "Mpc"))
+
+    expected = [np.sum(masses[periodic_dists(positions, c) <= radius])
+                for c in centres]
+    np.testing.assert_allclose(spheres.sums().to_value("Msun"), expected)
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import unyt
+from src.calc.histogram import LogHistogram
+
+
+def masses(seed):
+    rng = np.random.default_rng(seed)
+    # Including placeholder (zero) masses and masses outside of the edges
+    return np.concatenate([10**rng.uniform(9, 15, 1000), [0.0, 1e8, 1e16]])
+
+
+def test_add_matches_np_histogram():
+    m = masses(1)
+    hist = LogHistogram.from_range(1e10, 1e14, 20, "Msun")
+    hist.add(unyt.unyt_array(m, "Msun"), chunk_size=100)
+
+    positive = m[m > 0]
+    expected = np.histogram(positive, bins=hist.edges.value)[0]
+    np.testing.assert_array_equal(hist.counts, expected)
+
+    assert hist.num_skipped == 1
+    assert hist.num_masses == len(positive)
+    assert hist.num_outside == len(positive) - np.sum(expected)
+    assert hist.total == pytest.approx(np.sum(positive))
+    assert hist.min == np.min(positive)
+    assert hist.max == np.max(positive)
+
+
+def test_merge_matches_single_histogram():
+    m1, m2 = masses(1), masses(2)
+    volume = unyt.unyt_quantity(10.0, "Mpc**3")
+
+    h1 = LogHistogram.from_range(1e10, 1e14, 20, "Msun", volume).add(m1)
+    h2 = LogHistogram.from_range(1e10, 1e14, 20, "Msun", volume).add(m2)
+    both = LogHistogram.from_range(1e10, 1e14, 20, "Msun").add(
+        np.concatenate([m1, m2]))
+
+    merged = LogHistogram.reduce([h1, None, h2])
+
+    np.testing.assert_array_equal(merged.counts, both.counts)
+    assert merged.volume == 2 * volume
+    assert merged.num_masses == both.num_masses
+    assert merged.num_skipped == both.num_skipped
+    assert merged.total == pytest.approx(both.total)
+    assert merged.min == both.min
+    assert merged.max == both.max
+
+
+def test_merge_rejects_different_edges():
+    h1 = LogHistogram.from_range(1e10, 1e14, 20, "Msun")
+    h2 = LogHistogram.from_range(1e10, 1e14, 10, "Msun")
+
+    with pytest.raises(ValueError):
+        h1.merge(h2)
+
+
+def test_dict_round_trip():
+    hist = LogHistogram.from_range(
+        1e10, 1e14, 20, "Msun", unyt.unyt_quantity(10.0, "Mpc**3"))
+    hist.add(masses(1))
+
+    loaded = LogHistogram.from_dict(hist.to_dict())
+
+    np.testing.assert_allclose(loaded.edges.value, hist.edges.value)
+    assert loaded.edges.units == hist.edges.units
+    np.testing.assert_array_equal(loaded.counts, hist.counts)
+    assert loaded.volume == hist.volume
+    assert loaded.stats() == hist.stats()
@@ -0,0 +1,72 @@
+import numpy as np
+import unyt
+from src.cache.ragged import RaggedArray
+
+
+def rows():
+    return [np.array([1.0, 2.0]), np.array([]), np.array([3.0, 4.0, 5.0])]
+
+
+def test_from_rows():
+    a = RaggedArray.from_rows(rows())
+
+    assert len(a) == 3
+    np.testing.assert_array_equal(a.lengths, [2, 0, 3])
+    for row, expected in zip(a, rows()):
+        np.testing.assert_array_equal(row, expected)
+
+
+def test_sums_with_empty_rows():
+    a = RaggedArray.from_rows([np.array([]), *rows(), np.array([])])
+
+    np.testing.assert_array_equal(a.sums(), [0, 3, 0, 12, 0])
+
+
+def test_sums_keep_units():
+    a = RaggedArray.from_rows([unyt.unyt_array(r, "Msun") for r in rows()])
+
+    sums = a.sums()
+    assert sums.units == unyt.Unit("Msun")
+    np.testing.assert_array_equal(sums.value, [3, 0, 12])
+
+
+def test_select():
+    a = RaggedArray.from_rows(rows())
+    selected = a.select(a.values > 1.5)
+
+    expected = [r[r > 1.5] for r in rows()]
+    np.testing.assert_array_equal(selected.lengths, [1, 0, 3])
+    for row, e in zip(selected, expected):
+        np.testing.assert_array_equal(row, e)
+
+
+def test_concatenate():
+    a = RaggedArray.from_rows(rows())
+    b = RaggedArray.from_rows([np.array([6.0]), np.array([7.0, 8.0])])
+
+    joined = RaggedArray.concatenate([a, None, b])
+
+    expected = rows() + [np.array([6.0]), np.array([7.0, 8.0])]
+    assert len(joined) == len(expected)
+    for row, e in zip(joined, expected):
+        np.testing.assert_array_equal(row, e)
+
+
+def test_concatenate_converts_units():
+    a = RaggedArray.from_rows([unyt.unyt_array([1.0], "Msun")])
+    b = RaggedArray.from_rows([unyt.unyt_array([2.0], "kg")])
+
+    joined = RaggedArray.concatenate([a, b])
+
+    assert joined.units == unyt.Unit("Msun")
+    kg = unyt.unyt_quantity(2.0, "kg").to_value("Msun")
+    np.testing.assert_allclose(joined.sums().value, [1.0, kg])
+
+
+def test_slice():
+    a = RaggedArray.from_rows(rows())
+
+    sliced = a[1:]
+    assert len(sliced) == 2
+    np.testing.assert_array_equal(sliced.lengths, [0, 3])
+    np.testing.assert_array_equal(sliced[1], rows()[2])